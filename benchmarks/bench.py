@@ -0,0 +1,242 @@
+"""
+End-to-end load benchmark for the WiZ and servo MCP servers against the local simulators.
+
+Each scenario calls an MCP tool through the server's own tool manager (argument
+validation included) at increasing concurrency and reports throughput and p50/p99
+latency. Results are written as JSON tagged with the git commit, so runs can be
+compared across commits:
+
+    python benchmarks/bench.py --output bench_output.json
+    python benchmarks/bench.py --baseline bench_output.json
+
+Each run also checks every server's import time against its startup budget (see
+startup.py) and exits non-zero if one is over.
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+import startup
+from simulators import ESP32Simulator, WizSimulator
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def start_simulators(args):
+    """Run the simulators on their own event loop thread so they don't share the client's loop."""
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+
+    async def start():
+        wiz = await WizSimulator(args.bulbs, args.latency_ms, args.jitter_ms, args.loss).start()
+        esp32 = await ESP32Simulator(latency_ms=args.latency_ms, loss=args.loss, press_delay_ms=args.press_delay_ms).start()
+        return wiz, esp32
+
+    wiz, esp32 = asyncio.run_coroutine_threadsafe(start(), loop).result()
+    return loop, wiz, esp32
+
+
+def load_server(relative_dir: str, module: str):
+    sys.path.insert(0, os.path.join(ROOT, relative_dir))
+    return importlib.import_module(module)
+
+
+def result_text(result):
+    if isinstance(result, tuple):
+        result = result[0]
+    if isinstance(result, dict):
+        return json.dumps(result)
+    return " ".join(getattr(block, "text", "") for block in result)
+
+
+def is_error(text: str):
+    if text.startswith("Error"):
+        return True
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return False
+    # toggle_switch reports ok=False; group commands report a failed count
+    return isinstance(data, dict) and (data.get("ok") is False or bool(data.get("failed")))
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+async def run_level(server, tool, make_args, concurrency, requests):
+    latencies = []
+    errors = 0
+    counter = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            start = time.perf_counter()
+            try:
+                text = result_text(await server.mcp.call_tool(tool, make_args(i)))
+                failed = is_error(text)
+            except Exception:
+                failed = True
+            latencies.append(time.perf_counter() - start)
+            errors += failed
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return {
+        "concurrency": concurrency,
+        "elapsed_s": round(elapsed, 3),
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "mean_ms": round(statistics.mean(latencies) * 1000, 2),
+    }
+
+
+def actuations(queue, before, level):
+    """
+    What the servo actually did during a level. Above concurrency 1 most toggle_switch
+    calls are coalesced into another caller's press, so request throughput measures
+    the queue; presses per second is the actuation throughput.
+    """
+    after = queue.stats()
+    presses = after["presses"] - before["presses"]
+    return {
+        "presses": presses,
+        "actuation_rps": round(presses / level["elapsed_s"], 1) if level["elapsed_s"] else None,
+        "coalesced": after["coalesced"] - before["coalesced"],
+        "superseded": after["superseded"] - before["superseded"],
+    }
+
+
+def scenarios(wiz_ips, wiz, servo):
+    def color(i):
+        return {"r": random.randint(0, 255), "g": random.randint(0, 255), "b": random.randint(0, 255)}
+
+    return {
+        "wiz.set_color": (wiz, "set_color", lambda i: {**color(i), "ip_address": wiz_ips[i % len(wiz_ips)]}),
+        "wiz.get_status": (wiz, "get_status", lambda i: {"ip_address": wiz_ips[i % len(wiz_ips)]}),
+        "wiz.group_set_color": (wiz, "group_set_color", lambda i: {"group": "bench", **color(i)}),
+        "servo.toggle_switch": (servo, "toggle_switch", lambda i: {"state": "on" if i % 2 else "off"}),
+        # force skips the no-op check, so every batch of coalesced requests is a real press
+        "servo.toggle_forced": (servo, "toggle_switch", lambda i: {"state": "on" if i % 2 else "off", "force": True}),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_table(results, baseline=None):
+    previous = {(r["scenario"], r["concurrency"]): r for r in (baseline or {}).get("results", [])}
+    print(f"{'scenario':<22}{'conc':>6}{'req':>6}{'err':>5}{'rps':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    for r in results:
+        line = f"{r['scenario']:<22}{r['concurrency']:>6}{r['requests']:>6}{r['errors']:>5}{r['throughput_rps']:>10}{r['p50_ms']:>10}{r['p99_ms']:>10}"
+        old = previous.get((r["scenario"], r["concurrency"]))
+        if old and old["throughput_rps"]:
+            line += f"   rps {100 * (r['throughput_rps'] / old['throughput_rps'] - 1):+.0f}%  p99 {100 * (r['p99_ms'] / old['p99_ms'] - 1):+.0f}%"
+        print(line)
+        if "presses" in r:
+            print(f"{'':<28}(servo: {r['presses']} presses, {r['actuation_rps']}/s; "
+                  f"{r['coalesced']} coalesced, {r['superseded']} superseded)")
+
+
+async def main(args):
+    startup_results = None
+    if not args.skip_startup:
+        startup_results = startup.profile(runs=3)
+        startup.print_profile(startup_results)
+        print()
+
+    loop, wiz_sim, esp32_sim = start_simulators(args)
+    os.environ.update({
+        "WIZ_BULB_IP": wiz_sim.ips[0],
+        "WIZ_GROUPS": "bench=" + ",".join(wiz_sim.ips),
+        "WIZ_PUSH_UPDATES": "false",
+        "WIZ_DISCOVERY_INTERVAL": "0",
+        "ESP32_IP": esp32_sim.address,
+    })
+    wiz = load_server("mcp_servers/wiz_bulb", "wiz_server")
+    servo = load_server("mcp_servers/servo", "servo_mcp")
+
+    selected = scenarios(wiz_sim.ips, wiz, servo)
+    if args.scenarios:
+        selected = {name: selected[name] for name in args.scenarios.split(",")}
+    levels = [int(c) for c in args.concurrency.split(",")]
+
+    results = []
+    for name, (server, tool, make_args) in selected.items():
+        requests = args.servo_requests if name.startswith("servo.") else args.requests
+        for concurrency in levels:
+            before = servo.switch_queue.stats() if server is servo else None
+            level = await run_level(server, tool, make_args, concurrency, requests)
+            if before:
+                level.update(actuations(servo.switch_queue, before, level))
+            results.append({"scenario": name, **level})
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {
+            key: getattr(args, key)
+            for key in ("bulbs", "latency_ms", "jitter_ms", "loss", "press_delay_ms", "requests", "servo_requests", "concurrency")
+        },
+        "results": results,
+        "startup": startup_results,
+        "simulators": {"wiz": wiz_sim.stats(), "esp32": esp32_sim.stats()},
+    }
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print(f"Comparing against {baseline.get('commit')} ({baseline.get('timestamp')})")
+    print_table(results, baseline)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.output}")
+
+    await wiz.registry.close()
+    if servo.http_client:
+        await servo.http_client.aclose()
+    loop.call_soon_threadsafe(loop.stop)
+
+    over_budget = [r["server"] for r in startup_results or [] if r["over_budget"]]
+    if over_budget:
+        print(f"Startup budget exceeded: {', '.join(over_budget)}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the MCP servers against local device simulators.")
+    parser.add_argument("--bulbs", type=int, default=4)
+    parser.add_argument("--latency-ms", type=float, default=5.0)
+    parser.add_argument("--jitter-ms", type=float, default=1.0)
+    parser.add_argument("--loss", type=float, default=0.0)
+    parser.add_argument("--press-delay-ms", type=float, default=50.0)
+    parser.add_argument("--requests", type=int, default=200, help="Requests per concurrency level")
+    parser.add_argument("--servo-requests", type=int, default=40, help="Requests per level for servo scenarios")
+    parser.add_argument("--concurrency", default="1,4,16,64")
+    parser.add_argument("--scenarios", help="Comma-separated subset, e.g. wiz.set_color,servo.toggle_switch")
+    parser.add_argument("--output", help="Write results as JSON")
+    parser.add_argument("--baseline", help="Previous JSON output to compare against")
+    parser.add_argument("--skip-startup", action="store_true", help="Don't check server import times against their budgets")
+    random.seed(0)
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,90 @@
+"""
+Frame-rate benchmark for WiZ frame effects (manual_strobe, flash_bulb) against the
+simulated bulbs: pywizlight (send, wait for the ack, retry) versus the fast UDP path
+with and without pipelining. For each requested strobe rate it reports the achieved
+rate, skipped frames, timing jitter and, for the fast path, lost acks:
+
+    python benchmarks/effects.py
+    python benchmarks/effects.py --latency-ms 20 --loss 0.02 --hz 10,25,50,100 --output effects.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+from bench import ROOT, git_commit, load_server, start_simulators
+
+MODES = {
+    "pywizlight": {"fast": False},
+    "udp": {"fast": True, "pipeline": False},
+    "udp_pipelined": {"fast": True, "pipeline": True},
+}
+
+
+async def run(args, wiz, ip):
+    from pywizlight import PilotBuilder
+    light = await wiz.get_light(ip)
+    pilots = [PilotBuilder(rgb=(255, 255, 255)), None]
+    results = []
+    for hz in (float(h) for h in args.hz.split(",")):
+        for mode, options in MODES.items():
+            if args.modes and mode not in args.modes.split(","):
+                continue
+            period = 1.0 / hz / 2.0
+            frames = int(args.duration * hz) * 2
+            result = await wiz.play_frames(light, pilots, period, frames, **options)
+            results.append({"mode": mode, "target_hz": hz, **{k: v for k, v in result.items() if k != "target_hz"}})
+            await asyncio.sleep(0.2)
+    return results
+
+
+def print_table(results):
+    print(f"{'mode':<16}{'target hz':>10}{'achieved':>10}{'skipped':>9}{'jitter ms':>11}{'cmd ms':>8}{'lost':>6}")
+    for r in results:
+        lost = r.get("lost")
+        print(
+            f"{r['mode']:<16}{r['target_hz']:>10}{r['achieved_hz']:>10}{r['frames_skipped']:>9}"
+            f"{r['jitter_ms'] if r['jitter_ms'] is not None else '-':>11}{r['avg_command_ms'] if r['avg_command_ms'] is not None else '-':>8}"
+            f"{lost if lost is not None else '-':>6}"
+        )
+
+
+async def main(args):
+    loop, wiz_sim, _ = start_simulators(args)
+    os.environ.update({
+        "WIZ_BULB_IP": wiz_sim.ips[0],
+        "WIZ_PUSH_UPDATES": "false",
+        "WIZ_DISCOVERY_INTERVAL": "0",
+    })
+    wiz = load_server("mcp_servers/wiz_bulb", "wiz_server")
+    results = await run(args, wiz, wiz_sim.ips[0])
+    print_table(results)
+    if args.output:
+        report = {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "config": {key: getattr(args, key) for key in ("latency_ms", "jitter_ms", "loss", "duration", "hz")},
+            "results": results,
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.output}")
+    wiz.udp.close()
+    await wiz.registry.close()
+    loop.call_soon_threadsafe(loop.stop)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare strobe frame rates of pywizlight and the fast UDP path.")
+    parser.add_argument("--latency-ms", type=float, default=5.0)
+    parser.add_argument("--jitter-ms", type=float, default=1.0)
+    parser.add_argument("--loss", type=float, default=0.0)
+    parser.add_argument("--hz", default="5,20,50,100", help="Comma-separated strobe rates (on/off cycles per second)")
+    parser.add_argument("--duration", type=float, default=2.0, help="Seconds per rate and mode")
+    parser.add_argument("--modes", help="Comma-separated subset of " + ",".join(MODES))
+    parser.add_argument("--output", help="Write results as JSON")
+    args = parser.parse_args()
+    args.bulbs, args.press_delay_ms = 1, 0.0
+    sys.exit(asyncio.run(main(args)))
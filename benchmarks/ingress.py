@@ -0,0 +1,154 @@
+"""
+Ingress latency of the Telegram gateway with long polling versus the webhook listener.
+
+Runs the gateway against TelegramSimulator (a local fake Bot API, with a canned
+Archestra reply) and, for each mode, sends user messages one at a time, measuring
+from the moment a message reaches "Telegram" to the gateway's "Thinking..."
+placeholder arriving back. In webhook mode it also reports how long the listener
+took to acknowledge each delivery, and checks that a wrong secret token is refused:
+
+    python benchmarks/ingress.py
+    python benchmarks/ingress.py --latency-ms 80 --messages 50 --output ingress.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from bench import ROOT, git_commit
+from simulators import TelegramSimulator
+
+CHAT_ID = 4242
+
+
+class Backend(TelegramSimulator):
+    """The fake Bot API, also answering the gateway's Archestra A2A requests with a canned reply."""
+
+    async def handle(self, target, headers, body):
+        if target.startswith("/v1/a2a/"):
+            return "200 OK", {"jsonrpc": "2.0", "id": 1, "result": {"parts": [{"kind": "text", "text": "ok"}]}}
+        return await super().handle(target, headers, body)
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else None
+
+
+def summary(values):
+    ms = [v * 1000 for v in values]
+    if not ms:
+        return {}
+    return {
+        "p50_ms": round(statistics.median(ms), 2),
+        "p95_ms": round(percentile(ms, 0.95), 2),
+        "max_ms": round(max(ms), 2),
+        "mean_ms": round(statistics.fmean(ms), 2),
+    }
+
+
+async def run_mode(args, mode: str):
+    sim = await Backend(port=args.port, latency_ms=args.latency_ms).start()
+    webhook_url = f"http://127.0.0.1:{args.webhook_port}/telegram" if mode == "webhook" else ""
+    secret = "bench-secret"
+    env = dict(
+        os.environ,
+        TELEGRAM_BOT_TOKEN="123456:bench",
+        TELEGRAM_CHAT_ID=str(CHAT_ID),
+        TELEGRAM_API_URL=sim.base_url,
+        ARCHESTRA_AGENT_ID="bench",
+        ARCHESTRA_API_KEY="bench",
+        ARCHESTRA_BASE_URL=f"http://127.0.0.1:{args.port}",
+        ARCHESTRA_STREAMING="false",
+        GATEWAY_FAST_PATH="false",
+        GATEWAY_WEBHOOK_URL=webhook_url,
+        GATEWAY_WEBHOOK_LISTEN="127.0.0.1",
+        GATEWAY_WEBHOOK_PORT=str(args.webhook_port),
+        GATEWAY_WEBHOOK_SECRET=secret,
+        GATEWAY_LOG_FILE=os.path.join(tempfile.gettempdir(), "ingress_gateway.log"),
+        GATEWAY_LOG_LEVEL="WARNING",
+        TRACING="false",
+    )
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, os.path.join(ROOT, "mcp_servers/telegram/telegram_gateway.py"),
+        cwd=tempfile.gettempdir(), env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    result = {"mode": mode}
+    try:
+        deadline = time.monotonic() + 20
+        while not (sim.webhook if mode == "webhook" else sim.polls):
+            if process.returncode is not None or time.monotonic() > deadline:
+                raise RuntimeError(f"gateway did not start in {mode} mode")
+            await asyncio.sleep(0.05)
+        await asyncio.sleep(0.5)
+        if mode == "webhook":
+            async with httpx.AsyncClient() as client:
+                response = await client.post(webhook_url, json={"update_id": 0}, headers={"X-Telegram-Bot-Api-Secret-Token": "wrong"})
+            result["wrong_secret_status"] = response.status_code
+
+        latencies = []
+        for _ in range(args.messages):
+            placeholders = sum(c[1] == "sendMessage" for c in sim.calls)
+            replies = sum(c[1] == "editMessageText" for c in sim.calls)
+            started = time.perf_counter()
+            await sim.send_text(CHAT_ID, "hello")
+            arrived, _, _ = await sim.wait_for("sendMessage", placeholders)
+            latencies.append(arrived - started)
+            await sim.wait_for("editMessageText", replies)
+            # Land messages at different points of the long-poll cycle
+            await asyncio.sleep(random.uniform(0, args.interval))
+        result.update(summary(latencies), messages=len(latencies))
+        if sim.acks:
+            result["ack"] = summary(sim.acks)
+        result["bot_api_requests"] = sim.requests
+    finally:
+        if process.returncode is None:
+            process.terminate()
+            await process.wait()
+        await sim.stop()
+    return result
+
+
+def print_table(results):
+    print(f"{'mode':<10}{'p50 ms':>9}{'p95 ms':>9}{'max ms':>9}{'ack p50 ms':>12}{'api reqs':>10}")
+    for r in results:
+        ack = r.get("ack", {}).get("p50_ms")
+        print(f"{r['mode']:<10}{r['p50_ms']:>9}{r['p95_ms']:>9}{r['max_ms']:>9}{ack if ack is not None else '-':>12}{r['bot_api_requests']:>10}")
+    for r in results:
+        if "wrong_secret_status" in r:
+            print(f"Wrong secret token answered with HTTP {r['wrong_secret_status']}")
+
+
+async def main(args):
+    results = [await run_mode(args, mode) for mode in args.modes.split(",")]
+    print_table(results)
+    if args.output:
+        report = {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "config": {key: getattr(args, key) for key in ("latency_ms", "messages", "interval")},
+            "results": results,
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare gateway ingress latency with long polling and the webhook.")
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="Round trip to the fake Telegram")
+    parser.add_argument("--messages", type=int, default=20, help="Messages per mode")
+    parser.add_argument("--interval", type=float, default=0.3, help="Up to this many seconds between messages")
+    parser.add_argument("--modes", default="polling,webhook")
+    parser.add_argument("--port", type=int, default=18081, help="Fake Bot API port")
+    parser.add_argument("--webhook-port", type=int, default=18443, help="Gateway webhook listener port")
+    parser.add_argument("--output", help="Write results as JSON")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,402 @@
+"""
+Local stand-ins for the hardware, so the MCP servers can be benchmarked without a LAN.
+
+WizSimulator answers the UDP JSON protocol pywizlight speaks (setPilot, getPilot,
+getSystemConfig, getModelConfig, registration) on port 38899. Each simulated bulb
+binds its own loopback address (127.0.0.2, 127.0.0.3, ...), which works out of the
+box on Linux.
+
+ESP32Simulator serves the firmware's HTTP endpoints (/ and /toggle?state=on|off) and,
+like the real board, handles one request at a time and blocks for the press delay.
+
+TelegramSimulator is a fake Bot API (base URL http://host:port/bot) for the gateway:
+getUpdates long polling, setWebhook with delivery to the registered URL and secret
+token, and sendMessage/editMessageText, which it records with their arrival times.
+
+Run standalone:
+    python benchmarks/simulators.py --bulbs 4 --latency-ms 20 --loss 0.01 --press-delay-ms 300
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from urllib.parse import parse_qs, urlsplit
+
+WIZ_PORT = 38899
+
+
+class WizBulbProtocol(asyncio.DatagramProtocol):
+    """One simulated bulb."""
+
+    def __init__(self, mac: str, latency: float, jitter: float, loss: float):
+        self.mac = mac
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.transport = None
+        self.pilot = {"state": False, "sceneId": 0, "temp": 2700, "dimming": 100}
+        self.received = 0
+        self.dropped = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.received += 1
+        if random.random() < self.loss:
+            self.dropped += 1
+            return
+        try:
+            request = json.loads(data.decode())
+        except ValueError:
+            return
+        response = self.handle(request)
+        delay = max(0.0, self.latency + random.uniform(-self.jitter, self.jitter))
+        payload = json.dumps(response).encode()
+        asyncio.get_running_loop().call_later(delay, self._send, payload, addr)
+
+    def _send(self, payload, addr):
+        if self.transport and not self.transport.is_closing():
+            self.transport.sendto(payload, addr)
+
+    def handle(self, request: dict):
+        method = request.get("method")
+        params = request.get("params") or {}
+        if method in ("setPilot", "setState"):
+            if any(key in params for key in ("r", "g", "b", "temp", "sceneId")):
+                for key in ("r", "g", "b", "w", "c", "temp", "sceneId", "speed"):
+                    self.pilot.pop(key, None)
+            self.pilot.update(params)
+            return {"method": method, "env": "pro", "result": {"success": True}}
+        if method == "getPilot":
+            return {"method": method, "env": "pro", "result": {"mac": self.mac, "rssi": -55, **self.pilot}}
+        if method == "getSystemConfig":
+            return {
+                "method": method,
+                "env": "pro",
+                "result": {"mac": self.mac, "moduleName": "ESP01_SHRGB1C_31", "fwVersion": "1.25.0", "typeId": 0},
+            }
+        if method == "getModelConfig":
+            # Read once by pywizlight's updateState() to learn the bulb type
+            return {"method": method, "env": "pro", "result": {"cctRange": [2200, 2700, 6500, 6500], "wcr": 30, "nowc": 1}}
+        if method == "registration":
+            return {"method": method, "env": "pro", "result": {"mac": self.mac, "success": True}}
+        return {"method": method, "env": "pro", "error": {"code": -32601, "message": "Method not found"}}
+
+
+class WizSimulator:
+    """A set of simulated bulbs on consecutive loopback addresses."""
+
+    def __init__(self, bulbs: int = 1, latency_ms: float = 5.0, jitter_ms: float = 0.0, loss: float = 0.0, first_ip: int = 2):
+        self.ips = [f"127.0.0.{first_ip + i}" for i in range(bulbs)]
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.loss = loss
+        self.protocols = {}
+        self.transports = []
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        for i, ip in enumerate(self.ips):
+            mac = f"a8bb50{i:06x}"
+            transport, protocol = await loop.create_datagram_endpoint(
+                lambda mac=mac: WizBulbProtocol(mac, self.latency, self.jitter, self.loss),
+                local_addr=(ip, WIZ_PORT),
+            )
+            self.transports.append(transport)
+            self.protocols[ip] = protocol
+        return self
+
+    def stats(self):
+        return {
+            ip: {"received": p.received, "dropped": p.dropped, "state": p.pilot.get("state")}
+            for ip, p in self.protocols.items()
+        }
+
+    async def stop(self):
+        for transport in self.transports:
+            transport.close()
+
+
+class ESP32Simulator:
+    """HTTP/1.1 stand-in for the ESP32 servo controller firmware."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 18080, latency_ms: float = 5.0, loss: float = 0.0, press_delay_ms: float = 300.0):
+        self.host = host
+        self.port = port
+        self.latency = latency_ms / 1000
+        self.loss = loss
+        self.press_delay = press_delay_ms / 1000
+        # The firmware's loop() serves one client at a time and blocks while pressing
+        self.busy = asyncio.Lock()
+        self.server = None
+        self.state = None
+        self.presses = 0
+        self.requests = 0
+        self.dropped = 0
+
+    @property
+    def address(self):
+        return f"{self.host}:{self.port}"
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._serve, self.host, self.port)
+        return self
+
+    async def _serve(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                keep_alive = True
+                while True:
+                    header = await reader.readline()
+                    if header in (b"\r\n", b"\n", b""):
+                        break
+                    if header.lower().startswith(b"connection:") and b"close" in header.lower():
+                        keep_alive = False
+                self.requests += 1
+                if random.random() < self.loss:
+                    self.dropped += 1
+                    break
+                async with self.busy:
+                    await asyncio.sleep(self.latency)
+                    status, content_type, body = await self.handle(request_line.decode().split(" ")[1])
+                writer.write(
+                    f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + body
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, IndexError):
+            pass
+        finally:
+            writer.close()
+
+    async def handle(self, target: str):
+        url = urlsplit(target)
+        if url.path == "/":
+            return "200 OK", "text/html", b"<h1>Servo Switch Controller</h1>"
+        if url.path != "/toggle":
+            return "404 Not Found", "text/plain", b"Not found"
+        state = parse_qs(url.query).get("state", [None])[0]
+        if state is None:
+            return "400 Bad Request", "text/plain", b"Missing 'state'"
+        if state not in ("on", "off"):
+            return "400 Bad Request", "text/plain", b"Invalid state. Use 'on' or 'off'."
+        await asyncio.sleep(self.press_delay)
+        self.state = state
+        self.presses += 1
+        body = json.dumps({"status": "ok", "state": state, "message": f"Switched {state.upper()}"})
+        return "200 OK", "application/json", body.encode()
+
+    def stats(self):
+        return {"requests": self.requests, "presses": self.presses, "dropped": self.dropped, "state": self.state}
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+
+
+class TelegramSimulator:
+    """Fake Telegram Bot API: inject user messages with send_text(), read the bot's calls from .calls."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 18081, latency_ms: float = 50.0):
+        self.host = host
+        self.port = port
+        self.latency = latency_ms / 1000
+        self.server = None
+        self.client = None
+        self.updates = []  # pending for getUpdates
+        self.next_update_id = 1
+        self.next_message_id = 1
+        self.webhook = None  # (url, secret token) while a webhook is set
+        self.webhook_error = None  # (unix time, description) of the last failed delivery
+        self.arrived = asyncio.Condition()
+        self.calls = []  # (perf_counter, method, params) for every sendMessage/editMessageText
+        self.acks = []  # seconds each webhook delivery took to be acknowledged
+        self.polls = 0
+        self.requests = 0
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}/bot"
+
+    async def start(self):
+        import httpx
+        self.client = httpx.AsyncClient(timeout=10.0)
+        self.server = await asyncio.start_server(self._serve, self.host, self.port)
+        return self
+
+    async def _serve(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    header = await reader.readline()
+                    if header in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = header.decode().partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                self.requests += 1
+                # Half the round trip each way, so a long poll answered by a new update pays one way too
+                await asyncio.sleep(self.latency / 2)
+                status, payload = await self.handle(request_line.decode().split(" ")[1], headers, body)
+                await asyncio.sleep(self.latency / 2)
+                data = json.dumps(payload).encode()
+                writer.write(
+                    f"HTTP/1.1 {status}\r\nContent-Type: application/json\r\nContent-Length: {len(data)}\r\n"
+                    f"Connection: keep-alive\r\n\r\n".encode() + data
+                )
+                await writer.drain()
+        except (ConnectionError, IndexError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            # Cancelled: a long poll still waiting when the simulator stops
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    def params(headers, body):
+        if headers.get("content-type", "").startswith("application/json"):
+            return json.loads(body or b"{}")
+        # python-telegram-bot posts form fields, JSON-encoding everything that isn't a string
+        params = {}
+        for key, values in parse_qs(body.decode()).items():
+            try:
+                params[key] = json.loads(values[0])
+            except ValueError:
+                params[key] = values[0]
+        return params
+
+    async def handle(self, target: str, headers: dict, body: bytes):
+        method = urlsplit(target).path.rsplit("/", 1)[-1]
+        params = self.params(headers, body)
+        if method == "getMe":
+            return "200 OK", {"ok": True, "result": {"id": 1, "is_bot": True, "first_name": "Sim", "username": "sim_bot"}}
+        if method == "setWebhook":
+            self.webhook = (params["url"], params.get("secret_token"))
+            return "200 OK", {"ok": True, "result": True}
+        if method == "deleteWebhook":
+            self.webhook = None
+            if params.get("drop_pending_updates"):
+                self.updates.clear()
+            return "200 OK", {"ok": True, "result": True}
+        if method == "getWebhookInfo":
+            info = {"url": self.webhook[0] if self.webhook else "", "has_custom_certificate": False, "pending_update_count": len(self.updates)}
+            if self.webhook_error:
+                info.update(last_error_date=int(self.webhook_error[0]), last_error_message=self.webhook_error[1])
+            return "200 OK", {"ok": True, "result": info}
+        if method == "getUpdates":
+            if self.webhook:
+                return "409 Conflict", {"ok": False, "error_code": 409, "description": "Conflict: can't use getUpdates method while webhook is active"}
+            return "200 OK", {"ok": True, "result": await self.get_updates(int(params.get("offset") or 0), float(params.get("timeout") or 0))}
+        if method in ("sendMessage", "editMessageText"):
+            return "200 OK", {"ok": True, "result": await self.record(method, params)}
+        return "200 OK", {"ok": True, "result": True}
+
+    async def get_updates(self, offset: int, timeout: float):
+        self.polls += 1
+        self.updates = [u for u in self.updates if u["update_id"] >= offset]
+        if not self.updates:
+            async with self.arrived:
+                try:
+                    await asyncio.wait_for(self.arrived.wait_for(lambda: self.updates), timeout)
+                except asyncio.TimeoutError:
+                    pass
+        return list(self.updates)
+
+    async def record(self, method: str, params: dict):
+        async with self.arrived:
+            self.calls.append((time.perf_counter(), method, params))
+            self.arrived.notify_all()
+        if method == "sendMessage":
+            message_id = self.next_message_id
+            self.next_message_id += 1
+        else:
+            message_id = int(params["message_id"])
+        return {
+            "message_id": message_id, "date": int(time.time()), "text": params.get("text", ""),
+            "chat": {"id": int(params["chat_id"]), "type": "private"},
+            "from": {"id": 1, "is_bot": True, "first_name": "Sim"},
+        }
+
+    async def send_text(self, chat_id: int, text: str):
+        """A user message to the bot: pushed to the webhook if one is set, else queued for getUpdates."""
+        message_id = self.next_message_id
+        self.next_message_id += 1
+        update = {
+            "update_id": self.next_update_id,
+            "message": {
+                "message_id": message_id, "date": int(time.time()), "text": text,
+                "chat": {"id": chat_id, "type": "private"},
+                "from": {"id": chat_id, "is_bot": False, "first_name": "User"},
+            },
+        }
+        self.next_update_id += 1
+        if self.webhook:
+            asyncio.create_task(self.deliver(update))
+        else:
+            async with self.arrived:
+                self.updates.append(update)
+                self.arrived.notify_all()
+        return update
+
+    async def deliver(self, update):
+        url, secret = self.webhook
+        await asyncio.sleep(self.latency / 2)
+        started = time.perf_counter()
+        try:
+            response = await self.client.post(url, json=update, headers={"X-Telegram-Bot-Api-Secret-Token": secret or ""})
+            response.raise_for_status()
+            self.acks.append(time.perf_counter() - started)
+        except Exception as e:
+            # Telegram keeps the update and reports the failure in getWebhookInfo
+            self.webhook_error = (time.time(), str(e) or type(e).__name__)
+            self.updates.append(update)
+
+    async def wait_for(self, method: str, count: int, timeout: float = 10.0):
+        """Wait until .calls holds more than `count` calls of method; returns the newest one."""
+        async with self.arrived:
+            await asyncio.wait_for(self.arrived.wait_for(lambda: sum(c[1] == method for c in self.calls) > count), timeout)
+            return [c for c in self.calls if c[1] == method][-1]
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+        if self.client:
+            await self.client.aclose()
+
+
+async def main(args):
+    wiz = await WizSimulator(args.bulbs, args.latency_ms, args.jitter_ms, args.loss).start()
+    esp32 = await ESP32Simulator(port=args.esp32_port, latency_ms=args.latency_ms, loss=args.loss, press_delay_ms=args.press_delay_ms).start()
+    print(f"WiZ bulbs listening on {', '.join(wiz.ips)} (UDP {WIZ_PORT})")
+    print(f"ESP32 listening on http://{esp32.address}")
+    print(f"Point the servers at them with WIZ_BULB_IP={wiz.ips[0]} ESP32_IP={esp32.address}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await wiz.stop()
+        await esp32.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run local WiZ bulb and ESP32 simulators.")
+    parser.add_argument("--bulbs", type=int, default=4)
+    parser.add_argument("--latency-ms", type=float, default=5.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--loss", type=float, default=0.0, help="Probability (0-1) a request is dropped")
+    parser.add_argument("--press-delay-ms", type=float, default=300.0)
+    parser.add_argument("--esp32-port", type=int, default=18080)
+    try:
+        asyncio.run(main(parser.parse_args()))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,142 @@
+"""
+Startup profiling for the MCP servers and the gateway.
+
+For each server this runs `python -X importtime -c "import <module>"` in a fresh
+interpreter and reports the module's cumulative import time and its heaviest
+direct imports. With --ready it also launches the server over streamable HTTP and
+times how long it takes to answer an MCP handshake, the same check the supervisor
+in run_mcp_servers.py uses. Import times are compared against STARTUP_BUDGET_MS:
+
+    python benchmarks/startup.py
+    python benchmarks/startup.py --ready --top 10
+
+bench.py runs the import check too and fails when a server is over budget.
+"""
+import argparse
+import asyncio
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from run_mcp_servers import probe_mcp  # noqa: E402
+
+# (name, directory, module, port used for the --ready check)
+SERVERS = [
+    ("wiz", "mcp_servers/wiz_bulb", "wiz_server", 18101),
+    ("timekeeper", "mcp_servers/timekeeper", "timekeeper", 18102),
+    ("telegram", "mcp_servers/telegram", "telegram_bot", 18103),
+    ("servo", "mcp_servers/servo", "servo_mcp", 18104),
+    ("gateway", "mcp_servers/telegram", "telegram_gateway", None),
+]
+
+# Import-time budgets in milliseconds. The MCP SDK alone accounts for most of a
+# FastMCP server's import; the gateway doesn't load it until a fast-path command.
+STARTUP_BUDGET_MS = {
+    "wiz": 1100,
+    "timekeeper": 1100,
+    "telegram": 1100,
+    "servo": 1100,
+    "gateway": 450,
+}
+
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)")
+
+def profile_imports(directory: str, module: str):
+    """One -X importtime run: (total ms, {direct import: cumulative ms})."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=os.path.join(ROOT, directory),
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+    total = None
+    children = {}
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if not match:
+            continue
+        _, cumulative, indent, name = match.groups()
+        if name == module and not indent:
+            total = int(cumulative) / 1000
+        elif len(indent) == 2:
+            # Direct imports of the module are one level (two spaces) below it
+            children[name] = int(cumulative) / 1000
+    return total, children
+
+async def measure_ready(directory: str, module: str, port: int, timeout: float = 30.0):
+    """Seconds from launching the server to a successful MCP handshake on its port."""
+    env = dict(os.environ, WIZ_DISCOVERY_INTERVAL="0", TIMEKEEPER_DB=os.path.join(tempfile.gettempdir(), "startup_profile.db"))
+    started = time.monotonic()
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, os.path.join(ROOT, directory, f"{module}.py"), "--transport", "streamable-http", "--port", str(port),
+        cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        async with httpx.AsyncClient(timeout=2.0) as client:
+            while time.monotonic() - started < timeout:
+                if process.returncode is not None:
+                    return None
+                if await probe_mcp(client, port):
+                    return round(time.monotonic() - started, 3)
+                await asyncio.sleep(0.02)
+        return None
+    finally:
+        if process.returncode is None:
+            process.terminate()
+            await process.wait()
+
+def profile(runs: int = 3, top: int = 5, ready: bool = False, only=None):
+    """Profile every server; returns one result dict per server."""
+    results = []
+    for name, directory, module, port in SERVERS:
+        if only and name not in only:
+            continue
+        totals = []
+        children = {}
+        for _ in range(runs):
+            total, run_children = profile_imports(directory, module)
+            totals.append(total)
+            for child, ms in run_children.items():
+                children.setdefault(child, []).append(ms)
+        heaviest = sorted(((statistics.median(v), k) for k, v in children.items()), reverse=True)[:top]
+        import_ms = round(statistics.median(totals), 1)
+        result = {
+            "server": name,
+            "import_ms": import_ms,
+            "budget_ms": STARTUP_BUDGET_MS.get(name),
+            "over_budget": name in STARTUP_BUDGET_MS and import_ms > STARTUP_BUDGET_MS[name],
+            "heaviest_imports": {k: round(v, 1) for v, k in heaviest},
+        }
+        if ready and port:
+            result["ready_s"] = asyncio.run(measure_ready(directory, module, port))
+        results.append(result)
+    return results
+
+def print_profile(results):
+    print(f"{'server':<12}{'import ms':>11}{'budget':>9}{'ready s':>9}  heaviest imports")
+    for r in results:
+        ready = r.get("ready_s")
+        heaviest = ", ".join(f"{k} {v:.0f}" for k, v in r["heaviest_imports"].items())
+        flag = "  OVER BUDGET" if r["over_budget"] else ""
+        print(f"{r['server']:<12}{r['import_ms']:>11}{r['budget_ms'] or '-':>9}{ready if ready is not None else '-':>9}  {heaviest}{flag}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Profile MCP server import and startup time.")
+    parser.add_argument("--runs", type=int, default=3, help="Import runs per server (the median is reported)")
+    parser.add_argument("--top", type=int, default=5, help="How many of the heaviest direct imports to list")
+    parser.add_argument("--ready", action="store_true", help="Also time launch to first MCP handshake")
+    parser.add_argument("--servers", help="Comma-separated subset, e.g. wiz,servo")
+    args = parser.parse_args()
+    results = profile(args.runs, args.top, args.ready, args.servers.split(",") if args.servers else None)
+    print_profile(results)
+    sys.exit(1 if any(r["over_budget"] for r in results) else 0)
@@ -0,0 +1,106 @@
+"""
+Runs the WiZ, Timekeeper, Telegram and Servo MCP servers in one process and one
+event loop, instead of one Python interpreter each (`run_mcp_servers.py --single-process`).
+
+Every server keeps its usual port and /mcp endpoint, so existing Archestra and
+gateway configuration keeps working. All of them are also mounted in one ASGI app
+on --port under a prefix: /wiz/mcp, /timekeeper/mcp, /telegram/mcp and /servo/mcp.
+The servers share one pooled HTTP client, and timekeeper jobs and WiZ scenes call
+the other servers' tools in-process instead of over HTTP.
+"""
+import argparse
+import asyncio
+import contextlib
+import importlib
+import os
+import signal
+import sys
+import time
+
+import httpx
+import uvicorn
+from starlette.applications import Starlette
+from starlette.routing import Mount
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# (name, directory, module, port), ports as in run_mcp_servers.py. Shutdown runs in
+# reverse, so the Telegram outbox flushes first; the host closes the shared client after all of them.
+SERVERS = [
+    ("wiz", "mcp_servers/wiz_bulb", "wiz_server", 8001),
+    ("timekeeper", "mcp_servers/timekeeper", "timekeeper", 8002),
+    ("servo", "mcp_servers/servo", "servo_mcp", 8004),
+    ("telegram", "mcp_servers/telegram", "telegram_bot", 8003),
+]
+
+class Server(uvicorn.Server):
+    """uvicorn server that leaves signal handling to the host, which stops all servers at once."""
+    @contextlib.contextmanager
+    def capture_signals(self):
+        yield
+
+def load_servers():
+    modules = {}
+    for name, directory, module, _ in SERVERS:
+        sys.path.insert(0, os.path.join(ROOT, directory))
+        modules[name] = importlib.import_module(module)
+    return modules
+
+@contextlib.asynccontextmanager
+async def running(modules: dict):
+    """Start each server's session manager and background work, and stop them in reverse order."""
+    # The modules pass their own per-request timeouts; this matches the Telegram server's client for the rest
+    shared_client = httpx.AsyncClient(
+        timeout=15.0,
+        limits=httpx.Limits(max_connections=50, max_keepalive_connections=10, keepalive_expiry=60.0),
+    )
+    modules["servo"].http_client = shared_client
+    modules["telegram"].http_client = shared_client
+    modules["timekeeper"].local_servers.update({name: module.mcp for name, module in modules.items() if name != "timekeeper"})
+    modules["wiz"].local_servers["servo"] = modules["servo"].mcp
+    async with contextlib.AsyncExitStack() as stack:
+        stack.push_async_callback(shared_client.aclose)
+        for name, module in modules.items():
+            await stack.enter_async_context(module.mcp.session_manager.run())
+            # The Telegram server has no background work to start; its outbox starts per-chat workers on demand
+            if hasattr(module, "startup"):
+                await module.startup()
+            stack.push_async_callback(module.shutdown)
+        yield
+
+async def serve(args):
+    started = time.perf_counter()
+    modules = load_servers()
+    imported = time.perf_counter()
+
+    apps = {}
+    for name, module in modules.items():
+        module.mcp.settings.transport_security = None
+        apps[name] = module.mcp.streamable_http_app()
+
+    configs = []
+    if args.port:
+        combined = Starlette(routes=[Mount(f"/{name}", app=app) for name, app in apps.items()])
+        configs.append(uvicorn.Config(combined, host=args.host, port=args.port, lifespan="off", log_level=args.log_level))
+        print(f"Serving {', '.join(f'/{name}/mcp' for name in apps)} on http://{args.host}:{args.port}")
+    if not args.no_legacy_ports:
+        for name, _, _, port in SERVERS:
+            configs.append(uvicorn.Config(apps[name], host=args.host, port=port, lifespan="off", log_level=args.log_level))
+            print(f"Serving {name} on http://{args.host}:{port}/mcp")
+    servers = [Server(config) for config in configs]
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, lambda: [setattr(server, "should_exit", True) for server in servers])
+
+    async with running(modules):
+        print(f"MCP host ready: imports {imported - started:.2f}s, total {time.perf_counter() - started:.2f}s")
+        await asyncio.gather(*(server.serve() for server in servers))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run all MCP servers in one process.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000, help="Port for the combined app with per-server prefixes (0 disables)")
+    parser.add_argument("--no-legacy-ports", action="store_true", help="Don't also serve each server on its own port")
+    parser.add_argument("--log-level", default="info")
+    asyncio.run(serve(parser.parse_args()))
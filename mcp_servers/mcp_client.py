@@ -0,0 +1,49 @@
+"""
+Tool calls from one local MCP server (or the gateway) to another: the gateway's fast
+path, timekeeper jobs and WiZ scenes all go through here.
+
+    text, is_error = await call_tool(SERVO_MCP_URL, "toggle_switch", {"state": "on"}, timeout=10)
+
+The call goes over streamable HTTP and carries the current trace in `_meta`, so the
+other server's spans join the caller's trace. When the servers share a process
+(mcp_host.py), pass the other server's FastMCP instance as `local` and the tool is
+called directly instead. Either way the result is flattened to (text, is_error);
+structured results come back as JSON text. Transport failures are raised as the
+underlying error (e.g. ConnectError) rather than the anyio ExceptionGroup around it.
+"""
+import json
+
+from mcp_tracing import traceparent
+
+def root_cause(error: BaseException):
+    """The first error inside (possibly nested) exception groups, or error itself."""
+    while getattr(error, "exceptions", None):
+        error = error.exceptions[0]
+    return error
+
+async def call_tool(url: str, tool: str, arguments: dict, timeout: float, local=None):
+    """Call a tool on another MCP server. Returns (text, is_error)."""
+    if local is not None:
+        result = await local.call_tool(tool, arguments)
+        if isinstance(result, tuple):
+            result = result[0]
+        if isinstance(result, dict):
+            return json.dumps(result), False
+        return "\n".join(getattr(block, "text", "") for block in result), False
+    # The MCP client costs ~0.5s to import, so it is only loaded on the first remote call
+    from mcp import ClientSession
+    from mcp.client.streamable_http import streamablehttp_client
+    try:
+        async with streamablehttp_client(url, timeout=timeout) as (read, write, _):
+            async with ClientSession(read, write) as session:
+                await session.initialize()
+                context = traceparent()
+                result = await session.call_tool(tool, arguments, meta={"traceparent": context} if context else None)
+    except Exception as e:
+        # The client's task group wraps failures ("unhandled errors in a TaskGroup"); report what actually went wrong
+        cause = root_cause(e)
+        if cause is e:
+            raise
+        raise cause from e
+    text = "\n".join(block.text for block in result.content if getattr(block, "type", None) == "text")
+    return text, result.isError
@@ -0,0 +1,222 @@
+"""
+Device health for the MCP servers: a circuit breaker per device and a background
+prober, without extra dependencies.
+
+    health = HealthMonitor("Bulb", probe=probe_bulb, targets=monitored_bulbs, failures=(WizLightConnectionError,))
+
+    async with health.guard(ip):       # raises DeviceOffline at once while the breaker is open
+        await light.turn_on(pilot)
+
+A breaker opens after BREAKER_FAILURE_THRESHOLD consecutive failures (exceptions
+matching `failures`, or timeouts). While it is open, calls fail fast with a
+"<device> offline since ..." DeviceOffline instead of waiting out the device's
+timeout. After BREAKER_RESET_SECONDS it is half-open and lets one call (or
+probe) through as a trial: success closes the breaker, failure opens it again.
+
+The prober (health.run(), started from the server's startup()) checks every
+device each HEALTH_PROBE_INTERVAL seconds and records its round trip time.
+Devices that answered a real call within the interval aren't probed again.
+Open breakers get their half-open trial from the prober as soon as it is due,
+so a device that comes back is noticed without waiting for traffic.
+health.snapshot() backs each server's device_health tool.
+"""
+import asyncio
+import contextlib
+import os
+import statistics
+import time
+from collections import deque
+
+class DeviceOffline(Exception):
+    """Raised instead of contacting a device whose breaker is open."""
+    def __init__(self, breaker):
+        since = time.strftime("%H:%M:%S", time.localtime(breaker.failing_since)) if breaker.failing_since else "recently"
+        retry = max(0.0, breaker.retry_at - time.monotonic())
+        next_check = "a check is in progress" if breaker.state == "half_open" else f"next check in {retry:.0f}s"
+        super().__init__(f"{breaker.label} offline since {since} ({breaker.last_error}); {next_check}")
+
+class Breaker:
+    """
+    Circuit breaker for one device. Closed: calls go through. Open: they fail fast
+    until reset_timeout has passed. Half-open: one trial call is let through.
+    """
+    def __init__(self, label: str, threshold: int, reset_timeout: float):
+        self.label = label
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0  # consecutive
+        self.failing_since = None  # wall-clock time of the first failure in the current run of failures
+        self.retry_at = 0.0  # monotonic time an open breaker becomes half-open
+        self.trial = False  # a half-open trial call is in flight
+        self.last_ok = None
+        self.last_checked = None  # monotonic time of the last call or probe outcome
+        self.last_error = None
+        self.rtts = deque(maxlen=50)  # probe round trips in seconds
+        self.probes = 0
+        self.trips = 0
+        self.rejected = 0
+
+    def available(self):
+        if self.state == "closed":
+            return True
+        if self.state == "open":
+            return time.monotonic() >= self.retry_at
+        return not self.trial
+
+    def check(self):
+        """Raise DeviceOffline if a call can't go through now."""
+        if not self.available():
+            self.rejected += 1
+            raise DeviceOffline(self)
+
+    def begin(self):
+        """Admit a call, making it the half-open trial once the open period is over."""
+        self.check()
+        if self.state == "open":
+            self.state = "half_open"
+        if self.state == "half_open":
+            self.trial = True
+
+    def success(self, rtt: float = None):
+        if self.state != "closed":
+            print(f"{self.label} is back online (offline for {time.time() - self.failing_since:.0f}s)")
+        self.state = "closed"
+        self.failures = 0
+        self.failing_since = None
+        self.trial = False
+        self.last_error = None
+        self.last_ok = self.last_checked = time.monotonic()
+        if rtt is not None:
+            self.rtts.append(rtt)
+
+    def failure(self, error: BaseException):
+        now = time.monotonic()
+        self.failures += 1
+        self.failing_since = self.failing_since or time.time()
+        if str(error):
+            self.last_error = f"{type(error).__name__}: {error}"
+        else:
+            self.last_error = "timed out" if isinstance(error, asyncio.TimeoutError) else type(error).__name__
+        self.last_checked = now
+        self.trial = False
+        if self.state == "half_open" or self.failures >= self.threshold:
+            if self.state == "closed":
+                self.trips += 1
+                print(f"{self.label} is offline after {self.failures} failures ({self.last_error}); failing fast")
+            self.state = "open"
+            self.retry_at = now + self.reset_timeout
+
+    def release(self):
+        """The call ended without telling us anything about the device (e.g. it was cancelled)."""
+        self.trial = False
+
+    def snapshot(self):
+        now = time.monotonic()
+        rtts = sorted(self.rtts)
+        return {
+            "online": None if self.last_checked is None else self.state == "closed",
+            "breaker": self.state,
+            "offline_since": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.failing_since)) if self.failing_since and self.state != "closed" else None,
+            "consecutive_failures": self.failures,
+            "last_error": self.last_error,
+            "last_ok_seconds_ago": round(now - self.last_ok, 1) if self.last_ok else None,
+            "retry_in_seconds": round(max(0.0, self.retry_at - now), 1) if self.state == "open" else None,
+            "rtt_ms": round(self.rtts[-1] * 1000, 1) if self.rtts else None,
+            "rtt_p50_ms": round(statistics.median(rtts) * 1000, 1) if rtts else None,
+            "probes": self.probes,
+            "trips": self.trips,
+            "fast_failures": self.rejected,
+        }
+
+class HealthMonitor:
+    """
+    Breakers for one server's devices plus the prober that keeps them current.
+    probe(device) is a coroutine that raises if the device doesn't answer;
+    targets() lists the devices to probe besides those already seen in calls.
+    """
+    def __init__(self, kind: str, probe, targets, failures: tuple = (OSError,)):
+        # Each server builds its monitor after load_dotenv(), so .env settings apply
+        self.kind = kind
+        self.probe = probe
+        self.targets = targets
+        self.failures = failures + (asyncio.TimeoutError,)
+        self.interval = float(os.getenv("HEALTH_PROBE_INTERVAL", "30"))
+        self.timeout = float(os.getenv("HEALTH_PROBE_TIMEOUT", "2"))
+        self.threshold = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "2"))
+        self.reset_timeout = float(os.getenv("BREAKER_RESET_SECONDS", "15"))
+        self.breakers = {}  # device -> Breaker
+
+    def breaker(self, device: str):
+        breaker = self.breakers.get(device)
+        if breaker is None:
+            label = f"{self.kind} {device}" if self.kind else device
+            breaker = self.breakers[device] = Breaker(label, self.threshold, self.reset_timeout)
+        return breaker
+
+    def check(self, device: str):
+        """Fail fast with DeviceOffline if the device's breaker is open."""
+        breaker = self.breakers.get(device)
+        if breaker:
+            breaker.check()
+
+    @contextlib.asynccontextmanager
+    async def guard(self, device: str, rtt: bool = False):
+        """Run one device round trip through the breaker and record how it went."""
+        breaker = self.breaker(device)
+        breaker.begin()
+        start = time.monotonic()
+        try:
+            yield breaker
+        except self.failures as e:
+            breaker.failure(e)
+            raise
+        except BaseException:
+            breaker.release()
+            raise
+        breaker.success(time.monotonic() - start if rtt else None)
+
+    def record_failure(self, device: str, error: BaseException):
+        """Count a failure noticed outside guard(), e.g. a caller's timeout that cancelled the call."""
+        self.breaker(device).failure(error)
+
+    def devices(self):
+        try:
+            devices = set(self.targets())
+        except Exception as e:
+            print(f"Health: could not list devices to probe: {e}")
+            devices = set()
+        return devices | set(self.breakers)
+
+    def due(self, device: str):
+        breaker = self.breaker(device)
+        if breaker.state == "closed":
+            return breaker.last_checked is None or time.monotonic() - breaker.last_checked >= self.interval
+        return breaker.available()
+
+    async def probe_device(self, device: str):
+        self.breaker(device).probes += 1
+        try:
+            async with self.guard(device, rtt=True):
+                await asyncio.wait_for(self.probe(device), self.timeout)
+        except DeviceOffline:
+            pass
+        except Exception as e:
+            if not isinstance(e, self.failures):
+                print(f"Health: probe of {device} failed: {e}")
+
+    async def run(self):
+        """Background task: probe devices as they come due (checked every second, which costs a dict scan)."""
+        while True:
+            due = [device for device in self.devices() if self.due(device)]
+            if due:
+                await asyncio.gather(*(self.probe_device(device) for device in due))
+            await asyncio.sleep(1.0)
+
+    def snapshot(self):
+        return {
+            "devices": {device: breaker.snapshot() for device, breaker in sorted(self.breakers.items())},
+            "probe_interval_seconds": self.interval,
+            "failure_threshold": self.threshold,
+            "reset_seconds": self.reset_timeout,
+        }
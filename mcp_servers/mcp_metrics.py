@@ -0,0 +1,217 @@
+"""
+Shared instrumentation for the MCP servers and the gateway, without extra dependencies.
+
+    metrics = Metrics("wiz")
+    metrics.instrument(mcp)          # before the @mcp.tool() definitions
+
+wraps every tool registered afterwards with a latency histogram, an in-flight gauge
+and call/error counters (errors are classified by exception type, or "ErrorResult"
+for tools that report failure in their return value), and adds a Prometheus-format
+/metrics route next to /mcp. Device round trips are recorded with
+
+    async with metrics.device("wiz_udp", ip):
+        await light.turn_on(pilot)
+
+Recording is a few dict updates and a bisect per call, cheap enough to leave on.
+Given a tracer (mcp_tracing.Tracer), tool calls and device round trips are also
+recorded as spans, continuing the trace the caller passed along with the request.
+"""
+import asyncio
+import bisect
+import contextlib
+import functools
+import time
+
+from mcp_tracing import current_span, request_traceparent
+
+# Histogram bucket upper bounds in seconds, covering LAN round trips through agent runs
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def is_error_result(result):
+    """Most tools here report failure as an 'Error...' string or a dict with ok=False."""
+    if isinstance(result, str):
+        return result.startswith("Error")
+    if isinstance(result, dict):
+        return result.get("ok") is False
+    return False
+
+def escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+class Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+
+    def render(self, name: str, labels: str):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ("+Inf",), self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f"{name}_sum{{{labels}}} {self.sum:.6f}")
+        lines.append(f"{name}_count{{{labels}}} {self.count}")
+        return lines
+
+class Metrics:
+    """Per-process metrics for one server (the `server` label on every sample)."""
+    def __init__(self, server: str, tracer=None):
+        self.server = server
+        self.tracer = tracer
+        self.mcp = None
+        self.started = time.time()
+        self.tool_latency = {}  # tool -> Histogram
+        self.tool_calls = {}  # (tool, outcome) -> count
+        self.tool_errors = {}  # (tool, error type) -> count
+        self.in_flight = {}  # tool -> gauge
+        self.device_rtt = {}  # (device, target) -> Histogram
+        self.device_errors = {}  # (device, target, error type) -> count
+
+    def record(self, tool: str, seconds: float, error_type: str = None):
+        histogram = self.tool_latency.get(tool)
+        if histogram is None:
+            histogram = self.tool_latency[tool] = Histogram()
+        histogram.observe(seconds)
+        key = (tool, "error" if error_type else "ok")
+        self.tool_calls[key] = self.tool_calls.get(key, 0) + 1
+        if error_type:
+            key = (tool, error_type)
+            self.tool_errors[key] = self.tool_errors.get(key, 0) + 1
+
+    def timed(self, fn=None, *, name: str = None, is_error=is_error_result):
+        """Decorator recording latency, in-flight count and errors of an async function."""
+        if fn is None:
+            return functools.partial(self.timed, name=name, is_error=is_error)
+        tool = name or fn.__name__
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            self.in_flight[tool] = self.in_flight.get(tool, 0) + 1
+            start = time.perf_counter()
+            with self.span(f"{self.server}.{tool}", parent=self.parent()) as span:
+                try:
+                    result = await fn(*args, **kwargs)
+                except BaseException as e:
+                    self.record(tool, time.perf_counter() - start, type(e).__name__)
+                    raise
+                finally:
+                    self.in_flight[tool] -= 1
+                error_type = "ErrorResult" if is_error(result) else None
+                self.record(tool, time.perf_counter() - start, error_type)
+                if span and error_type:
+                    span.error = error_type
+            return result
+        return wrapper
+
+    def span(self, name: str, parent=None, **attributes):
+        if self.tracer is None:
+            return contextlib.nullcontext()
+        return self.tracer.span(name, parent, **attributes)
+
+    def parent(self):
+        """Span a tool call continues: the current one, or the one its MCP request came with."""
+        if self.tracer is None or self.mcp is None:
+            return None
+        return current_span.get() or request_traceparent(self.mcp)
+
+    def instrument(self, mcp):
+        """Time every tool registered on mcp from now on, and serve GET /metrics."""
+        register = mcp.tool
+        self.mcp = mcp
+
+        def tool(*args, **kwargs):
+            decorator = register(*args, **kwargs)
+
+            def instrumented(fn):
+                decorator(self.timed(fn, name=kwargs.get("name")))
+                return fn
+            return instrumented
+
+        mcp.tool = tool
+        mcp.custom_route("/metrics", methods=["GET"])(self.endpoint)
+        return self
+
+    async def endpoint(self, request):
+        from starlette.responses import PlainTextResponse
+        return PlainTextResponse(self.render(), media_type="text/plain; version=0.0.4")
+
+    @contextlib.asynccontextmanager
+    async def device(self, device: str, target: str):
+        """Time one round trip to a device; failures are counted by exception type."""
+        start = time.perf_counter()
+        with self.span(device, target=target):
+            try:
+                yield
+            except BaseException as e:
+                key = (device, target, type(e).__name__)
+                self.device_errors[key] = self.device_errors.get(key, 0) + 1
+                raise
+        self.observe_device(device, target, time.perf_counter() - start)
+
+    def observe_device(self, device: str, target: str, seconds: float):
+        histogram = self.device_rtt.get((device, target))
+        if histogram is None:
+            histogram = self.device_rtt[(device, target)] = Histogram()
+        histogram.observe(seconds)
+
+    def render(self):
+        server = f'server="{escape(self.server)}"'
+        lines = [
+            "# HELP mcp_tool_duration_seconds Tool call latency.",
+            "# TYPE mcp_tool_duration_seconds histogram",
+        ]
+        for tool, histogram in self.tool_latency.items():
+            lines += histogram.render("mcp_tool_duration_seconds", f'{server},tool="{escape(tool)}"')
+        lines += ["# HELP mcp_tool_calls_total Tool calls by outcome.", "# TYPE mcp_tool_calls_total counter"]
+        for (tool, outcome), count in self.tool_calls.items():
+            lines.append(f'mcp_tool_calls_total{{{server},tool="{escape(tool)}",outcome="{outcome}"}} {count}')
+        lines += ["# HELP mcp_tool_errors_total Failed tool calls by error type.", "# TYPE mcp_tool_errors_total counter"]
+        for (tool, error_type), count in self.tool_errors.items():
+            lines.append(f'mcp_tool_errors_total{{{server},tool="{escape(tool)}",error_type="{escape(error_type)}"}} {count}')
+        lines += ["# HELP mcp_tool_in_flight Tool calls currently running.", "# TYPE mcp_tool_in_flight gauge"]
+        for tool, count in self.in_flight.items():
+            lines.append(f'mcp_tool_in_flight{{{server},tool="{escape(tool)}"}} {count}')
+        lines += ["# HELP device_rtt_seconds Round trip time of device requests.", "# TYPE device_rtt_seconds histogram"]
+        for (device, target), histogram in self.device_rtt.items():
+            lines += histogram.render("device_rtt_seconds", f'{server},device="{escape(device)}",target="{escape(target)}"')
+        lines += ["# HELP device_errors_total Failed device requests by error type.", "# TYPE device_errors_total counter"]
+        for (device, target, error_type), count in self.device_errors.items():
+            lines.append(f'device_errors_total{{{server},device="{escape(device)}",target="{escape(target)}",error_type="{escape(error_type)}"}} {count}')
+        lines += [
+            "# HELP process_start_time_seconds Start time of the process since the Unix epoch.",
+            "# TYPE process_start_time_seconds gauge",
+            f"process_start_time_seconds{{{server}}} {self.started:.3f}",
+        ]
+        return "\n".join(lines) + "\n"
+
+async def serve_metrics(metrics: Metrics, host: str, port: int):
+    """Minimal HTTP listener for GET /metrics, for processes without an ASGI app (the gateway)."""
+    async def handle(reader, writer):
+        try:
+            request_line = await reader.readline()
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass
+            parts = request_line.decode(errors="replace").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+                status, body = "200 OK", metrics.render().encode()
+            else:
+                status, body = "404 Not Found", b"Not found\n"
+            writer.write(
+                f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    return await asyncio.start_server(handle, host, port)
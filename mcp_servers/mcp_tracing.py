@@ -0,0 +1,299 @@
+"""
+End-to-end request tracing for the gateway and the MCP servers, without extra dependencies.
+
+Trace context travels as a W3C traceparent (00-<trace id>-<span id>-01). The gateway
+starts a trace for each Telegram message and passes it on in the A2A message metadata
+and `traceparent` header of its Archestra requests, and in the `_meta` of fast-path
+tool calls. MCP tools pick it up from the request's `_meta` or `traceparent` header, so
+their spans land in the same trace:
+
+    tracer = Tracer("wiz")
+    metrics = Metrics("wiz", tracer=tracer).instrument(mcp)   # a span per tool call and device round trip
+
+    with tracer.span("wiz.discover", subnet="192.168.1.0/24"):
+        ...
+
+Durations come from the monotonic clock; start times are wall-clock so spans from
+different processes line up. Finished spans are appended by a background thread to
+TRACE_FILE (traces.jsonl in the repo root) as JSON lines with OTLP field names
+(traceId, spanId, parentSpanId, startTimeUnixNano, ...), which a collector's file
+log receiver can pick up. Every process on the host writes to the same file, so a
+per-request breakdown is one query:
+
+    python mcp_servers/mcp_tracing.py              # latest gateway request
+    python mcp_servers/mcp_tracing.py <trace id>
+    python mcp_servers/mcp_tracing.py --list 20    # recent requests, slowest first with --slowest
+    python mcp_servers/mcp_tracing.py --service timekeeper   # latest scheduled job run
+"""
+import argparse
+import atexit
+import contextlib
+import contextvars
+import json
+import os
+import queue
+import re
+import secrets
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def trace_file():
+    """Where spans are written (JSON lines); relative paths are taken from the repo root so all servers share one file."""
+    return os.path.join(ROOT, os.getenv("TRACE_FILE", "traces.jsonl"))
+
+TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+# The span that new spans in this task are children of
+current_span = contextvars.ContextVar("current_span", default=None)
+
+def parse_traceparent(value):
+    """(trace id, parent span id) from a traceparent header, or None if it isn't one."""
+    match = TRACEPARENT.match(value.strip().lower()) if isinstance(value, str) else None
+    if not match or match.group(1) == "0" * 32 or match.group(2) == "0" * 16:
+        return None
+    return match.group(1), match.group(2)
+
+def traceparent():
+    """traceparent of the current span, for passing the trace on to another service."""
+    span = current_span.get()
+    return span.traceparent() if span else None
+
+def request_traceparent(mcp):
+    """traceparent sent with the MCP request being handled, from its _meta or HTTP headers."""
+    try:
+        request_context = mcp.get_context().request_context
+    except (LookupError, ValueError):
+        return None
+    value = getattr(request_context.meta, "traceparent", None) if request_context.meta else None
+    if not value and request_context.request is not None:
+        value = request_context.request.headers.get("traceparent")
+    return value
+
+class Span:
+    __slots__ = ("tracer", "name", "trace_id", "span_id", "parent_id", "attributes", "start_ns", "start", "error", "ended")
+
+    def __init__(self, tracer, name: str, trace_id: str, parent_id: str, attributes: dict):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.start_ns = time.time_ns()
+        self.start = time.perf_counter_ns()
+        self.error = None
+        self.ended = False
+
+    def traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def elapsed_ms(self):
+        return (time.perf_counter_ns() - self.start) / 1e6
+
+    def end(self, error: str = None):
+        if self.ended:
+            return
+        self.ended = True
+        self.error = error or self.error
+        self.tracer.export(self, time.perf_counter_ns() - self.start)
+
+class Tracer:
+    """Creates spans for one service (the gateway or an MCP server) and exports them."""
+    def __init__(self, service: str, path: str = None):
+        # Settings are read here rather than at import, after the servers have loaded .env
+        self.service = service
+        self.path = path or trace_file()
+        self.enabled = os.getenv("TRACING", "true").lower() == "true"
+        # The file is rotated to <path>.1 past this size
+        self.max_bytes = int(os.getenv("TRACE_MAX_BYTES", str(20 * 1024 * 1024)))
+        self.pending = queue.SimpleQueue()
+        self.writer = None
+        self.lock = threading.Lock()
+
+    def start(self, name: str, parent=None, root: bool = False, **attributes):
+        """
+        Start a span; call .end() on it when done. parent is a Span or a traceparent
+        string and defaults to the current span; root=True starts a new trace.
+        """
+        if parent is None and not root:
+            parent = current_span.get()
+        if isinstance(parent, Span):
+            trace_id, parent_id = parent.trace_id, parent.span_id
+        else:
+            trace_id, parent_id = parse_traceparent(parent) or (secrets.token_hex(16), None)
+        return Span(self, name, trace_id, parent_id, attributes)
+
+    @contextlib.contextmanager
+    def span(self, name: str, parent=None, root: bool = False, **attributes):
+        """Time a block as a span that is the current span inside it; exceptions mark it failed."""
+        span = self.start(name, parent, root, **attributes)
+        token = current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.end(type(e).__name__)
+            raise
+        finally:
+            current_span.reset(token)
+            span.end()
+
+    @contextlib.contextmanager
+    def activate(self, span: Span):
+        """Make an already started span the parent of spans created inside the block."""
+        token = current_span.set(span)
+        try:
+            yield span
+        finally:
+            current_span.reset(token)
+
+    def export(self, span: Span, duration_ns: int):
+        if not self.enabled:
+            return
+        record = {
+            "traceId": span.trace_id,
+            "spanId": span.span_id,
+            "parentSpanId": span.parent_id,
+            "name": span.name,
+            "service": self.service,
+            "startTimeUnixNano": span.start_ns,
+            "endTimeUnixNano": span.start_ns + duration_ns,
+            "durationMs": round(duration_ns / 1e6, 3),
+            "status": "error" if span.error else "ok",
+            "attributes": {**span.attributes, **({"error": span.error} if span.error else {})},
+        }
+        self.pending.put(record)
+        if self.writer is None:
+            with self.lock:
+                if self.writer is None:
+                    self.writer = threading.Thread(target=self._write_loop, name=f"{self.service}-trace-writer", daemon=True)
+                    self.writer.start()
+                    atexit.register(self.close)
+
+    def _write_loop(self):
+        while True:
+            records = [self.pending.get()]
+            while True:
+                try:
+                    records.append(self.pending.get_nowait())
+                except queue.Empty:
+                    break
+            stop = None in records
+            self._write([r for r in records if r is not None])
+            if stop:
+                return
+
+    def _write(self, records):
+        if not records:
+            return
+        lines = "".join(json.dumps(r, default=str, separators=(",", ":")) + "\n" for r in records)
+        try:
+            if self.max_bytes and os.path.getsize(self.path) > self.max_bytes:
+                os.replace(self.path, self.path + ".1")
+        except OSError:
+            pass
+        try:
+            # One append per batch; every process shares the file, so it isn't kept open across rotations
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(lines)
+        except OSError:
+            pass
+
+    def close(self):
+        """Write out spans still queued (runs at exit)."""
+        if self.writer is not None and self.writer.is_alive():
+            self.pending.put(None)
+            self.writer.join(timeout=2.0)
+
+def read_spans(path: str = None, trace_id: str = None):
+    """Span records from the trace file (and its rotated predecessor), optionally for one trace."""
+    spans = []
+    path = path or trace_file()
+    for name in (path + ".1", path):
+        try:
+            with open(name, encoding="utf-8") as f:
+                for line in f:
+                    if trace_id and trace_id not in line:
+                        continue
+                    try:
+                        spans.append(json.loads(line))
+                    except ValueError:
+                        continue
+        except OSError:
+            continue
+    return spans
+
+def recent_requests(spans, service: str = "gateway"):
+    """Root spans of the given service, i.e. one per traced request, oldest first."""
+    roots = [s for s in spans if not s.get("parentSpanId") and s.get("service") == service]
+    return sorted(roots, key=lambda s: s["startTimeUnixNano"])
+
+def breakdown(spans, trace_id: str):
+    """
+    The spans of one trace as (offset ms, duration ms, depth, span) rows in tree order.
+    Spans whose parent isn't in the file (e.g. created inside Archestra) hang off the root.
+    """
+    spans = sorted((s for s in spans if s["traceId"] == trace_id), key=lambda s: s["startTimeUnixNano"])
+    if not spans:
+        return []
+    ids = {s["spanId"] for s in spans}
+    top = [s for s in spans if not s.get("parentSpanId")] or spans[:1]
+    top_ids = {s["spanId"] for s in top}
+    children = {}
+    for s in spans:
+        parent = s.get("parentSpanId")
+        if s["spanId"] in top_ids:
+            continue
+        if parent not in ids:
+            parent = top[0]["spanId"]
+        children.setdefault(parent, []).append(s)
+    origin = spans[0]["startTimeUnixNano"]
+    rows = []
+
+    def walk(span, depth):
+        rows.append(((span["startTimeUnixNano"] - origin) / 1e6, span["durationMs"], depth, span))
+        for child in children.get(span["spanId"], []):
+            walk(child, depth + 1)
+
+    for span in top:
+        walk(span, 0)
+    return rows
+
+def format_breakdown(rows):
+    if not rows:
+        return "No spans recorded for that trace."
+    lines = [f"trace {rows[0][3]['traceId']}", f"{'start ms':>10}{'dur ms':>10}  span"]
+    for offset, duration, depth, span in rows:
+        attributes = " ".join(f"{k}={v}" for k, v in span.get("attributes", {}).items())
+        flag = " [error]" if span.get("status") == "error" else ""
+        lines.append(f"{offset:>10.1f}{duration:>10.1f}  {'  ' * depth}{span['name']} ({span['service']}){flag}  {attributes}".rstrip())
+    return "\n".join(lines)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-request latency breakdown from the trace file.")
+    parser.add_argument("trace_id", nargs="?", help="Trace to show (default: the latest gateway request)")
+    parser.add_argument("--file", default=None, help="Trace file (default: TRACE_FILE)")
+    parser.add_argument("--list", type=int, metavar="N", help="List the last N requests instead")
+    parser.add_argument("--slowest", action="store_true", help="With --list, sort by duration")
+    parser.add_argument("--service", default="gateway", help="Whose requests to list (timekeeper for scheduled jobs)")
+    args = parser.parse_args()
+
+    spans = read_spans(args.file, args.trace_id)
+    if args.list:
+        recent = recent_requests(spans, args.service)[-args.list:]
+        if args.slowest:
+            recent.sort(key=lambda s: s["durationMs"], reverse=True)
+        for s in recent:
+            started = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(s["startTimeUnixNano"] / 1e9))
+            attributes = " ".join(f"{k}={v}" for k, v in s.get("attributes", {}).items())
+            print(f"{s['traceId']}  {started}  {s['durationMs']:>9.1f} ms  {attributes}")
+    else:
+        trace_id = args.trace_id
+        if not trace_id:
+            recent = recent_requests(spans, args.service)
+            trace_id = recent[-1]["traceId"] if recent else None
+        print(format_breakdown(breakdown(spans, trace_id)) if trace_id else "No traced requests yet.")
@@ -1,78 +1,360 @@
+import asyncio
 import os
+import sys
 import time
 import socket
 import httpx
 from mcp.server.fastmcp import FastMCP
 from dotenv import load_dotenv
-from zeroconf import Zeroconf, ServiceBrowser, ServiceStateChange
+
+# Shared helpers (mcp_health, mcp_metrics, mcp_tracing) live one directory up
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from mcp_health import DeviceOffline, HealthMonitor
+from mcp_metrics import Metrics
+from mcp_tracing import Tracer
 
 load_dotenv()
 
 # Configuration
 ESP32_HOSTNAME = "switcheroo.local."
+# The firmware advertises its web server under this service type (MDNS.addService("http", "tcp", 80))
+ESP32_SERVICE_TYPE = "_http._tcp.local."
 ESP32_IP = os.getenv("ESP32_IP") 
+FALLBACK_IP = "192.168.0.101"
+REQUEST_TIMEOUT = float(os.getenv("ESP32_TIMEOUT", "5.0"))
 
-class ESP32Listener:
+class ESP32Resolver:
+    """
+    Background mDNS browser that keeps the ESP32's current address cached.
+    Falls back to ESP32_IP, then to the historical default, until the board is found.
+    """
     def __init__(self):
         self.address = None
+        self.service_name = None
+        self.resolved_at = None
+        self.aiozc = None
+        self.browser = None
+
+    async def start(self):
+        # zeroconf is imported here rather than at module load, so it doesn't delay server startup
+        from zeroconf import IPVersion
+        from zeroconf.asyncio import AsyncServiceBrowser, AsyncZeroconf
+        self.aiozc = AsyncZeroconf(ip_version=IPVersion.V4Only)
+        self.browser = AsyncServiceBrowser(self.aiozc.zeroconf, ESP32_SERVICE_TYPE, handlers=[self._on_change])
+
+    def _on_change(self, zeroconf, service_type, name, state_change):
+        from zeroconf import ServiceStateChange
+        if state_change in (ServiceStateChange.Added, ServiceStateChange.Updated):
+            asyncio.ensure_future(self._resolve(service_type, name))
+
+    async def _resolve(self, service_type, name):
+        from zeroconf import IPVersion
+        from zeroconf.asyncio import AsyncServiceInfo
+        info = AsyncServiceInfo(service_type, name)
+        if not await info.async_request(self.aiozc.zeroconf, 3000):
+            return False
+        if (info.server or "").lower() != ESP32_HOSTNAME:
+            return False
+        addresses = info.parsed_addresses(IPVersion.V4Only)
+        if not addresses:
+            return False
+        if addresses[0] != self.address:
+            print(f"Discovered ESP32 at {addresses[0]}")
+        self.address = addresses[0]
+        self.service_name = name
+        self.resolved_at = time.time()
+        return True
+
+    async def refresh(self):
+        """Re-resolve the ESP32, e.g. after a connection failure. Returns True if an address was found."""
+        if self.aiozc and self.service_name and await self._resolve(ESP32_SERVICE_TYPE, self.service_name):
+            return True
+        # The OS resolver handles switcheroo.local where nss-mdns/Bonjour is available
+        try:
+            infos = await asyncio.wait_for(
+                asyncio.get_running_loop().getaddrinfo(ESP32_HOSTNAME.rstrip("."), 80, family=socket.AF_INET),
+                timeout=2.0,
+            )
+        except (OSError, asyncio.TimeoutError):
+            return False
+        self.address = infos[0][4][0]
+        self.resolved_at = time.time()
+        return True
+
+    def current(self):
+        """Return (ip, source) for the address requests should go to."""
+        if self.address:
+            return self.address, "mdns"
+        if ESP32_IP:
+            return ESP32_IP, "env"
+        return FALLBACK_IP, "default"
+
+    async def close(self):
+        if self.browser:
+            await self.browser.async_cancel()
+        if self.aiozc:
+            await self.aiozc.async_close()
+
+resolver = ESP32Resolver()
+http_client = None
+# False while mcp_host.py lends its shared client, which the host closes itself
+owns_client = False
+last_rtt_ms = None
+
+def get_client():
+    """Return the shared keep-alive client, creating it on first use."""
+    global http_client, owns_client
+    if http_client is None:
+        owns_client = True
+        http_client = httpx.AsyncClient(
+            timeout=REQUEST_TIMEOUT,
+            limits=httpx.Limits(max_keepalive_connections=4, keepalive_expiry=60.0),
+        )
+    return http_client
+
+async def esp32_request(path: str, timeout: float = REQUEST_TIMEOUT):
+    """
+    GET a path on the ESP32 through the shared client, re-resolving and retrying
+    once if the connection can't be made. Returns (response, ip).
+    """
+    global last_rtt_ms
+    ip, _ = resolver.current()
+    try:
+        start = time.monotonic()
+        async with metrics.device("esp32_http", ip):
+            response = await get_client().get(f"http://{ip}{path}", timeout=timeout)
+    except (httpx.ConnectError, httpx.ConnectTimeout):
+        # Nothing reached the board, so retrying can't cause a double press
+        if not await resolver.refresh() or resolver.current()[0] == ip:
+            raise
+        ip, _ = resolver.current()
+        print(f"ESP32 moved, retrying at {ip}")
+        start = time.monotonic()
+        async with metrics.device("esp32_http", ip):
+            response = await get_client().get(f"http://{ip}{path}", timeout=timeout)
+    last_rtt_ms = round((time.monotonic() - start) * 1000, 1)
+    return response, ip
+
+async def probe_esp32(device: str):
+    await esp32_request("/", health.timeout)
+
+# Any HTTP response means the board is up; only transport errors (refused, timed out) count against it
+health = HealthMonitor("", probe=probe_esp32, targets=lambda: ["ESP32"], failures=(httpx.TransportError,))
+
+async def esp32_get(path: str):
+    """esp32_request through the ESP32's circuit breaker: fails fast with DeviceOffline while it's down."""
+    async with health.guard("ESP32"):
+        return await esp32_request(path)
+
+async def press_switch(state: str):
+    """Send one press to the ESP32. Returns (ok, message)."""
+    # Address comes from the background mDNS browser, then ESP32_IP, then the default.
+    ip, _ = resolver.current()
+    print(f"Attempting to toggle switch {state} at http://{ip}...")
+    
+    try:
+        # The ESP32 endpoint expects a query parameter 'state'
+        # Note: Using string concatenation for the URL to avoid any params encoding issues
+        response, ip = await esp32_get(f"/toggle?state={state.lower()}")
+        print(f"Response: {response.text}")
+        response.raise_for_status()
+        
+        # Try to parse JSON response, fallback to text if not JSON
+        try:
+            data = response.json()
+            return True, f"Success: {data.get('message', 'Switch toggled')} (IP: {ip})"
+        except ValueError:
+            return True, f"Success: {response.text} (IP: {ip})"
+                
+    except DeviceOffline as e:
+        return False, f"Error: {e}"
+    except httpx.TimeoutException:
+        return False, f"Error: Connection to ESP32 at {ip} timed out."
+    except httpx.ConnectError:
+        return False, f"Error: Could not connect to ESP32 at {ip}."
+    except httpx.HTTPStatusError as e:
+        return False, f"Error: ESP32 returned status {e.response.status_code}."
+    except Exception as e:
+        return False, f"Error: {str(e)}"
+
+class ActuationQueue:
+    """
+    Serializes presses to the switch; the firmware blocks for PRESS_DELAY_MS per press,
+    so overlapping requests only time out. Commands that arrive while a press is in
+    flight are coalesced: only the latest requested state is pressed, and a press
+    that matches the last commanded state is skipped. Callers whose state was
+    overridden by a later request are told so rather than given the press result.
+    """
+    def __init__(self, press):
+        self.press = press
+        self.last_state = None
+        self.pending_state = None
+        self.pending_force = False
+        self.waiters = []
+        self.busy = False
+        self.worker = None
+        self.presses = 0
+        self.coalesced = 0
+        self.superseded = 0
+        self.skipped = 0
 
-    def remove_service(self, zeroconf, type, name):
-        pass
+    def depth(self):
+        return len(self.waiters) + (1 if self.busy else 0)
 
-    def add_service(self, zeroconf, type, name):
-        info = zeroconf.get_service_info(type, name)
-        if info:
-            self.address = socket.inet_ntoa(info.addresses[0])
-            print(f"Discovered ESP32 at {self.address}")
+    async def submit(self, state: str, force: bool = False):
+        enqueued = time.monotonic()
+        position = self.depth()
+        waiter = asyncio.get_running_loop().create_future()
+        self.pending_state = state
+        self.pending_force = self.pending_force or force
+        self.waiters.append((waiter, state))
+        if self.worker is None or self.worker.done():
+            self.worker = asyncio.create_task(self._drain())
+        result = await waiter
+        return dict(result, queue_position=position, waited_ms=round((time.monotonic() - enqueued) * 1000, 1))
 
-    def update_service(self, zeroconf, type, name):
-        pass
+    async def _drain(self):
+        while self.waiters:
+            state, force, waiters = self.pending_state, self.pending_force, self.waiters
+            self.pending_state, self.pending_force, self.waiters = None, False, []
+            self.busy = True
+            self.coalesced += len(waiters) - 1
+            try:
+                if state == self.last_state and not force:
+                    self.skipped += 1
+                    result = {"ok": True, "result": f"Switch already {state}; no press needed.", "pressed": False}
+                else:
+                    ok, message = await self.press(state)
+                    self.presses += 1
+                    # After a failed or timed-out press we no longer know where the switch is
+                    self.last_state = state if ok else None
+                    result = {"ok": ok, "result": message, "pressed": True}
+            except Exception as e:
+                self.last_state = None
+                result = {"ok": False, "result": f"Error: {str(e)}", "pressed": False}
+            finally:
+                self.busy = False
+            result.update(state=state, coalesced_with=len(waiters) - 1)
+            for waiter, wanted in waiters:
+                if waiter.done():
+                    continue
+                if wanted == state:
+                    waiter.set_result(result)
+                else:
+                    self.superseded += 1
+                    waiter.set_result({
+                        "ok": True,
+                        "result": f"Not pressed: superseded by a later request to switch {state}.",
+                        "pressed": False,
+                        "state": wanted,
+                        "superseded_by": state,
+                        "coalesced_with": len(waiters) - 1,
+                    })
+
+    def stats(self):
+        return {
+            "last_commanded_state": self.last_state,
+            "queue_depth": self.depth(),
+            "presses": self.presses,
+            "coalesced": self.coalesced,
+            "superseded": self.superseded,
+            "skipped_no_ops": self.skipped,
+        }
+
+switch_queue = ActuationQueue(press_switch)
 
 mcp = FastMCP("Servo Switch Controller")
+tracer = Tracer("servo")
+metrics = Metrics("servo", tracer=tracer).instrument(mcp)
 
 @mcp.tool()
-async def toggle_switch(state: str):
+async def toggle_switch(state: str, force: bool = False):
     """
     Toggle the physical wall switch via the ESP32 servo controller.
+    Presses are queued one at a time; requests that arrive while the servo is busy
+    collapse to the most recent state (earlier requests for the other state report
+    superseded_by instead of pressing), and a press to the last commanded state is skipped.
     :param state: The desired state, either 'on' or 'off'.
-    Returns a message indicating the result of the operation.
+    :param force: Press even if the switch was last commanded to this state. Default False.
+    Returns the result of the operation with its queue position and wait time.
     """
     if state.lower() not in ["on", "off"]:
         return "Error: State must be 'on' or 'off'"
-    
-    # Simple logic: Try ENV first, then default. 
-    # Skipping blocking mDNS for now to ensure speed and reliability.
-    ip = os.getenv("ESP32_IP", "192.168.0.101")
-    
-    base_url = f"http://{ip}"
-    print(f"Attempting to toggle switch {state} at {base_url}...")
-    
+    return await switch_queue.submit(state.lower(), force)
+
+@mcp.tool()
+async def esp32_status():
+    """
+    Report where the ESP32 servo controller is (resolved address and how it was found),
+    measure the current round-trip time to it, and show the press queue and last commanded state.
+    """
+    ip, source = resolver.current()
+    result = {
+        "address": ip,
+        "source": source,
+        "resolved_seconds_ago": round(time.time() - resolver.resolved_at, 1) if resolver.resolved_at else None,
+        "last_rtt_ms": last_rtt_ms,
+        **switch_queue.stats(),
+        "health": health.breaker("ESP32").snapshot(),
+    }
     try:
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            # The ESP32 endpoint expects a query parameter 'state'
-            # Note: Using string concatenation for the URL to avoid any params encoding issues
-            full_url = f"{base_url}/toggle?state={state.lower()}"
-            print(f"HTTP Request: GET {full_url}")
-            
-            response = await client.get(full_url)
-            print(f"Response: {response.text}")
-            response.raise_for_status()
-            
-            # Try to parse JSON response, fallback to text if not JSON
-            try:
-                data = response.json()
-                return f"Success: {data.get('message', 'Switch toggled')} (IP: {ip})"
-            except ValueError:
-                return f"Success: {response.text} (IP: {ip})"
-                
-    except httpx.TimeoutException:
-        return f"Error: Connection to ESP32 at {ip} timed out."
-    except httpx.ConnectError:
-        return f"Error: Could not connect to ESP32 at {ip}."
-    except httpx.HTTPStatusError as e:
-        return f"Error: ESP32 returned status {e.response.status_code}."
+        response, ip = await esp32_get("/")
+        result.update(address=ip, reachable=response.is_success, rtt_ms=last_rtt_ms)
     except Exception as e:
-        return f"Error: {str(e)}"
+        result.update(reachable=False, error=str(e) or type(e).__name__)
+    return result
+
+@mcp.tool()
+async def device_health():
+    """
+    Report whether the ESP32 is reachable, as the background health prober last saw it:
+    online/offline, since when, last error and round-trip time. While it is offline,
+    toggle_switch fails immediately instead of waiting for a timeout, so check this
+    before planning actions that need the switch.
+    """
+    return health.snapshot()
+
+resolver_task = None
+health_task = None
+
+async def start_resolver():
+    try:
+        await resolver.start()
+    except Exception as e:
+        print(f"mDNS browser unavailable, using configured address: {e}")
+
+async def startup():
+    """
+    Start the mDNS browser in the background (until it finds the board, ESP32_IP is used)
+    and the health prober.
+    """
+    global resolver_task, health_task
+    resolver_task = asyncio.create_task(start_resolver())
+    if health.interval > 0:
+        health_task = asyncio.create_task(health.run())
+
+async def shutdown():
+    """Stop the prober, and close the client and the mDNS browser."""
+    if resolver_task:
+        resolver_task.cancel()
+    if health_task:
+        health_task.cancel()
+    if http_client and owns_client:
+        await http_client.aclose()
+    await resolver.close()
+
+async def serve(transport: str):
+    """Run the MCP server with the mDNS browser, and close the client and browser on shutdown."""
+    await startup()
+    try:
+        if transport == "sse":
+            await mcp.run_sse_async()
+        elif transport == "streamable-http":
+            await mcp.run_streamable_http_async()
+        else:
+            await mcp.run_stdio_async()
+    finally:
+        await shutdown()
 
 import argparse
 
@@ -93,4 +375,4 @@ if __name__ == "__main__":
         mcp.settings.transport_security = None
         print(f"Starting Servo MCP Server on http://0.0.0.0:{args.port}/mcp")
 
-    mcp.run(transport=args.transport)
+    asyncio.run(serve(args.transport))
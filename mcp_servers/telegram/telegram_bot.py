@@ -1,38 +1,282 @@
 from mcp.server.fastmcp import FastMCP
 import httpx
 import argparse
+import asyncio
 import os
+import sys
+import time
+import uuid
+from collections import OrderedDict, deque
 from dotenv import load_dotenv
 
+# Shared helpers (mcp_metrics, mcp_tracing) live one directory up
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from mcp_metrics import Metrics
+from mcp_tracing import Tracer, traceparent
+
 load_dotenv()
 
 mcp = FastMCP("Telegram Agent")
+tracer = Tracer("telegram")
+metrics = Metrics("telegram", tracer=tracer).instrument(mcp)
 
 BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")
+# Telegram allows roughly 30 messages/second per bot and about 1 message/second per chat
+GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))
+CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))
+CHAT_BURST = int(os.getenv("TELEGRAM_CHAT_BURST", "3"))
+MAX_ATTEMPTS = int(os.getenv("TELEGRAM_MAX_ATTEMPTS", "5"))
+DELIVERY_HISTORY = int(os.getenv("TELEGRAM_DELIVERY_HISTORY", "200"))
+TELEGRAM_MAX_TEXT = 4096
+REQUEST_TIMEOUT = 15.0
+# Bot API endpoint, e.g. a local Bot API server or a fake Telegram for testing
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org/bot")
+
+http_client = None
+# False while mcp_host.py lends its shared client, which the host closes itself
+owns_client = False
+
+def get_client():
+    """Return the shared Telegram API client, creating it on first use."""
+    global http_client, owns_client
+    if http_client is None:
+        owns_client = True
+        http_client = httpx.AsyncClient(timeout=REQUEST_TIMEOUT)
+    return http_client
+
+class TokenBucket:
+    """
+    Allows `rate` sends per second with bursts of up to `burst`. pause() empties the
+    bucket for a while, e.g. when Telegram answers 429 with retry_after.
+    """
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def wait_time(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    async def acquire(self):
+        while (delay := self.wait_time()) > 0:
+            await asyncio.sleep(delay)
+        self.tokens -= 1
+
+    def pause(self, seconds: float):
+        # Nothing until blocked_until, then a single send before the normal rate resumes
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 1.0
+        self.updated = self.blocked_until
+
+class OutboundQueue:
+    """
+    Delivers messages in order per chat without exceeding Telegram's limits.
+    Messages that pile up while a chat waits for its rate limit are merged into one
+    send. Every message gets a delivery id whose status can be looked up later.
+    """
+    def __init__(self, send, global_rate: float = GLOBAL_RATE, chat_rate: float = CHAT_RATE, chat_burst: int = CHAT_BURST):
+        self.send = send
+        self.global_bucket = TokenBucket(global_rate, max(1, int(global_rate)))
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.chat_buckets = {}
+        self.pending = {}  # chat_id -> deque of delivery ids waiting to be sent
+        self.workers = {}  # chat_id -> worker task
+        self.deliveries = OrderedDict()
+        self.sent = 0
+        self.merged = 0
+        self.failed = 0
+        self.rate_limited = 0
+
+    def enqueue(self, chat_id: str, text: str):
+        delivery_id = uuid.uuid4().hex[:12]
+        queue = self.pending.setdefault(chat_id, deque())
+        self.deliveries[delivery_id] = {
+            "delivery_id": delivery_id,
+            "chat_id": chat_id,
+            "status": "queued",
+            "text": text,
+            "enqueued_at": time.time(),
+            "queue_position": len(queue),
+            "traceparent": traceparent(),
+        }
+        queue.append(delivery_id)
+        self._trim()
+        if chat_id not in self.workers:
+            self.workers[chat_id] = asyncio.create_task(self._drain(chat_id))
+        return self.deliveries[delivery_id]
+
+    def _take_batch(self, queue):
+        """Pop the messages to send next: as many queued ones as fit in one Telegram message."""
+        batch = [queue.popleft()]
+        length = len(self.deliveries[batch[0]]["text"])
+        while queue and length + 2 + len(self.deliveries[queue[0]]["text"]) <= TELEGRAM_MAX_TEXT:
+            length += 2 + len(self.deliveries[queue[0]]["text"])
+            batch.append(queue.popleft())
+        return batch
+
+    async def _drain(self, chat_id):
+        queue = self.pending[chat_id]
+        bucket = self.chat_buckets.setdefault(chat_id, TokenBucket(self.chat_rate, self.chat_burst))
+        records = []
+        try:
+            while queue:
+                await bucket.acquire()
+                await self.global_bucket.acquire()
+                # Everything that queued up while we waited for a token goes out together
+                batch = self._take_batch(queue)
+                records = [self.deliveries[d] for d in batch]
+                text = "\n\n".join(r["text"] for r in records)
+                for record in records:
+                    record["status"] = "sending"
+                    record["merged_with"] = len(batch) - 1
+                self.merged += len(batch) - 1
+                # Sends happen after the tool call returned; trace them under the request that queued the first message
+                with tracer.span("telegram.deliver", parent=records[0]["traceparent"], messages=len(batch)):
+                    await self._deliver(chat_id, text, records, bucket)
+        finally:
+            # If the worker stops early (cancelled at shutdown, or an unexpected error), nothing it held is left looking queued
+            unsent = [r for r in records if r["status"] == "sending"] + [self.deliveries[d] for d in queue]
+            for record in unsent:
+                record.update(status="failed", error="delivery worker stopped before sending")
+            self.failed += len(unsent)
+            del self.pending[chat_id]
+            del self.workers[chat_id]
+
+    async def _deliver(self, chat_id, text, records, bucket):
+        error = None
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            for record in records:
+                record["attempts"] = attempt
+            try:
+                message_id = await self.send(chat_id, text)
+                for record in records:
+                    record.update(status="sent", sent_at=time.time(), message_id=message_id)
+                self.sent += 1
+                return
+            except httpx.HTTPStatusError as e:
+                error = f"HTTP {e.response.status_code}: {e.response.text}"
+                if e.response.status_code == 429:
+                    # retry_after applies to the whole bot, so every chat's sends wait it out
+                    self.rate_limited += 1
+                    retry_after = retry_after_seconds(e.response)
+                    bucket.pause(retry_after)
+                    self.global_bucket.pause(retry_after)
+                    await bucket.acquire()
+                    await self.global_bucket.acquire()
+                    continue
+                if e.response.status_code < 500:
+                    break
+            except httpx.HTTPError as e:
+                error = f"{type(e).__name__}: {e}"
+            except Exception as e:
+                # e.g. a 200 whose body isn't JSON: the message may have gone out, so don't send it again
+                error = f"{type(e).__name__}: {e}"
+                break
+            await asyncio.sleep(min(2 ** attempt, 30))
+        self.failed += len(records)
+        for record in records:
+            record.update(status="failed", error=error)
+
+    def _trim(self):
+        """Forget the oldest finished deliveries past DELIVERY_HISTORY."""
+        for delivery_id in list(self.deliveries):
+            if len(self.deliveries) <= DELIVERY_HISTORY:
+                break
+            if self.deliveries[delivery_id]["status"] in ("sent", "failed"):
+                del self.deliveries[delivery_id]
+
+    def status(self, delivery_id: str):
+        record = self.deliveries.get(delivery_id)
+        return {k: v for k, v in record.items() if k != "text"} if record else None
+
+    async def flush(self, timeout: float):
+        """Wait up to timeout seconds for queued messages to go out."""
+        if self.workers:
+            await asyncio.wait(list(self.workers.values()), timeout=timeout)
+
+    def stats(self):
+        return {
+            "queued": sum(len(q) for q in self.pending.values()),
+            "sends": self.sent,
+            "merged": self.merged,
+            "failed": self.failed,
+            "rate_limited": self.rate_limited,
+        }
+
+def retry_after_seconds(response):
+    try:
+        return float(response.json().get("parameters", {}).get("retry_after", 1))
+    except ValueError:
+        return float(response.headers.get("Retry-After", 1))
+
+async def send_message(chat_id: str, text: str):
+    """POST one sendMessage; raises httpx errors so the queue can retry. Returns Telegram's message id."""
+    url = f"{TELEGRAM_API_URL}{BOT_TOKEN}/sendMessage"
+    async with metrics.device("telegram_api", "sendMessage"):
+        response = await get_client().post(url, json={"chat_id": chat_id, "text": text}, timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+    return response.json().get("result", {}).get("message_id")
+
+outbox = OutboundQueue(send_message)
 
 @mcp.tool()
 async def telegram_send(message: str):
     """
     Send a message to the user via Telegram.
+    The message is queued and sent within Telegram's rate limits; messages sent in quick
+    succession may be combined into one. Returns right away with a delivery id.
     :param message: The text to send.
     """
     if not BOT_TOKEN or not CHAT_ID:
         return "Error: TELEGRAM_BOT_TOKEN or TELEGRAM_CHAT_ID not found in environment."
 
-    url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
-    payload = {
-        "chat_id": CHAT_ID,
-        "text": message
+    record = outbox.enqueue(CHAT_ID, message)
+    return {
+        "result": f"Message queued for Telegram: {message}",
+        "delivery_id": record["delivery_id"],
+        "queue_position": record["queue_position"],
     }
 
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(url, json=payload)
-            response.raise_for_status()
-            return f"Message sent to Telegram: {message}"
-        except Exception as e:
-            return f"Failed to send Telegram message: {str(e)}"
+@mcp.tool()
+async def telegram_delivery_status(delivery_id: str = None):
+    """
+    Look up whether a queued Telegram message was delivered.
+    :param delivery_id: The id returned by telegram_send. If omitted, reports queue totals only.
+    Returns the delivery's status (queued, sending, sent or failed) and the queue counters.
+    """
+    if delivery_id is None:
+        return outbox.stats()
+    status = outbox.status(delivery_id)
+    if status is None:
+        return f"Error: Unknown delivery id '{delivery_id}'"
+    return {**status, "queue": outbox.stats()}
+
+async def shutdown():
+    """Give queued messages a moment to go out, then close the client."""
+    await outbox.flush(timeout=5.0)
+    if http_client and owns_client:
+        await http_client.aclose()
+
+async def serve(transport: str):
+    """Run the MCP server, then give queued messages a moment to go out and close the client."""
+    try:
+        if transport == "sse":
+            await mcp.run_sse_async()
+        elif transport == "streamable-http":
+            await mcp.run_streamable_http_async()
+        else:
+            await mcp.run_stdio_async()
+    finally:
+        await shutdown()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -51,4 +295,4 @@ if __name__ == "__main__":
         mcp.settings.transport_security = None
         print(f"Starting Telegram Agent on http://0.0.0.0:{args.port}/mcp")
 
-    mcp.run(transport=args.transport)
+    asyncio.run(serve(args.transport))
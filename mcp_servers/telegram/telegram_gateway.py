@@ -1,9 +1,31 @@
 import os
 import asyncio
+import contextlib
+import hmac
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import re
+import secrets
+import signal
+import socket
+import sys
+import time
+from collections import deque
+from urllib.parse import urlsplit
 import httpx
 from dotenv import load_dotenv
 from telegram import Update
-from telegram.ext import ApplicationBuilder, ContextTypes, MessageHandler, filters
+from telegram.error import BadRequest, RetryAfter, TelegramError
+from telegram.ext import ApplicationBuilder, CommandHandler, ContextTypes, MessageHandler, filters
+
+# Shared helpers (mcp_client, mcp_metrics, mcp_tracing) live one directory up
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from mcp_client import call_tool
+from mcp_metrics import Metrics, serve_metrics
+from mcp_tracing import Tracer, breakdown, current_span, format_breakdown, read_spans, traceparent
 
 # Load environment variables
 load_dotenv()
@@ -16,11 +38,172 @@ ALLOWED_CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")
 ARCHESTRA_AGENT_ID = os.getenv("ARCHESTRA_AGENT_ID")
 ARCHESTRA_API_KEY = os.getenv("ARCHESTRA_API_KEY")
 ARCHESTRA_BASE_URL = os.getenv("ARCHESTRA_BASE_URL", "http://localhost:9000")
+# Stream agent output into the placeholder message (A2A message/stream over SSE)
+ARCHESTRA_STREAMING = os.getenv("ARCHESTRA_STREAMING", "true").lower() == "true"
+# Minimum seconds between progressive edits; Telegram throttles frequent edits of one message
+EDIT_INTERVAL = float(os.getenv("TELEGRAM_EDIT_INTERVAL", "1.5"))
+TELEGRAM_MAX_TEXT = 4096
+# How many agent runs may be in flight at once, and how many more may wait before we turn messages away
+MAX_CONCURRENT_RUNS = int(os.getenv("GATEWAY_MAX_CONCURRENT_RUNS", "4"))
+MAX_QUEUED_RUNS = int(os.getenv("GATEWAY_MAX_QUEUED_RUNS", "20"))
+# Logging: level, rotating debug log, and how much of the raw Archestra payloads to record
+LOG_LEVEL = os.getenv("GATEWAY_LOG_LEVEL", "INFO").upper()
+# Relative paths are taken from this directory, not the working directory
+LOG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.getenv("GATEWAY_LOG_FILE", "gateway_debug.log"))
+LOG_MAX_BYTES = int(os.getenv("GATEWAY_LOG_MAX_BYTES", str(5 * 1024 * 1024)))
+LOG_BACKUPS = int(os.getenv("GATEWAY_LOG_BACKUPS", "3"))
+# Fraction of raw responses logged at INFO; at DEBUG every response is logged
+RAW_LOG_SAMPLE_RATE = float(os.getenv("GATEWAY_RAW_LOG_SAMPLE_RATE", "0"))
+RAW_LOG_MAX_CHARS = int(os.getenv("GATEWAY_RAW_LOG_MAX_CHARS", "2000"))
+# Fast path: simple device commands go straight to the MCP servers instead of through Archestra
+FAST_PATH_ENABLED = os.getenv("GATEWAY_FAST_PATH", "true").lower() == "true"
+FAST_PATH_RULES_FILE = os.getenv("GATEWAY_FAST_PATH_RULES")
+FAST_PATH_TIMEOUT = float(os.getenv("GATEWAY_FAST_PATH_TIMEOUT", "10"))
+# How long the WiZ server's scene names are cached; only those names take the "<name> scene" fast path
+SCENE_CACHE_SECONDS = float(os.getenv("GATEWAY_SCENE_CACHE_SECONDS", "30"))
+MCP_SERVER_URLS = {
+    "wiz": os.getenv("WIZ_MCP_URL", "http://localhost:8001/mcp"),
+    "servo": os.getenv("SERVO_MCP_URL", "http://localhost:8004/mcp"),
+}
+# Prometheus /metrics listener for Archestra and fast-path timings (0 disables)
+METRICS_PORT = int(os.getenv("GATEWAY_METRICS_PORT", "0"))
+# Ingress: with a public webhook URL set, Telegram pushes updates to a local listener; otherwise we long-poll
+WEBHOOK_URL = os.getenv("GATEWAY_WEBHOOK_URL")
+WEBHOOK_LISTEN = os.getenv("GATEWAY_WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("GATEWAY_WEBHOOK_PORT", "8443"))
+# Telegram sends it in X-Telegram-Bot-Api-Secret-Token; a random one is registered for each run when unset
+WEBHOOK_SECRET = os.getenv("GATEWAY_WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+# Seconds between getWebhookInfo checks, and how many failing checks in a row switch to polling (0 disables)
+WEBHOOK_CHECK_INTERVAL = float(os.getenv("GATEWAY_WEBHOOK_CHECK_INTERVAL", "60"))
+WEBHOOK_MAX_FAILED_CHECKS = int(os.getenv("GATEWAY_WEBHOOK_MAX_FAILED_CHECKS", "3"))
+# Bot API endpoint, e.g. a local fake Telegram for testing
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org/bot")
+
+try:
+    import h2  # noqa: F401 - lets httpx negotiate HTTP/2
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+logger = logging.getLogger("gateway")
+tracer = Tracer("gateway")
+metrics = Metrics("gateway", tracer=tracer)
+
+def is_gateway_error(reply):
+    return isinstance(reply, str) and reply.startswith(("Archestra API Error", "Gateway Error"))
+
+log_listener = None
+
+def setup_logging():
+    """
+    Route gateway logs through a queue so file and console writes happen on a
+    background thread, never on the event loop. The file rotates at LOG_MAX_BYTES.
+    """
+    global log_listener
+    if log_listener:
+        return
+    formatter = logging.Formatter("%(asctime)s %(levelname)s %(message)s")
+    file_handler = logging.handlers.RotatingFileHandler(LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS)
+    console_handler = logging.StreamHandler()
+    for handler in (file_handler, console_handler):
+        handler.setFormatter(formatter)
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
+    log_listener = logging.handlers.QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+    log_listener.start()
+
+def log_raw(label: str, data):
+    """Log a raw payload only at DEBUG or for a sample of requests, truncated to RAW_LOG_MAX_CHARS."""
+    if logger.isEnabledFor(logging.DEBUG):
+        level = logging.DEBUG
+    elif RAW_LOG_SAMPLE_RATE and random.random() < RAW_LOG_SAMPLE_RATE:
+        level = logging.INFO
+    else:
+        return
+    text = str(data)
+    if len(text) > RAW_LOG_MAX_CHARS:
+        text = text[:RAW_LOG_MAX_CHARS] + f"... [{len(text) - RAW_LOG_MAX_CHARS} more chars]"
+    logger.log(level, "%s: %s", label, text)
+
+http_client = None
+
+def get_client():
+    """Return the gateway's shared, pooled Archestra client."""
+    global http_client
+    if http_client is None:
+        http_client = httpx.AsyncClient(
+            timeout=120.0,
+            http2=HTTP2_AVAILABLE,
+            limits=httpx.Limits(max_connections=MAX_CONCURRENT_RUNS * 2, max_keepalive_connections=MAX_CONCURRENT_RUNS),
+        )
+    return http_client
+
+metrics_server = None
+
+async def start_metrics(application=None):
+    """Application startup hook: serve /metrics when GATEWAY_METRICS_PORT is set."""
+    global metrics_server
+    if METRICS_PORT:
+        metrics_server = await serve_metrics(metrics, "0.0.0.0", METRICS_PORT)
+        logger.info("Serving metrics on http://0.0.0.0:%s/metrics", METRICS_PORT)
+
+async def close_client(application=None):
+    """Application shutdown hook: close the shared client and flush the log queue."""
+    global http_client
+    if http_client:
+        await http_client.aclose()
+        http_client = None
+    if metrics_server:
+        metrics_server.close()
+    if log_listener:
+        log_listener.stop()
+
+def parts_text(parts):
+    return "".join([p.get("text", "") for p in parts if p.get("kind") == "text"])
+
+def extract_reply(result):
+    """Pull the agent's reply text out of an A2A result, or None if there isn't any."""
+    # Check if 'result' IS the message object (has 'parts')
+    if "parts" in result:
+        return parts_text(result.get("parts", []))
+        
+    # Fallback: Check if it's nested under 'message' or 'messages'
+    elif "message" in result:
+         return parts_text(result["message"].get("parts", []))
+         
+    elif "messages" in result:
+        # Previous logic for list of messages
+        messages = result["messages"]
+        assistant_replies = [m for m in messages if m.get("role") == "agent" or m.get("role") == "assistant"]
+        if assistant_replies:
+            return parts_text(assistant_replies[-1].get("parts", []))
 
+    # A finished task carries its output as artifacts
+    elif "artifacts" in result:
+        return "".join(parts_text(a.get("parts", [])) for a in result["artifacts"])
+    return None
+
+def add_trace_context(payload: dict, headers: dict):
+    """
+    Pass the current trace on to Archestra: as a traceparent header for its HTTP
+    tracing, and in the A2A message metadata so it can reach the MCP tool calls.
+    """
+    context = traceparent()
+    if context:
+        headers["traceparent"] = context
+        payload["params"]["message"]["metadata"] = {"traceparent": context}
+        payload["params"]["metadata"] = {"traceparent": context}
+
+@metrics.timed(is_error=is_gateway_error)
 async def forward_to_archestra(text: str):
     """
     Sends a message to the Archestra A2A agent and waits for the response.
     """
+    return await _forward_to_archestra(text)
+
+async def _forward_to_archestra(text: str):
     url = f"{ARCHESTRA_BASE_URL}/v1/a2a/{ARCHESTRA_AGENT_ID}"
     headers = {
         "Authorization": f"Bearer {ARCHESTRA_API_KEY}",
@@ -38,91 +221,737 @@ async def forward_to_archestra(text: str):
             "wait": True  # Enable synchronous waiting for the agent's response
         }
     }
+    add_trace_context(payload, headers)
     
-    async with httpx.AsyncClient(timeout=120.0) as client:
+    client = get_client()
+    try:
+        logger.info("Sending to Archestra: %s", text)
+        response = await client.post(url, json=payload, headers=headers)
+        response.raise_for_status()
+        
+        data = response.json()
+        log_raw("Archestra raw response", data)
+        
+        if "result" in data:
+            reply_text = extract_reply(data["result"])
+            if reply_text is not None:
+                return reply_text
+        
+        return "Archestra processed the message but returned no text reply."
+        
+    except httpx.HTTPStatusError as e:
+        return f"Archestra API Error: {e.response.status_code} - {e.response.text}"
+    except Exception as e:
+        return f"Gateway Error: {str(e)}"
+
+class StreamingUnsupported(Exception):
+    """Archestra (or something in front of it) doesn't speak message/stream."""
+
+class PlaceholderEditor:
+    """
+    Progressively edits the "Thinking..." message with partial agent output,
+    at most once per EDIT_INTERVAL and backing off when Telegram says retry_after.
+    """
+    def __init__(self, bot, chat_id, message_id):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.shown = None
+        self.next_edit = 0.0
+
+    async def update(self, text: str):
+        text = text.strip()
+        # Leave room for the " …" marking the reply as still in progress
+        if len(text) > TELEGRAM_MAX_TEXT - 2:
+            text = text[:TELEGRAM_MAX_TEXT - 3] + "…"
+        if not text or text == self.shown or time.monotonic() < self.next_edit:
+            return
+        self.next_edit = time.monotonic() + EDIT_INTERVAL
         try:
-            print(f"Gateway: Sending to Archestra: {text}")
-            response = await client.post(url, json=payload, headers=headers)
-            response.raise_for_status()
-            
-            data = response.json()
-            print(f"Gateway: Archestra Raw Response: {data}")
-            
-            # Log to file for debugging
-            with open("gateway_debug.log", "a") as f:
-                f.write(f"\n--- Response ---\n{data}\n")
-            
-            if "result" in data:
-                result = data["result"]
-                
-                # Check if 'result' IS the message object (has 'parts')
-                if "parts" in result:
-                    parts = result.get("parts", [])
-                    reply_text = "".join([p.get("text", "") for p in parts if p.get("kind") == "text"])
-                    return reply_text
-                    
-                # Fallback: Check if it's nested under 'message' or 'messages'
-                elif "message" in result:
-                     parts = result["message"].get("parts", [])
-                     reply_text = "".join([p.get("text", "") for p in parts if p.get("kind") == "text"])
-                     return reply_text
-                     
-                elif "messages" in result:
-                    # Previous logic for list of messages
-                    messages = result["messages"]
-                    assistant_replies = [m for m in messages if m.get("role") == "agent" or m.get("role") == "assistant"]
-                    if assistant_replies:
-                        last_reply = assistant_replies[-1]
-                        parts = last_reply.get("parts", [])
-                        reply_text = "".join([p.get("text", "") for p in parts if p.get("kind") == "text"])
-                        return reply_text
-            
-            return "Archestra processed the message but returned no text reply."
-            
-        except httpx.HTTPStatusError as e:
-            return f"Archestra API Error: {e.response.status_code} - {e.response.text}"
-        except Exception as e:
-            return f"Gateway Error: {str(e)}"
+            with tracer.span("telegram.edit", chars=len(text)):
+                await self.bot.edit_message_text(chat_id=self.chat_id, message_id=self.message_id, text=text + " …")
+            self.shown = text
+        except RetryAfter as e:
+            retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") else e.retry_after
+            self.next_edit = time.monotonic() + retry_after
+        except BadRequest as e:
+            logger.warning("Progressive edit failed: %s", e)
+
+async def read_sse(response):
+    """Yield the JSON payload of each server-sent event."""
+    data = []
+    async for line in response.aiter_lines():
+        if line.startswith("data:"):
+            data.append(line[5:].lstrip())
+        elif not line and data:
+            yield json.loads("\n".join(data))
+            data = []
+    if data:
+        yield json.loads("\n".join(data))
+
+# Flipped off the first time the endpoint turns out not to support streaming
+streaming_supported = ARCHESTRA_STREAMING
+
+@metrics.timed(is_error=is_gateway_error)
+async def stream_from_archestra(text: str, on_progress):
+    """
+    Sends a message to the Archestra A2A agent with message/stream and calls
+    on_progress(partial_text) as output arrives. Falls back to the synchronous
+    forward_to_archestra if streaming isn't supported.
+    """
+    global streaming_supported
+    # The fallback calls the untimed _forward_to_archestra, so each message is recorded once, here
+    if not streaming_supported:
+        return await _forward_to_archestra(text)
+    try:
+        return await _stream_from_archestra(text, on_progress)
+    except StreamingUnsupported as e:
+        logger.warning("Streaming unavailable (%s), falling back to message/send", e)
+        streaming_supported = False
+        return await _forward_to_archestra(text)
+
+async def _stream_from_archestra(text: str, on_progress):
+    url = f"{ARCHESTRA_BASE_URL}/v1/a2a/{ARCHESTRA_AGENT_ID}"
+    headers = {
+        "Authorization": f"Bearer {ARCHESTRA_API_KEY}",
+        "Content-Type": "application/json",
+        "Accept": "text/event-stream",
+    }
+    
+    payload = {
+        "jsonrpc": "2.0",
+        "id": 1,
+        "method": "message/stream",
+        "params": {
+            "message": {
+                "parts": [{"kind": "text", "text": text}]
+            }
+        }
+    }
+    add_trace_context(payload, headers)
+
+    artifacts = {}
+    message_text = status_text = None
+    span = current_span.get()
+    client = get_client()
+    try:
+        logger.info("Streaming to Archestra: %s", text)
+        async with client.stream("POST", url, json=payload, headers=headers) as response:
+            if response.status_code in (404, 405, 501):
+                raise StreamingUnsupported(f"HTTP {response.status_code}")
+            if response.is_error:
+                # Read the body while the stream is still open; once the block exits it can't be read
+                await response.aread()
+                return f"Archestra API Error: {response.status_code} - {response.text}"
+
+            if not response.headers.get("content-type", "").startswith("text/event-stream"):
+                # Answered as a plain JSON-RPC response: either an error or the whole result
+                data = json.loads(await response.aread())
+                if data.get("error", {}).get("code") == -32601:
+                    raise StreamingUnsupported(data["error"].get("message", "method not found"))
+                if "error" in data:
+                    return f"Archestra API Error: {data['error']}"
+                reply_text = extract_reply(data.get("result", {}))
+                return reply_text if reply_text is not None else "Archestra processed the message but returned no text reply."
+
+            async for event in read_sse(response):
+                log_raw("Archestra stream event", event)
+                if "error" in event:
+                    if event["error"].get("code") == -32601:
+                        raise StreamingUnsupported(event["error"].get("message", "method not found"))
+                    return f"Archestra API Error: {event['error']}"
+                result = event.get("result", {})
+                kind = result.get("kind")
+                if kind == "artifact-update":
+                    artifact = result.get("artifact", {})
+                    artifact_id = artifact.get("artifactId", "")
+                    chunk = parts_text(artifact.get("parts", []))
+                    artifacts[artifact_id] = artifacts.get(artifact_id, "") + chunk if result.get("append") else chunk
+                elif kind == "status-update":
+                    message = result.get("status", {}).get("message")
+                    if message and message.get("role") in ("agent", "assistant"):
+                        status_text = parts_text(message.get("parts", []))
+                elif kind == "message":
+                    if result.get("role") in ("agent", "assistant"):
+                        message_text = parts_text(result.get("parts", []))
+                elif kind == "task":
+                    for artifact in result.get("artifacts") or []:
+                        artifacts[artifact.get("artifactId", "")] = parts_text(artifact.get("parts", []))
+                reply_text = "".join(artifacts.values()) or message_text or status_text
+                if reply_text:
+                    if span and "first_output_ms" not in span.attributes:
+                        span.set(first_output_ms=round(span.elapsed_ms(), 1))
+                    await on_progress(reply_text)
+
+        reply_text = "".join(artifacts.values()) or message_text or status_text
+        return reply_text or "Archestra processed the message but returned no text reply."
+
+    except StreamingUnsupported:
+        raise
+    except Exception as e:
+        return f"Gateway Error: {str(e)}"
+
+class ChatDispatcher:
+    """
+    Runs agent requests concurrently across chats, up to max_concurrent at a time,
+    while keeping them strictly in order within each chat. Past max_queued waiting
+    requests, new messages are turned away instead of piling up.
+    """
+    def __init__(self, max_concurrent: int = MAX_CONCURRENT_RUNS, max_queued: int = MAX_QUEUED_RUNS):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.slots = asyncio.Semaphore(max_concurrent)
+        self.queues = {}  # chat_id -> deque of jobs waiting for that chat's worker
+        self.workers = {}  # chat_id -> worker task
+        self.in_flight = 0
+        self.queued = 0
+        self.completed = 0
+        self.rejected = 0
+
+    def full(self):
+        return self.queued >= self.max_queued
+
+    def position(self, chat_id):
+        """How many runs a new message from chat_id would wait behind (0 = starts now)."""
+        ahead_globally = self.in_flight + self.queued - self.max_concurrent + 1
+        # Within a chat we also wait for its running message and everything queued behind it
+        ahead_in_chat = len(self.queues[chat_id]) + 1 if chat_id in self.workers else 0
+        return max(0, ahead_globally, ahead_in_chat)
+
+    def submit(self, chat_id, job):
+        """Queue job (a coroutine function) behind earlier messages from the same chat."""
+        self.queued += 1
+        self.queues.setdefault(chat_id, deque()).append(job)
+        if chat_id not in self.workers:
+            self.workers[chat_id] = asyncio.create_task(self._drain(chat_id))
+
+    async def _drain(self, chat_id):
+        queue = self.queues[chat_id]
+        try:
+            while queue:
+                job = queue.popleft()
+                async with self.slots:
+                    self.queued -= 1
+                    self.in_flight += 1
+                    try:
+                        await job()
+                    except Exception as e:
+                        logger.exception("Message handling failed for chat %s: %s", chat_id, e)
+                    finally:
+                        self.in_flight -= 1
+                        self.completed += 1
+        finally:
+            del self.queues[chat_id]
+            del self.workers[chat_id]
+
+    def stats(self):
+        return {
+            "in_flight": self.in_flight,
+            "queued": self.queued,
+            "chats_active": len(self.workers),
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "max_concurrent": self.max_concurrent,
+            "max_queued": self.max_queued,
+        }
+
+dispatcher = ChatDispatcher()
+
+FAST_PATH_COLORS = {
+    "red": (255, 0, 0),
+    "green": (0, 255, 0),
+    "blue": (0, 0, 255),
+    "yellow": (255, 200, 0),
+    "orange": (255, 100, 0),
+    "purple": (150, 0, 255),
+    "pink": (255, 80, 160),
+    "white": (255, 255, 255),
+}
+
+# Each rule is matched against the whole (normalized) message. Named groups can be
+# used in args as "{name}"; a value that is just "{name}" and all digits becomes an int.
+# "limits" bounds integer args as [min, max]; a message outside them goes to Archestra.
+DEFAULT_FAST_PATH_RULES = [
+    {"pattern": r"(?:turn |switch )?(?:the )?(?:lights?|bulbs?|lamp) on|(?:turn |switch )on (?:the )?(?:lights?|bulbs?|lamp)", "server": "wiz", "tool": "turn_on"},
+    {"pattern": r"(?:turn |switch )?(?:the )?(?:lights?|bulbs?|lamp) off|(?:turn |switch )off (?:the )?(?:lights?|bulbs?|lamp)", "server": "wiz", "tool": "turn_off"},
+    {"pattern": r"dim (?:the )?(?:lights?|bulbs?|lamp)", "server": "wiz", "tool": "turn_on", "args": {"brightness": 64}},
+    {"pattern": r"(?:set )?(?:the )?(?:lights?|bulbs?|lamp) (?:to )?(?P<kelvin>\d{4})k?", "server": "wiz", "tool": "set_warmth", "args": {"kelvin": "{kelvin}"}, "limits": {"kelvin": [2200, 6500]}},
+    {"pattern": r"(?:set )?(?:the )?(?:lights?|bulbs?|lamp) (?:to )?warm(?: white)?|warm (?:lights?|white)", "server": "wiz", "tool": "set_warmth", "args": {"kelvin": 2700}},
+    {"pattern": r"(?:set )?(?:the )?(?:lights?|bulbs?|lamp) (?:to )?(?:cool|cold|daylight)(?: white)?|daylight", "server": "wiz", "tool": "set_warmth", "args": {"kelvin": 6500}},
+    *[
+        {"pattern": rf"(?:set |make |turn )?(?:the )?(?:lights?|bulbs?|lamp) (?:to )?{name}|{name} (?:lights?|bulbs?|lamp)", "server": "wiz", "tool": "set_color", "args": {"r": r, "g": g, "b": b}}
+        for name, (r, g, b) in FAST_PATH_COLORS.items()
+    ],
+    {"pattern": r"(?:apply |activate |start |set )?(?:the )?(?P<name>[a-z0-9_ ]+?) scene|(?:apply |activate |start )(?:the )?scene (?P<name2>[a-z0-9_ ]+)", "server": "wiz", "tool": "apply_scene", "args": {"name": "{name}{name2}"}},
+    {"pattern": r"(?:turn |switch |flip )?(?:the )?(?:wall )?switch (?P<state>on|off)|(?:turn |switch |flip )(?P<state2>on|off) (?:the )?(?:wall )?switch", "server": "servo", "tool": "toggle_switch", "args": {"state": "{state}{state2}"}},
+]
+
+def load_fast_path_rules():
+    """
+    The rule table: GATEWAY_FAST_PATH_RULES (a JSON list of {"pattern", "server", "tool",
+    "args", "limits"}) if set, otherwise the built-in rules. Patterns are compiled once here.
+    """
+    rules = DEFAULT_FAST_PATH_RULES
+    if FAST_PATH_RULES_FILE:
+        with open(FAST_PATH_RULES_FILE) as f:
+            rules = json.load(f)
+    compiled = []
+    for rule in rules:
+        if rule["server"] not in MCP_SERVER_URLS:
+            raise ValueError(f"Fast path rule {rule['pattern']!r} names unknown server {rule['server']!r}")
+        compiled.append((re.compile(rule["pattern"], re.IGNORECASE), rule))
+    return compiled
+
+def normalize_command(text: str):
+    text = " ".join(text.lower().split())
+    text = re.sub(r"^(?:please |hey |ok )+|(?: please| now)+$", "", text.rstrip(".!"))
+    return text.strip()
+
+def match_fast_path(text: str, rules):
+    """Return (server, tool, arguments) for the first rule matching text, or None."""
+    command = normalize_command(text)
+    for pattern, rule in rules:
+        match = pattern.fullmatch(command)
+        if not match:
+            continue
+        groups = {k: v or "" for k, v in match.groupdict().items()}
+        args = {}
+        for key, value in (rule.get("args") or {}).items():
+            if isinstance(value, str):
+                value = value.format(**groups)
+                if value.isdigit():
+                    value = int(value)
+            args[key] = value
+        if not within_limits(args, rule.get("limits")):
+            continue
+        return rule["server"], rule["tool"], args
+    return None
+
+def within_limits(args: dict, limits):
+    for key, (low, high) in (limits or {}).items():
+        value = args.get(key)
+        if not isinstance(value, int) or not low <= value <= high:
+            return False
+    return True
+
+class SceneNames:
+    """
+    Scene names the WiZ server knows (from list_scenes), refreshed at most every
+    SCENE_CACHE_SECONDS, so "the crime scene" goes to Archestra instead of apply_scene.
+    """
+    def __init__(self):
+        self.names = set()
+        self.fetched = None
+
+    @staticmethod
+    def key(name: str):
+        # Same matching as the WiZ server's SceneBook: case-insensitive, spaces and underscores alike
+        return "_".join(name.lower().split())
+
+    async def known(self, name: str):
+        if self.fetched is None or time.monotonic() - self.fetched >= SCENE_CACHE_SECONDS:
+            try:
+                async with metrics.device("mcp_tool", "wiz.list_scenes"):
+                    text, is_error = await asyncio.wait_for(call_tool(MCP_SERVER_URLS["wiz"], "list_scenes", {}, FAST_PATH_TIMEOUT), FAST_PATH_TIMEOUT)
+                if is_error:
+                    raise ValueError(text)
+                self.names = {self.key(scene) for scene in json.loads(text)["scenes"]}
+                self.fetched = time.monotonic()
+            except Exception as e:
+                logger.warning("Could not list scenes (%s); sending scene commands to Archestra", e)
+                return False
+        return self.key(name) in self.names
+
+def render_tool_reply(text: str, is_error: bool):
+    """
+    A short confirmation for a fast-path tool result, or None if the tool reported a
+    failure (isError, "Error..." text, ok: false, or nothing in a fan-out succeeded).
+    Structured results (scenes, group commands, the switch queue) are summarized
+    rather than posted as JSON.
+    """
+    if is_error or text.startswith("Error"):
+        return None
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return text or "Done."
+    if not isinstance(data, dict):
+        return text or "Done."
+    if data.get("ok") is False:
+        return None
+    if "succeeded" in data and isinstance(data.get("results"), dict):
+        # Scene or group fan-out: one result per bulb (and the switch)
+        if not data["succeeded"]:
+            return None
+        label = f"Scene '{data['scene']}'" if "scene" in data else f"Group '{data.get('group')}'"
+        total = data["succeeded"] + data["failed"]
+        reply = f"{label}: {data['succeeded']} of {total} set."
+        failed = [f"{device} ({result.get('error', 'failed')})" for device, result in data["results"].items() if not result.get("ok")]
+        if failed:
+            reply += f" Failed: {', '.join(failed)}."
+        return reply
+    result = data.get("result")
+    return result if isinstance(result, str) and result else "Done."
+
+class RouteStats:
+    """Which path each message took (fast path vs. Archestra) and how long it took."""
+    def __init__(self, window: int = 500):
+        self.counts = {"fast_path": 0, "archestra": 0, "fast_path_fallback": 0}
+        self.latencies = {"fast_path": deque(maxlen=window), "archestra": deque(maxlen=window)}
+
+    def record(self, path: str, seconds: float):
+        self.counts[path] += 1
+        self.latencies[path].append(seconds)
+
+    def stats(self):
+        total = self.counts["fast_path"] + self.counts["archestra"]
+        report = {
+            **self.counts,
+            "fast_path_share": round(self.counts["fast_path"] / total, 3) if total else None,
+        }
+        for path, values in self.latencies.items():
+            ordered = sorted(values)
+            report[f"{path}_p50_ms"] = round(ordered[len(ordered) // 2] * 1000) if ordered else None
+            report[f"{path}_p95_ms"] = round(ordered[int(len(ordered) * 0.95)] * 1000) if ordered else None
+        return report
+
+fast_path_rules = load_fast_path_rules() if FAST_PATH_ENABLED else []
+scene_names = SceneNames()
+route_stats = RouteStats()
+# chat id -> trace id of its latest message, for /trace
+last_traces = {}
+
+async def try_fast_path(user_text: str):
+    """
+    Run user_text as a direct tool call if it matches a fast path rule. Returns the
+    reply, or None when the message should go to Archestra (no match, the MCP
+    server couldn't be reached, or the tool reported an error).
+    """
+    route = match_fast_path(user_text, fast_path_rules)
+    if not route:
+        return None
+    server, tool, arguments = route
+    if tool == "apply_scene" and not await scene_names.known(arguments.get("name", "")):
+        return None
+    try:
+        async with metrics.device("mcp_tool", f"{server}.{tool}"):
+            text, is_error = await asyncio.wait_for(call_tool(MCP_SERVER_URLS[server], tool, arguments, FAST_PATH_TIMEOUT), FAST_PATH_TIMEOUT)
+    except Exception as e:
+        logger.warning("Fast path %s.%s failed (%s), falling back to Archestra", server, tool, e)
+        route_stats.counts["fast_path_fallback"] += 1
+        return None
+    reply = render_tool_reply(text, is_error)
+    if reply is None:
+        logger.warning("Fast path %s.%s(%s) reported an error (%s), falling back to Archestra", server, tool, arguments, text)
+        route_stats.counts["fast_path_fallback"] += 1
+        return None
+    logger.info("Fast path: %r -> %s.%s(%s)", user_text, server, tool, arguments)
+    return reply
+
+def is_authorized(update: Update):
+    chat_id = str(update.effective_chat.id)
+    # Optional Security: Only respond to the authorized user
+    if ALLOWED_CHAT_ID and chat_id != str(ALLOWED_CHAT_ID):
+        logger.warning("Unauthorized access attempt from Chat ID %s", chat_id)
+        return False
+    return True
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     Callback for incoming Telegram messages.
+    Hands the message to the dispatcher and returns right away, so one slow agent
+    run never holds up messages from other chats.
     """
     user_text = update.message.text
     chat_id = str(update.effective_chat.id)
     
-    # Optional Security: Only respond to the authorized user
-    if ALLOWED_CHAT_ID and chat_id != str(ALLOWED_CHAT_ID):
-        print(f"Gateway: Unauthorized access attempt from Chat ID {chat_id}")
+    if not is_authorized(update):
         return
 
     if not user_text:
         return
 
-    # Send a typing indicator or "Processing..." message if needed
-    placeholder_msg = await update.message.reply_text("Thinking...")
+    if dispatcher.full():
+        dispatcher.rejected += 1
+        await update.message.reply_text("I'm busy with too many requests right now. Please try again in a moment.")
+        return
 
-    # Forward to Archestra
-    reply_from_archestra = await forward_to_archestra(user_text)
+    # Each message is one trace; Telegram only dates messages to the second, so its delay is approximate
+    root = tracer.start(
+        "gateway.message", root=True, chat_id=chat_id, chars=len(user_text),
+        telegram_delay_s=round(time.time() - update.message.date.timestamp()),
+        ingress="webhook" if webhook and webhook.active else "polling",
+    )
+    arrived = webhook.arrivals.pop(update.update_id, None) if webhook else None
+    if arrived is not None:
+        root.set(webhook_wait_ms=round((time.perf_counter() - arrived) * 1000, 2))
+    last_traces[chat_id] = root.trace_id
+    try:
+        with tracer.activate(root):
+            # Send a typing indicator or "Processing..." message if needed
+            position = dispatcher.position(chat_id)
+            with tracer.span("telegram.placeholder"):
+                placeholder_msg = await update.message.reply_text(f"Queued (position {position})..." if position else "Thinking...")
+            waiting = tracer.start("gateway.queue", position=position)
+    except BaseException as e:
+        root.end(type(e).__name__)
+        raise
+    dispatcher.submit(chat_id, lambda: process_message(update, context, placeholder_msg, user_text, queued=bool(position), trace=(root, waiting)))
+
+async def handle_queue_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    /queue: report how many agent runs are in flight and waiting.
+    """
+    if not is_authorized(update):
+        return
+    stats = dispatcher.stats()
+    await update.message.reply_text(
+        f"In flight: {stats['in_flight']}/{stats['max_concurrent']}\n"
+        f"Queued: {stats['queued']}/{stats['max_queued']}\n"
+        f"Active chats: {stats['chats_active']}\n"
+        f"Completed: {stats['completed']}, turned away: {stats['rejected']}\n"
+        + (f"Ingress: webhook, {webhook.received} updates, {webhook.duplicates} redelivered, {webhook.rejected} refused"
+           if webhook and webhook.active else "Ingress: polling")
+    )
+
+async def handle_routes_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    /routes: report how many messages the fast path handled versus Archestra, and their latency.
+    """
+    if not is_authorized(update):
+        return
+    stats = route_stats.stats()
+    share = f"{stats['fast_path_share']:.0%}" if stats["fast_path_share"] is not None else "n/a"
+    await update.message.reply_text(
+        f"Fast path: {stats['fast_path']} ({share}), p50 {stats['fast_path_p50_ms']} ms, p95 {stats['fast_path_p95_ms']} ms\n"
+        f"Archestra: {stats['archestra']}, p50 {stats['archestra_p50_ms']} ms, p95 {stats['archestra_p95_ms']} ms\n"
+        f"Fast path fell back to Archestra: {stats['fast_path_fallback']}"
+    )
+
+async def handle_trace_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    /trace [trace id]: latency breakdown of this chat's last message (or the given trace),
+    including the spans the MCP servers recorded for it.
+    """
+    if not is_authorized(update):
+        return
+    trace_id = context.args[0] if context.args else last_traces.get(str(update.effective_chat.id))
+    if not trace_id:
+        await update.message.reply_text("No traced messages yet.")
+        return
+    spans = await asyncio.to_thread(read_spans, tracer.path, trace_id)
+    text = format_breakdown(breakdown(spans, trace_id))
+    if len(text) > TELEGRAM_MAX_TEXT:
+        text = text[:TELEGRAM_MAX_TEXT - 1] + "…"
+    await update.message.reply_text(text)
+
+async def process_message(update: Update, context: ContextTypes.DEFAULT_TYPE, placeholder_msg, user_text: str, queued: bool = False, trace=None):
+    """
+    Runs one message through the fast path or Archestra and puts the reply in its placeholder.
+    trace is (root span of the message, span timing its wait in the dispatcher queue).
+    """
+    root, waiting = trace or (tracer.start("gateway.message", root=True), None)
+    if waiting:
+        waiting.end()
+    try:
+        with tracer.activate(root):
+            await answer_message(update, context, placeholder_msg, user_text, queued, root)
+    except BaseException as e:
+        root.end(type(e).__name__)
+        raise
+    finally:
+        root.end()
+
+async def answer_message(update: Update, context: ContextTypes.DEFAULT_TYPE, placeholder_msg, user_text: str, queued: bool, root):
+    if queued:
+        try:
+            with tracer.span("telegram.placeholder"):
+                await placeholder_msg.edit_text("Thinking...")
+        except Exception as e:
+            logger.warning("Failed to update queued placeholder: %s", e)
+
+    # Simple device commands skip the agent entirely
+    started = time.perf_counter()
+    editor = PlaceholderEditor(context.bot, update.effective_chat.id, placeholder_msg.message_id)
+    reply_from_archestra = await try_fast_path(user_text) if fast_path_rules else None
+    if reply_from_archestra is not None:
+        route_stats.record("fast_path", time.perf_counter() - started)
+        root.set(route="fast_path")
+    else:
+        # Forward to Archestra, streaming partial output into the placeholder when possible
+        if ARCHESTRA_STREAMING:
+            reply_from_archestra = await stream_from_archestra(user_text, editor.update)
+        else:
+            reply_from_archestra = await forward_to_archestra(user_text)
+        route_stats.record("archestra", time.perf_counter() - started)
+        root.set(route="archestra")
 
     # Handle empty responses (actions without text)
     if not reply_from_archestra or not reply_from_archestra.strip():
         reply_from_archestra = "[SUCCESS] Action executed (no text reply)."
 
-    # Send the reply back to Telegram
-    try:
-        await context.bot.edit_message_text(
-            chat_id=update.effective_chat.id,
-            message_id=placeholder_msg.message_id,
-            text=reply_from_archestra
-        )
-    except Exception as e:
-        print(f"Gateway: Failed to edit message: {e}")
-        # Fallback if edit fails
-        await context.bot.send_message(
-            chat_id=update.effective_chat.id,
-            text=reply_from_archestra
-        )
+    # Send the reply back to Telegram, leaving the edit gap Telegram expects after a progressive edit
+    with tracer.span("telegram.reply", chars=len(reply_from_archestra)):
+        if editor.shown:
+            await asyncio.sleep(max(0.0, editor.next_edit - time.monotonic()))
+        try:
+            await context.bot.edit_message_text(
+                chat_id=update.effective_chat.id,
+                message_id=placeholder_msg.message_id,
+                text=reply_from_archestra
+            )
+        except Exception as e:
+            logger.warning("Failed to edit message: %s", e)
+            # Fallback if edit fails
+            await context.bot.send_message(
+                chat_id=update.effective_chat.id,
+                text=reply_from_archestra
+            )
+
+class WebhookIngress:
+    """
+    Local HTTP listener for updates Telegram pushes to the webhook. Requests without the
+    secret token are refused; accepted updates go onto the application's update queue
+    and are acknowledged with 200 straight away, so Telegram never waits on a handler.
+    Telegram redelivers an update until it gets a 2xx, so repeats are dropped by update_id.
+    """
+    def __init__(self, application, path: str, secret: str):
+        self.application = application
+        self.path = path
+        self.secret = secret.encode()
+        self.active = False
+        self.server = None
+        self.task = None
+        self.recent = deque(maxlen=1000)  # update ids already queued
+        self.arrivals = {}  # update_id -> perf_counter() at arrival, until handle_message picks it up
+        self.received = 0
+        self.duplicates = 0
+        self.rejected = 0
+
+    async def handle(self, request):
+        from starlette.responses import Response
+        started = time.perf_counter()
+        token = request.headers.get("x-telegram-bot-api-secret-token", "").encode()
+        if not hmac.compare_digest(token, self.secret):
+            self.rejected += 1
+            metrics.record("telegram_webhook", time.perf_counter() - started, "Forbidden")
+            return Response(status_code=403)
+        try:
+            update = Update.de_json(await request.json(), self.application.bot)
+        except (ValueError, TypeError, KeyError) as e:
+            logger.warning("Ignoring malformed webhook update: %s", e)
+            metrics.record("telegram_webhook", time.perf_counter() - started, type(e).__name__)
+            return Response(status_code=400)
+        if update.update_id in self.recent:
+            self.duplicates += 1
+        else:
+            self.recent.append(update.update_id)
+            self.arrivals[update.update_id] = started
+            if len(self.arrivals) > self.recent.maxlen:
+                # Updates no message handler picked up (commands, edits) would otherwise stay here
+                self.arrivals.pop(next(iter(self.arrivals)))
+            self.received += 1
+            self.application.update_queue.put_nowait(update)
+        metrics.record("telegram_webhook", time.perf_counter() - started)
+        return Response(status_code=200)
+
+    async def start(self, host: str, port: int):
+        import uvicorn
+        from starlette.applications import Starlette
+        from starlette.routing import Route
+
+        class Server(uvicorn.Server):
+            """Leaves SIGINT/SIGTERM to run_webhook, which stops the bot and the listener together."""
+            @contextlib.contextmanager
+            def capture_signals(self):
+                yield
+
+        app = Starlette(routes=[Route(self.path, self.handle, methods=["POST"])])
+        self.server = Server(uvicorn.Config(app, host=host, port=port, lifespan="off", log_level="warning", access_log=False))
+        # Bound here because uvicorn calls sys.exit when it can't bind; this raises OSError instead
+        sock = socket.create_server((host, port))
+        self.task = asyncio.create_task(self.server.serve(sockets=[sock]))
+        while not self.server.started:
+            if self.task.done():
+                raise OSError(f"Webhook listener could not start on {host}:{port}")
+            await asyncio.sleep(0.01)
+        logger.info("Webhook listener on http://%s:%s%s", host, port, self.path)
+
+    async def stop(self):
+        self.active = False
+        if self.task and not self.task.done():
+            self.server.should_exit = True
+            with contextlib.suppress(BaseException):
+                await self.task
+
+webhook = None
+
+async def watch_webhook(application):
+    """
+    Switch to polling once getWebhookInfo shows updates stuck behind a failed delivery
+    (or the webhook gone) WEBHOOK_MAX_FAILED_CHECKS checks in a row, e.g. when the
+    tunnel or reverse proxy in front of the listener is down.
+    """
+    failed = 0
+    # Telegram dates errors to the second; older ones were for an earlier webhook
+    since = int(time.time())
+    while True:
+        await asyncio.sleep(WEBHOOK_CHECK_INTERVAL)
+        try:
+            info = await application.bot.get_webhook_info()
+        except TelegramError as e:
+            logger.warning("getWebhookInfo failed: %s", e)
+            continue
+        errored = info.last_error_date is not None and info.last_error_date.timestamp() >= since
+        # Pending updates drain once a delivery gets through, so both together mean we're stuck
+        if info.url != WEBHOOK_URL or (errored and info.pending_update_count):
+            failed += 1
+            logger.warning("Webhook delivery failing (%s/%s): %s", failed, WEBHOOK_MAX_FAILED_CHECKS, info.last_error_message or "webhook not set")
+        else:
+            failed = 0
+        if failed >= WEBHOOK_MAX_FAILED_CHECKS:
+            logger.error("Telegram can't reach the webhook; switching to polling")
+            webhook.active = False
+            # start_polling deletes the webhook, so the updates Telegram is holding come in through getUpdates
+            await application.updater.start_polling()
+            return
+
+async def run_webhook(application):
+    """
+    Webhook ingress: each update is handled as soon as Telegram sends it instead of on the
+    next long-poll response. Falls back to polling when the listener or the webhook can't
+    be set up, and when Telegram stops being able to deliver to it.
+    """
+    global webhook
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    webhook = WebhookIngress(application, urlsplit(WEBHOOK_URL).path or "/", WEBHOOK_SECRET)
+    watchdog = None
+    # run_polling would call these hooks itself
+    await start_metrics(application)
+    async with application:
+        await application.start()
+        try:
+            await webhook.start(WEBHOOK_LISTEN, WEBHOOK_PORT)
+            await application.bot.set_webhook(WEBHOOK_URL, secret_token=WEBHOOK_SECRET)
+            webhook.active = True
+            logger.info("Receiving updates by webhook at %s", WEBHOOK_URL)
+            if WEBHOOK_CHECK_INTERVAL:
+                watchdog = asyncio.create_task(watch_webhook(application))
+        except (OSError, TelegramError) as e:
+            logger.error("Webhook setup failed (%s); falling back to polling", e)
+            await webhook.stop()
+            await application.updater.start_polling()
+        await stop.wait()
+        if watchdog:
+            watchdog.cancel()
+        if application.updater.running:
+            await application.updater.stop()
+        await webhook.stop()
+        await application.stop()
+    await close_client(application)
 
 if __name__ == "__main__":
     if not BOT_TOKEN or not ARCHESTRA_AGENT_ID or not ARCHESTRA_API_KEY:
@@ -132,10 +961,17 @@ if __name__ == "__main__":
     print(f"Starting Telegram-Archestra Gateway Bot...")
     print(f"Target Agent: {ARCHESTRA_AGENT_ID}")
 
-    application = ApplicationBuilder().token(BOT_TOKEN).build()
+    setup_logging()
+    application = ApplicationBuilder().token(BOT_TOKEN).base_url(TELEGRAM_API_URL).post_init(start_metrics).post_shutdown(close_client).build()
     
     # Listen for all text messages
     text_handler = MessageHandler(filters.TEXT & (~filters.COMMAND), handle_message)
     application.add_handler(text_handler)
+    application.add_handler(CommandHandler("queue", handle_queue_command))
+    application.add_handler(CommandHandler("routes", handle_routes_command))
+    application.add_handler(CommandHandler("trace", handle_trace_command))
     
-    application.run_polling()
+    if WEBHOOK_URL:
+        asyncio.run(run_webhook(application))
+    else:
+        application.run_polling()
@@ -1,10 +1,333 @@
 from mcp.server.fastmcp import FastMCP
 import asyncio
+import heapq
+import json
+import os
+import sqlite3
+import sys
 import time
-from datetime import datetime
+import uuid
+from datetime import datetime, timedelta
 import argparse
+from dotenv import load_dotenv
+
+# Shared helpers (mcp_client, mcp_metrics, mcp_tracing) live one directory up
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from mcp_client import call_tool
+from mcp_metrics import Metrics
+from mcp_tracing import Tracer
+
+load_dotenv()
 
 mcp = FastMCP("Timekeeper Agent")
+tracer = Tracer("timekeeper")
+metrics = Metrics("timekeeper", tracer=tracer).instrument(mcp)
+
+# Where scheduled jobs are stored so they survive restarts; relative paths are taken from this directory
+DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.getenv("TIMEKEEPER_DB", "timekeeper.db"))
+# Jobs that were due while the server was down fire on startup if they are at most this many seconds late
+MISFIRE_GRACE = float(os.getenv("TIMEKEEPER_MISFIRE_GRACE", "3600"))
+# wait_for_duration holds the MCP request open, so it refuses longer waits in favour of schedule_in
+MAX_WAIT_SECONDS = int(os.getenv("TIMEKEEPER_MAX_WAIT", "60"))
+ACTION_TIMEOUT = float(os.getenv("TIMEKEEPER_ACTION_TIMEOUT", "60"))
+MCP_SERVER_URLS = {
+    "wiz": os.getenv("WIZ_MCP_URL", "http://localhost:8001/mcp"),
+    "telegram": os.getenv("TELEGRAM_MCP_URL", "http://localhost:8003/mcp"),
+    "servo": os.getenv("SERVO_MCP_URL", "http://localhost:8004/mcp"),
+}
+# When the servers share a process (mcp_host.py), their FastMCP instances are
+# registered here and job actions call them directly instead of over HTTP
+local_servers = {}
+
+class CronSchedule:
+    """
+    Standard 5-field cron expression (minute hour day-of-month month day-of-week) in
+    local time. Fields take *, lists, ranges and steps; Sunday is 0 or 7.
+    """
+    FIELDS = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+
+    def __init__(self, expression: str):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError("Cron expressions need 5 fields: minute hour day-of-month month day-of-week")
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, weekdays = (
+            self._parse(field, low, high) for field, (low, high) in zip(fields, self.FIELDS)
+        )
+        self.weekdays = {d % 7 for d in weekdays}
+        self.any_day = fields[2] == "*"
+        self.any_weekday = fields[4] == "*"
+
+    @staticmethod
+    def _parse(field: str, low: int, high: int):
+        values = set()
+        for part in field.split(","):
+            step = 1
+            if "/" in part:
+                part, step = part.split("/")
+                step = int(step)
+            if part == "*":
+                start, end = low, high
+            elif "-" in part:
+                start, end = (int(v) for v in part.split("-"))
+            else:
+                start = int(part)
+                end = high if step > 1 else start
+            if not low <= start <= end <= high or step < 1:
+                raise ValueError(f"Invalid cron field '{field}' (allowed {low}-{high})")
+            values.update(range(start, end + 1, step))
+        return values
+
+    def _day_matches(self, dt: datetime):
+        # Like cron: when both day fields are restricted, either one matching is enough
+        day = dt.day in self.days
+        weekday = dt.isoweekday() % 7 in self.weekdays
+        if self.any_day and self.any_weekday:
+            return True
+        if self.any_day:
+            return weekday
+        if self.any_weekday:
+            return day
+        return day or weekday
+
+    def next_after(self, timestamp: float):
+        """The first matching minute strictly after timestamp, as a Unix timestamp."""
+        dt = datetime.fromtimestamp(timestamp).replace(second=0, microsecond=0) + timedelta(minutes=1)
+        for _ in range(50000):
+            if dt.month not in self.months:
+                dt = (dt.replace(day=1, hour=0, minute=0) + timedelta(days=32)).replace(day=1)
+            elif not self._day_matches(dt):
+                dt = dt.replace(hour=0, minute=0) + timedelta(days=1)
+            elif dt.hour not in self.hours:
+                dt = dt.replace(minute=0) + timedelta(hours=1)
+            elif dt.minute not in self.minutes:
+                dt += timedelta(minutes=1)
+            else:
+                return dt.timestamp()
+        raise ValueError(f"Cron expression '{self.expression}' never fires")
+
+async def run_action(action: dict):
+    server = action["server"]
+    try:
+        async with metrics.device("mcp_tool", f"{server}.{action['tool']}"):
+            text, is_error = await asyncio.wait_for(
+                call_tool(MCP_SERVER_URLS[server], action["tool"], action.get("arguments") or {}, ACTION_TIMEOUT, local=local_servers.get(server)),
+                ACTION_TIMEOUT,
+            )
+        # Most tools here report failures as text rather than as MCP errors
+        return text, is_error or text.startswith("Error")
+    except Exception as e:
+        return f"Error: {type(e).__name__}: {e}", True
+
+class Scheduler:
+    """
+    Pending jobs live in one heap ordered by next run time and a single loop sleeps
+    until the earliest one, so thousands of timers cost no coroutines until they fire.
+    Every change is written to SQLite; on startup jobs that came due while the server
+    was down fire once if they are within MISFIRE_GRACE, and are marked missed (or, if
+    recurring, moved to their next run) otherwise.
+    """
+    def __init__(self, path: str, execute):
+        self.path = path
+        self.execute = execute
+        self.db = None
+        self.jobs = {}  # job_id -> job dict, for jobs still scheduled
+        self.crons = {}  # job_id -> CronSchedule
+        self.heap = []  # (next_run, job_id); stale entries are skipped when popped
+        self.wake = None
+        self.loop_task = None
+        self.running = set()
+        self.fired = 0
+        self.caught_up = 0
+        self.missed = 0
+
+    def open(self):
+        if self.db:
+            return
+        self.db = sqlite3.connect(self.path)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute(
+            """CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                name TEXT,
+                cron TEXT,
+                next_run REAL,
+                action TEXT NOT NULL,
+                status TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_run REAL,
+                last_result TEXT,
+                run_count INTEGER NOT NULL DEFAULT 0
+            )"""
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, next_run)")
+        self.db.commit()
+
+    async def start(self):
+        self.open()
+        self.wake = asyncio.Event()
+        now = time.time()
+        for row in self.db.execute("SELECT * FROM jobs WHERE status IN ('scheduled', 'running')").fetchall():
+            job = dict(row)
+            job["action"] = json.loads(job["action"])
+            if job["cron"]:
+                self.crons[job["id"]] = CronSchedule(job["cron"])
+            if job["next_run"] < now - MISFIRE_GRACE:
+                self.missed += 1
+                if not job["cron"]:
+                    job["status"] = "missed"
+                    self._save(job)
+                    continue
+                job["next_run"] = self.crons[job["id"]].next_after(now)
+            elif job["next_run"] <= now:
+                self.caught_up += 1
+            job["status"] = "scheduled"
+            self._save(job)
+            self.jobs[job["id"]] = job
+            heapq.heappush(self.heap, (job["next_run"], job["id"]))
+        self.loop_task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self.loop_task:
+            self.loop_task.cancel()
+        for task in list(self.running):
+            task.cancel()
+        if self.db:
+            self.db.close()
+            self.db = None
+
+    def _save(self, job: dict):
+        self.db.execute(
+            "INSERT OR REPLACE INTO jobs (id, name, cron, next_run, action, status, created_at, last_run, last_result, run_count) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (job["id"], job["name"], job["cron"], job["next_run"], json.dumps(job["action"]), job["status"],
+             job["created_at"], job["last_run"], job["last_result"], job["run_count"]),
+        )
+        self.db.commit()
+
+    def add(self, action: dict, next_run: float, name: str = None, cron: str = None):
+        self.open()
+        job = {
+            "id": uuid.uuid4().hex[:8],
+            "name": name,
+            "cron": cron,
+            "next_run": next_run,
+            "action": action,
+            "status": "scheduled",
+            "created_at": time.time(),
+            "last_run": None,
+            "last_result": None,
+            "run_count": 0,
+        }
+        if cron:
+            self.crons[job["id"]] = CronSchedule(cron)
+        self._save(job)
+        self._schedule(job)
+        return job
+
+    def _schedule(self, job: dict):
+        self.jobs[job["id"]] = job
+        heapq.heappush(self.heap, (job["next_run"], job["id"]))
+        # Only an earlier deadline than the one the loop is sleeping on needs to wake it
+        if self.wake and self.heap[0][1] == job["id"]:
+            self.wake.set()
+
+    def cancel(self, job_id: str):
+        job = self.jobs.pop(job_id, None)
+        if job is None:
+            return None
+        self.crons.pop(job_id, None)
+        job["status"] = "cancelled"
+        self._save(job)
+        return job
+
+    async def _run(self):
+        while True:
+            now = time.time()
+            while self.heap and self.heap[0][0] <= now:
+                next_run, job_id = heapq.heappop(self.heap)
+                job = self.jobs.get(job_id)
+                if job is None or job["next_run"] != next_run:
+                    continue
+                self._fire(job, now)
+            self.wake.clear()
+            # Re-check at least once a minute in case the wall clock jumps
+            timeout = min(60.0, self.heap[0][0] - time.time()) if self.heap else 60.0
+            try:
+                await asyncio.wait_for(self.wake.wait(), max(0.0, timeout))
+            except asyncio.TimeoutError:
+                pass
+
+    def _fire(self, job: dict, now: float):
+        self.fired += 1
+        job["run_count"] += 1
+        job["last_run"] = now
+        if job["cron"]:
+            job["next_run"] = self.crons[job["id"]].next_after(now)
+            self._schedule(job)
+        else:
+            job["status"] = "running"
+        self._save(job)
+        task = asyncio.create_task(self._execute(job))
+        self.running.add(task)
+        task.add_done_callback(self.running.discard)
+
+    async def _execute(self, job: dict):
+        # Each run is its own trace; calls to other servers continue it
+        with tracer.span("timekeeper.job", root=True, job_id=job["id"], job_name=job["name"], run=job["run_count"]) as span:
+            text, is_error = await self.execute(job["action"])
+            if is_error:
+                span.error = "ErrorResult"
+        job["last_result"] = text[:500]
+        # cancel() may have run while the action was in flight; the cancellation stands
+        cancelled = job["status"] == "cancelled"
+        if not job["cron"] and not cancelled:
+            self.jobs.pop(job["id"], None)
+            job["status"] = "failed" if is_error else "done"
+        if self.db and (cancelled or job["cron"] is None or job["id"] in self.jobs):
+            self._save(job)
+
+    def describe(self, job: dict):
+        return {
+            "job_id": job["id"],
+            "name": job["name"],
+            "cron": job["cron"],
+            "next_run": datetime.fromtimestamp(job["next_run"]).isoformat(timespec="seconds") if job["status"] == "scheduled" else None,
+            "status": job["status"],
+            "action": job["action"],
+            "run_count": job["run_count"],
+            "last_run": datetime.fromtimestamp(job["last_run"]).isoformat(timespec="seconds") if job["last_run"] else None,
+            "last_result": job["last_result"],
+        }
+
+    def finished(self, limit: int):
+        rows = self.db.execute(
+            "SELECT * FROM jobs WHERE status NOT IN ('scheduled', 'running') ORDER BY COALESCE(last_run, created_at) DESC LIMIT ?",
+            (limit,),
+        ).fetchall()
+        return [self.describe(dict(row, action=json.loads(row["action"]))) for row in rows]
+
+    def stats(self):
+        return {
+            "scheduled": len(self.jobs),
+            "running": len(self.running),
+            "fired": self.fired,
+            "caught_up_on_start": self.caught_up,
+            "missed_on_start": self.missed,
+        }
+
+scheduler = Scheduler(DB_PATH, run_action)
+
+def build_action(message: str = None, tool: str = None, server: str = None, arguments: dict = None):
+    """A Telegram message, or a call to a tool on one of the MCP servers."""
+    if message is not None:
+        return {"server": "telegram", "tool": "telegram_send", "arguments": {"message": message}}
+    if not tool or not server:
+        raise ValueError("Give either a message, or a tool and the server it lives on")
+    if server not in MCP_SERVER_URLS:
+        raise ValueError(f"Unknown server '{server}'. Available: {', '.join(MCP_SERVER_URLS)}")
+    return {"server": server, "tool": tool, "arguments": arguments or {}}
 
 @mcp.tool()
 async def get_current_time():
@@ -15,12 +338,117 @@ async def get_current_time():
 async def wait_for_duration(seconds: int):
     """
     Waits for a specified duration in seconds.
-    Useful for creating delays in workflows.
+    Useful for short delays in workflows (up to TIMEKEEPER_MAX_WAIT, 60s by default);
+    for anything longer use schedule_in, which doesn't hold the request open.
     """
+    if seconds > MAX_WAIT_SECONDS:
+        return f"Error: wait_for_duration is limited to {MAX_WAIT_SECONDS} seconds. Use schedule_in to run something after {seconds} seconds."
     print(f"Timekeeper: Waiting for {seconds} seconds...")
     await asyncio.sleep(seconds)
     return f"Time is up. Waited for {seconds} seconds."
 
+@mcp.tool()
+async def schedule_in(seconds: float, message: str = None, tool: str = None, server: str = None, arguments: dict = None, name: str = None):
+    """
+    Schedule a Telegram message or an MCP tool call to run after a delay. Returns immediately.
+    :param seconds: How long from now to run it.
+    :param message: Text to send to the user on Telegram (e.g. a reminder).
+    :param tool: Instead of a message, the name of a tool to call (e.g. 'turn_off').
+    :param server: The server the tool lives on: 'wiz', 'servo' or 'telegram'.
+    :param arguments: Arguments for the tool.
+    :param name: Optional label shown in list_jobs.
+    Returns the scheduled job with its id.
+    """
+    try:
+        action = build_action(message, tool, server, arguments)
+    except ValueError as e:
+        return f"Error: {str(e)}"
+    return scheduler.describe(scheduler.add(action, time.time() + seconds, name))
+
+@mcp.tool()
+async def schedule_at(when: str, message: str = None, tool: str = None, server: str = None, arguments: dict = None, name: str = None):
+    """
+    Schedule a Telegram message or an MCP tool call for a specific time. Returns immediately.
+    :param when: ISO 8601 date and time, e.g. '2025-06-01T07:30:00'. Local time unless an offset is given.
+    :param message: Text to send to the user on Telegram.
+    :param tool: Instead of a message, the name of a tool to call.
+    :param server: The server the tool lives on: 'wiz', 'servo' or 'telegram'.
+    :param arguments: Arguments for the tool.
+    :param name: Optional label shown in list_jobs.
+    Returns the scheduled job with its id.
+    """
+    try:
+        run_at = datetime.fromisoformat(when).timestamp()
+        action = build_action(message, tool, server, arguments)
+    except ValueError as e:
+        return f"Error: {str(e)}"
+    return scheduler.describe(scheduler.add(action, run_at, name))
+
+@mcp.tool()
+async def schedule_recurring(cron: str, message: str = None, tool: str = None, server: str = None, arguments: dict = None, name: str = None):
+    """
+    Schedule a Telegram message or an MCP tool call on a recurring cron schedule (local time).
+    :param cron: 5-field cron expression: minute hour day-of-month month day-of-week,
+                 e.g. '30 7 * * 1-5' for 07:30 on weekdays.
+    :param message: Text to send to the user on Telegram.
+    :param tool: Instead of a message, the name of a tool to call.
+    :param server: The server the tool lives on: 'wiz', 'servo' or 'telegram'.
+    :param arguments: Arguments for the tool.
+    :param name: Optional label shown in list_jobs.
+    Returns the scheduled job with its id and next run time.
+    """
+    try:
+        next_run = CronSchedule(cron).next_after(time.time())
+        action = build_action(message, tool, server, arguments)
+    except ValueError as e:
+        return f"Error: {str(e)}"
+    return scheduler.describe(scheduler.add(action, next_run, name, cron))
+
+@mcp.tool()
+async def list_jobs(include_finished: bool = False, limit: int = 50):
+    """
+    List scheduled jobs, soonest first.
+    :param include_finished: Also list done, failed, missed and cancelled jobs. Default False.
+    :param limit: Maximum number of jobs in each list. Default 50.
+    """
+    scheduler.open()
+    pending = sorted(scheduler.jobs.values(), key=lambda job: job["next_run"])[:limit]
+    report = {"jobs": [scheduler.describe(job) for job in pending], "stats": scheduler.stats()}
+    if include_finished:
+        report["finished"] = scheduler.finished(limit)
+    return report
+
+@mcp.tool()
+async def cancel_job(job_id: str):
+    """
+    Cancel a scheduled job.
+    :param job_id: The id returned when the job was scheduled.
+    """
+    job = scheduler.cancel(job_id)
+    if job is None:
+        return f"Error: No scheduled job with id '{job_id}'"
+    return scheduler.describe(job)
+
+async def startup():
+    """Load stored jobs and start the scheduler loop."""
+    await scheduler.start()
+
+async def shutdown():
+    await scheduler.close()
+
+async def serve(transport: str):
+    """Run the MCP server with the scheduler loop, and stop the loop on shutdown."""
+    await startup()
+    try:
+        if transport == "sse":
+            await mcp.run_sse_async()
+        elif transport == "streamable-http":
+            await mcp.run_streamable_http_async()
+        else:
+            await mcp.run_stdio_async()
+    finally:
+        await shutdown()
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--transport", default="stdio", choices=["stdio", "sse", "streamable-http"])
@@ -38,4 +466,4 @@ if __name__ == "__main__":
         mcp.settings.transport_security = None
         print(f"Starting Timekeeper on http://0.0.0.0:{args.port}/mcp")
 
-    mcp.run(transport=args.transport)
+    asyncio.run(serve(args.transport))
@@ -1,48 +1,1082 @@
 import asyncio
+import itertools
+import json
 import os
+import statistics
+import sys
+import time
+from collections import OrderedDict, deque
 from mcp.server.fastmcp import FastMCP
-from pywizlight import wizlight, PilotBuilder, discovery
+from pywizlight import wizlight, PilotBuilder, PilotParser, discovery
+from pywizlight.exceptions import WizLightConnectionError, WizLightTimeOutError
 from dotenv import load_dotenv
 
+# Shared helpers (mcp_client, mcp_health, mcp_metrics, mcp_tracing) live one directory up
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from mcp_client import call_tool
+from mcp_health import HealthMonitor
+from mcp_metrics import Metrics
+from mcp_tracing import Tracer
+
 load_dotenv()
 
 DEFAULT_BULB_IP = os.getenv("WIZ_BULB_IP")
+# Warm connection cache: how many bulbs to keep open and how long an idle one survives
+REGISTRY_MAX_SIZE = int(os.getenv("WIZ_REGISTRY_MAX_SIZE", "32"))
+REGISTRY_IDLE_TTL = float(os.getenv("WIZ_REGISTRY_IDLE_TTL", "600"))
+# Bulb groups, e.g. "living_room=192.168.1.10,192.168.1.11;bedroom=192.168.1.12"
+GROUPS_CONFIG = os.getenv("WIZ_GROUPS", "")
+GROUP_COMMAND_TIMEOUT = float(os.getenv("WIZ_GROUP_TIMEOUT", "3"))
+# Friendly bulb names, e.g. "desk=a8bb50aabbcc;porch=192.168.1.20"
+BULB_NAMES_CONFIG = os.getenv("WIZ_BULB_NAMES", "")
+# Background discovery: seconds between scans (0 disables) and how long each scan listens
+DISCOVERY_INTERVAL = float(os.getenv("WIZ_DISCOVERY_INTERVAL", "300"))
+DISCOVERY_WAIT = float(os.getenv("WIZ_DISCOVERY_WAIT", "3"))
+DISCOVERY_BROADCAST = os.getenv("WIZ_DISCOVERY_BROADCAST", "255.255.255.255")
+# State shadow: subscribe to bulb push updates, and how old a shadow may get before we poll
+PUSH_UPDATES = os.getenv("WIZ_PUSH_UPDATES", "true").lower() == "true"
+SHADOW_MAX_AGE = float(os.getenv("WIZ_SHADOW_MAX_AGE", "30"))
+# Effect engine: step size of interpolated fades and how many finished effects to remember
+EFFECT_FADE_STEP = float(os.getenv("WIZ_EFFECT_FADE_STEP", "0.1"))
+EFFECT_HISTORY = int(os.getenv("WIZ_EFFECT_HISTORY", "50"))
+# Fast UDP path for frame effects (strobe, flash): pre-serialized setPilot datagrams on one
+# socket, optionally pipelined (not waiting for each ack); acks missing after the timeout count as lost
+FAST_UDP = os.getenv("WIZ_FAST_UDP", "true").lower() == "true"
+UDP_PIPELINE = os.getenv("WIZ_UDP_PIPELINE", "true").lower() == "true"
+UDP_ACK_TIMEOUT = float(os.getenv("WIZ_UDP_ACK_TIMEOUT", "0.5"))
+# Scenes: JSON file of named scenes (reloaded when it changes) and how long a scene waits for the wall switch
+SCENES_FILE = os.getenv("WIZ_SCENES_FILE") or os.path.join(os.path.dirname(os.path.abspath(__file__)), "scenes.json")
+SCENE_SWITCH_TIMEOUT = float(os.getenv("WIZ_SCENE_SWITCH_TIMEOUT", "10"))
+SERVO_MCP_URL = os.getenv("SERVO_MCP_URL", "http://localhost:8004/mcp")
 
 mcp = FastMCP("Wiz Bulb Server")
+tracer = Tracer("wiz")
+metrics = Metrics("wiz", tracer=tracer).instrument(mcp)
 
-async def get_light(ip_address: str = None):
-    """Helper to initialize a light object."""
-    ip = ip_address or DEFAULT_BULB_IP
+def normalize_mac(value: str):
+    """Return a MAC in the bulb's lowercase, separator-free form, or None if it isn't one."""
+    mac = value.replace(":", "").replace("-", "").lower()
+    if len(mac) == 12 and all(c in "0123456789abcdef" for c in mac):
+        return mac
+    return None
+
+class BulbRegistry:
+    """
+    Process-wide cache of warm wizlight instances.
+    Lights are keyed by IP, with MAC addresses kept as aliases so a bulb can be
+    looked up either way. Least recently used and idle lights are closed and evicted.
+    """
+    def __init__(self, max_size: int = REGISTRY_MAX_SIZE, idle_ttl: float = REGISTRY_IDLE_TTL):
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        self._lights = OrderedDict()  # ip -> (wizlight, last_used)
+        self._macs = {}  # mac -> ip
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    async def get(self, key: str, mac: str = None) -> wizlight:
+        """Return a warm light for an IP (or a known MAC), creating it on a miss."""
+        key_mac = normalize_mac(key)
+        if key_mac:
+            ip = self.ip_for(key_mac)
+            if not ip:
+                raise ValueError(f"Unknown bulb MAC {key}; run discover_bulbs first or use its IP")
+            mac = key_mac
+        else:
+            ip = key
+            mac = normalize_mac(mac) if mac else None
+
+        now = time.monotonic()
+        entry = self._lights.get(ip)
+        if entry and now - entry[1] <= self.idle_ttl:
+            self.hits += 1
+            self._lights[ip] = (entry[0], now)
+            self._lights.move_to_end(ip)
+            return entry[0]
+
+        self.misses += 1
+        if entry:
+            await self._close(ip)
+        light = wizlight(ip, mac=mac)
+        self._lights[ip] = (light, now)
+        if mac:
+            self.remember_mac(mac, ip)
+        await self.evict()
+        return light
+
+    def ip_for(self, mac: str):
+        return self._macs.get(mac)
+
+    def remember_mac(self, mac: str, ip: str):
+        """Record (or move) the IP a MAC address currently lives at."""
+        mac = normalize_mac(mac)
+        if mac:
+            self._macs[mac] = ip
+
+    async def evict(self):
+        """Close lights that have been idle past the TTL, then trim to max_size."""
+        now = time.monotonic()
+        for ip, (_, last_used) in list(self._lights.items()):
+            if now - last_used > self.idle_ttl:
+                await self._close(ip)
+        while len(self._lights) > self.max_size:
+            await self._close(next(iter(self._lights)))
+
+    async def _close(self, ip: str):
+        light, _ = self._lights.pop(ip)
+        self.evictions += 1
+        try:
+            await light.async_close()
+        except Exception as e:
+            print(f"Wiz: Failed to close connection to {ip}: {e}")
+
+    async def close(self):
+        """Close every cached light. Called on server shutdown."""
+        for ip in list(self._lights):
+            await self._close(ip)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "open": len(self._lights),
+            "max_size": self.max_size,
+            "idle_ttl_seconds": self.idle_ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / total, 3) if total else None,
+            "bulbs": list(self._lights),
+        }
+
+registry = BulbRegistry()
+
+class BulbIndex:
+    """
+    In-memory MAC -> IP index kept current by a background discovery task.
+    Each scan only looks up the model of bulbs that are new or changed address.
+    """
+    def __init__(self):
+        self.bulbs = {}  # mac -> {"ip", "model", "last_seen"}
+        self.last_scan = None
+        self.scans = 0
+        self.last_error = None
+
+    async def refresh(self, wait_time: float = DISCOVERY_WAIT):
+        """Broadcast once and merge the responses into the index. Returns the MACs that were new or moved."""
+        found = await discovery.find_wizlights(wait_time=wait_time, broadcast_address=DISCOVERY_BROADCAST)
+        now = time.time()
+        changed = []
+        for bulb in found:
+            mac = normalize_mac(bulb.mac_address) or bulb.mac_address
+            entry = self.bulbs.get(mac)
+            if entry is None or entry["ip"] != bulb.ip_address:
+                if entry:
+                    print(f"Wiz: Bulb {mac} moved from {entry['ip']} to {bulb.ip_address}")
+                entry = self.bulbs[mac] = {"ip": bulb.ip_address, "model": None, "last_seen": now}
+                registry.remember_mac(mac, bulb.ip_address)
+                changed.append(mac)
+            entry["last_seen"] = now
+        for mac in changed:
+            self.bulbs[mac]["model"] = await self._lookup_model(mac)
+        self.last_scan = now
+        self.scans += 1
+        return changed
+
+    async def _lookup_model(self, mac: str):
+        try:
+            light = await registry.get(self.bulbs[mac]["ip"], mac=mac)
+            bulbtype = await asyncio.wait_for(light.get_bulbtype(), DISCOVERY_WAIT)
+            return bulbtype.name
+        except Exception as e:
+            print(f"Wiz: Could not read model of {mac}: {e}")
+            return None
+
+    def ip_for(self, mac: str):
+        entry = self.bulbs.get(mac)
+        return entry["ip"] if entry else None
+
+    def snapshot(self):
+        now = time.time()
+        names_by_target = {}
+        for name, target in bulb_names.items():
+            names_by_target.setdefault(target, []).append(name)
+        return [
+            {
+                "mac": mac,
+                "ip": entry["ip"],
+                "model": entry["model"],
+                "names": names_by_target.get(mac, []) + names_by_target.get(entry["ip"], []),
+                "last_seen_seconds_ago": round(now - entry["last_seen"], 1),
+            }
+            for mac, entry in sorted(self.bulbs.items(), key=lambda item: item[1]["ip"])
+        ]
+
+def parse_names(config: str):
+    """Parse the WIZ_BULB_NAMES env format into {name: mac_or_ip}."""
+    names = {}
+    for entry in config.split(";"):
+        if "=" not in entry:
+            continue
+        name, target = (part.strip() for part in entry.split("=", 1))
+        if name and target:
+            names[name.lower()] = normalize_mac(target) or target
+    return names
+
+bulb_index = BulbIndex()
+bulb_names = parse_names(BULB_NAMES_CONFIG)
+
+def resolve_bulb(target: str):
+    """Resolve a friendly name, MAC or IP to the bulb's current IP address."""
+    target = bulb_names.get(target.strip().lower(), target.strip())
+    mac = normalize_mac(target)
+    if not mac:
+        return target
+    ip = bulb_index.ip_for(mac) or registry.ip_for(mac)
     if not ip:
+        raise ValueError(f"Bulb {target} has not been discovered yet; try discover_bulbs(refresh=True)")
+    return ip
+
+# Pilot keys that select the bulb's color mode; setting one mode clears the others
+COLOR_MODE_KEYS = {"r", "g", "b", "w", "c", "temp", "sceneId", "speed"}
+
+class StateShadow:
+    """
+    Last known pilot of each bulb, fed by push updates (syncPilot), polls and our own commands.
+    Lets get_status answer without a round-trip and lets set-type tools skip no-op sends.
+    """
+    def __init__(self, max_age: float = SHADOW_MAX_AGE):
+        self.max_age = max_age
+        self.entries = {}  # ip -> {"pilot", "updated", "source", "complete"}
+        self._push_pending = set()
+        self.pushes = 0
+        self.polls = 0
+        self.sent = 0
+        self.suppressed = 0
+
+    def update(self, ip: str, pilot: dict, source: str, complete: bool = True):
+        self.entries[ip] = {"pilot": dict(pilot), "updated": time.monotonic(), "source": source, "complete": complete}
+
+    def apply(self, ip: str, params: dict):
+        """
+        Merge a pilot we just sent into the shadow. Without a fresh poll or push behind
+        it the entry only holds what we sent, so it is marked incomplete.
+        """
+        pilot = self.entries[ip]["pilot"] if ip in self.entries else {}
+        if COLOR_MODE_KEYS & params.keys():
+            for key in COLOR_MODE_KEYS:
+                pilot.pop(key, None)
+        pilot.update(params)
+        self.update(ip, pilot, "command", complete=self.complete(ip))
+
+    def invalidate(self, ip: str):
+        self.entries.pop(ip, None)
+
+    def age(self, ip: str):
+        entry = self.entries.get(ip)
+        return time.monotonic() - entry["updated"] if entry else None
+
+    def fresh(self, ip: str):
+        age = self.age(ip)
+        return age is not None and age <= self.max_age
+
+    def complete(self, ip: str):
+        """True if a fresh entry has the bulb's full state, not just the values we sent."""
+        return self.fresh(ip) and self.entries[ip]["complete"]
+
+    def matches(self, ip: str, params: dict):
+        """True if a fresh shadow already has every requested pilot value."""
+        if not self.fresh(ip):
+            return False
+        pilot = self.entries[ip]["pilot"]
+        return all(pilot.get(key) == value for key, value in params.items())
+
+    async def ensure_push(self, light: wizlight):
+        """Subscribe a light to push updates once; falls back to polling if the bulb or network won't push."""
+        if not PUSH_UPDATES or light.push_running or light.ip in self._push_pending:
+            return
+        self._push_pending.add(light.ip)
+        try:
+            if not light.mac:
+                await light.getMac()
+                registry.remember_mac(light.mac, light.ip)
+
+            def on_push(states):
+                if states and states[0]:
+                    self.pushes += 1
+                    self.update(light.ip, states[0].pilotResult, "push")
+
+            if not await light.start_push(on_push):
+                print(f"Wiz: Push updates unavailable for {light.ip}, falling back to polling")
+        except Exception as e:
+            print(f"Wiz: Could not subscribe {light.ip} to push updates: {e}")
+        finally:
+            self._push_pending.discard(light.ip)
+
+    async def poll(self, light: wizlight):
+        """Fetch the live pilot and store it."""
+        async with health.guard(light.ip), metrics.device("wiz_udp", light.ip):
+            states = await light.updateState()
+        self.polls += 1
+        if states and states[0]:
+            self.update(light.ip, states[0].pilotResult, "poll")
+        return self.entries.get(light.ip)
+
+    def stats(self):
+        return {
+            "bulbs": len(self.entries),
+            "max_age_seconds": self.max_age,
+            "push_updates": self.pushes,
+            "polls": self.polls,
+            "sent": self.sent,
+            "suppressed": self.suppressed,
+        }
+
+shadow = StateShadow()
+
+async def probe_bulb(ip: str):
+    """Health probe: one getPilot round trip (without updateState's model lookup), which also refreshes the shadow."""
+    light = await registry.get(ip)
+    response = await light.send({"method": "getPilot", "params": {}})
+    if response and "result" in response:
+        shadow.update(ip, response["result"], "poll")
+
+def monitored_bulbs():
+    """Bulbs the health prober watches: the default bulb, group members and every discovered bulb."""
+    targets = set(discovered_ips())
+    for members in groups.values():
+        targets.update(members)
+    if DEFAULT_BULB_IP:
+        targets.add(DEFAULT_BULB_IP)
+    ips = set()
+    for target in targets:
+        try:
+            ips.add(resolve_bulb(target))
+        except ValueError:
+            pass
+    return ips
+
+# Only a bulb that doesn't answer counts as down; error replies (e.g. an unsupported method) come from a live bulb
+health = HealthMonitor("Bulb", probe=probe_bulb, targets=monitored_bulbs, failures=(WizLightConnectionError, WizLightTimeOutError, OSError))
+
+async def get_light(ip_address: str = None):
+    """Helper to fetch a warm light object from the registry; fails fast if the bulb is known to be offline."""
+    target = ip_address or DEFAULT_BULB_IP
+    if not target:
         raise ValueError("No IP address provided and WIZ_BULB_IP not set in environment")
-    return wizlight(ip)
+    ip = resolve_bulb(target)
+    health.check(ip)
+    light = await registry.get(ip)
+    if PUSH_UPDATES and not light.push_running:
+        asyncio.create_task(shadow.ensure_push(light))
+    return light
+
+async def apply_pilot(light: wizlight, pilot: PilotBuilder = None):
+    """
+    Turn a light on with the given pilot (or off when pilot is None),
+    unless the shadow says the bulb is already in that state.
+    Returns True if a command was sent.
+    """
+    params = dict(pilot.pilot_params, state=True) if pilot else {"state": False}
+    # A direct command wins over whatever effect is running on the bulb
+    effects.stop(light.ip, "preempted")
+    if shadow.matches(light.ip, params):
+        shadow.suppressed += 1
+        return False
+    async with health.guard(light.ip), metrics.device("wiz_udp", light.ip):
+        if pilot:
+            await light.turn_on(pilot)
+        else:
+            await light.turn_off()
+    shadow.sent += 1
+    shadow.apply(light.ip, params)
+    return True
+
+WIZ_PORT = 38899
+
+def pilot_payload(pilot: PilotBuilder = None):
+    """The setPilot datagram pywizlight would send for turn_on(pilot), or turn_off() when pilot is None."""
+    message = pilot.set_pilot_message(state=True) if pilot else {"method": "setPilot", "params": {"state": False}}
+    return json.dumps(message, separators=(",", ":")).encode()
+
+class UdpSender(asyncio.DatagramProtocol):
+    """
+    Sends pre-serialized setPilot datagrams on one shared socket, for effects that need
+    more frames per second than pywizlight's send, wait-for-ack and retry cycle allows.
+    Acks are tracked as they arrive, matched to each bulb's sends in order; a send
+    whose ack hasn't arrived within UDP_ACK_TIMEOUT counts as lost. Nothing is retried.
+    """
+    def __init__(self, ack_timeout: float = UDP_ACK_TIMEOUT):
+        self.ack_timeout = ack_timeout
+        self.transport = None
+        self.outstanding = {}  # ip -> deque of (sent_at, ack future or None)
+        self.counters = {}  # ip -> {"sent", "acked", "lost", "unmatched"}
+        self.rtts = {}  # ip -> recent ack round trips
+
+    async def start(self):
+        if self.transport is None:
+            loop = asyncio.get_running_loop()
+            self.transport, _ = await loop.create_datagram_endpoint(lambda: self, local_addr=("0.0.0.0", 0))
+
+    def counter(self, ip: str):
+        if ip not in self.counters:
+            self.counters[ip] = {"sent": 0, "acked": 0, "lost": 0, "unmatched": 0}
+            self.rtts[ip] = deque(maxlen=500)
+        return self.counters[ip]
+
+    def datagram_received(self, data, addr):
+        if b'"setPilot"' not in data:
+            return
+        ip = addr[0]
+        now = time.monotonic()
+        self._expire(ip, now)
+        pending = self.outstanding.get(ip)
+        if not pending:
+            # An ack for a send already counted as lost
+            self.counter(ip)["unmatched"] += 1
+            return
+        sent_at, waiter = pending.popleft()
+        rtt = now - sent_at
+        self.counter(ip)["acked"] += 1
+        self.rtts[ip].append(rtt)
+        metrics.observe_device("wiz_udp_fast", ip, rtt)
+        if waiter and not waiter.done():
+            waiter.set_result(rtt)
+
+    def _expire(self, ip: str, now: float):
+        pending = self.outstanding.get(ip)
+        while pending and now - pending[0][0] >= self.ack_timeout:
+            _, waiter = pending.popleft()
+            self.counter(ip)["lost"] += 1
+            if waiter and not waiter.done():
+                waiter.set_result(None)
+
+    async def send(self, ip: str, payload: bytes, wait: bool = False):
+        """
+        Send one datagram. Pipelined (wait=False) returns as soon as it is handed to the
+        socket; otherwise waits for the ack. Returns False if the ack didn't arrive in time.
+        """
+        if self.transport is None:
+            await self.start()
+        now = time.monotonic()
+        self._expire(ip, now)
+        waiter = asyncio.get_running_loop().create_future() if wait else None
+        self.outstanding.setdefault(ip, deque()).append((now, waiter))
+        self.counter(ip)["sent"] += 1
+        self.transport.sendto(payload, (ip, WIZ_PORT))
+        if not wait:
+            return True
+        try:
+            return await asyncio.wait_for(waiter, self.ack_timeout) is not None
+        except asyncio.TimeoutError:
+            self._expire(ip, time.monotonic())
+            return False
+
+    async def settle(self, ip: str):
+        """Wait up to the ack timeout for the bulb's outstanding acks; whatever is still missing is lost."""
+        deadline = time.monotonic() + self.ack_timeout
+        while self.outstanding.get(ip) and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        self._expire(ip, float("inf"))
+
+    def stats(self):
+        report = {}
+        for ip, counter in self.counters.items():
+            rtts = sorted(self.rtts[ip])
+            report[ip] = {
+                **counter,
+                "loss_rate": round(counter["lost"] / counter["sent"], 4) if counter["sent"] else None,
+                "ack_p50_ms": round(rtts[len(rtts) // 2] * 1000, 2) if rtts else None,
+                "ack_p95_ms": round(rtts[int(len(rtts) * 0.95)] * 1000, 2) if rtts else None,
+            }
+        return {"enabled": FAST_UDP, "pipelined": UDP_PIPELINE, "ack_timeout_seconds": self.ack_timeout, "bulbs": report}
+
+    def close(self):
+        if self.transport:
+            self.transport.close()
+            self.transport = None
+
+udp = UdpSender()
+
+async def discovery_loop():
+    """Background task that keeps the bulb index fresh."""
+    while True:
+        try:
+            changed = await bulb_index.refresh()
+            bulb_index.last_error = None
+            if changed:
+                print(f"Wiz: Discovery found {len(changed)} new or moved bulbs ({len(bulb_index.bulbs)} known)")
+        except Exception as e:
+            bulb_index.last_error = str(e)
+            print(f"Wiz: Background discovery failed: {e}")
+        await asyncio.sleep(DISCOVERY_INTERVAL)
+
+async def run_frames(frames, frame_period: float, total_frames: int, target: str = None):
+    """
+    Play frames (zero-arg coroutine functions) in a loop on a fixed monotonic schedule.
+    Frame i is due at start + i * frame_period, so the time a command spends on the
+    network is taken out of the following sleep instead of being added to it.
+    When we fall a whole frame behind, late frames are skipped rather than played
+    back-to-back, keeping the effect in phase and on time.
+    Each command's round trip is recorded against target (the bulb's IP) when given.
+    Returns achieved rate and jitter statistics.
+    """
+    start = time.monotonic()
+    lateness = []
+    latencies = []
+    played = skipped = 0
+    index = 0
+    while index < total_frames:
+        deadline = start + index * frame_period
+        now = time.monotonic()
+        if now > deadline + frame_period:
+            # Jump to the frame that is due now; the phase stays correct since frame = index % len(frames)
+            behind = min(int((now - start) / frame_period), total_frames) - index
+            skipped += behind
+            index += behind
+            continue
+        if now < deadline:
+            await asyncio.sleep(deadline - now)
+        sent_at = time.monotonic()
+        lateness.append(sent_at - deadline)
+        await frames[index % len(frames)]()
+        latencies.append(time.monotonic() - sent_at)
+        if target:
+            metrics.observe_device("wiz_udp", target, latencies[-1])
+        played += 1
+        index += 1
+    # Hold the final frame for its full slot so the effect lasts as long as requested
+    end = start + total_frames * frame_period
+    if time.monotonic() < end:
+        await asyncio.sleep(end - time.monotonic())
+    elapsed = time.monotonic() - start
+    cycles = played / len(frames)
+    return {
+        "target_hz": round(1.0 / (frame_period * len(frames)), 3),
+        "achieved_hz": round(cycles / elapsed, 3) if elapsed > 0 else None,
+        "elapsed_seconds": round(elapsed, 3),
+        "frames_played": played,
+        "frames_skipped": skipped,
+        "jitter_ms": round(statistics.pstdev(lateness) * 1000, 1) if lateness else None,
+        "max_late_ms": round(max(lateness) * 1000, 1) if lateness else None,
+        "avg_command_ms": round(statistics.mean(latencies) * 1000, 1) if latencies else None,
+    }
+
+async def play_frames(light: wizlight, pilots: list, frame_period: float, total_frames: int, fast: bool = FAST_UDP, pipeline: bool = UDP_PIPELINE):
+    """
+    Play pilots (None = off) as frames with run_frames. On the fast UDP path the
+    datagrams are serialized once up front; the ack counts for the effect are added
+    to its result, and if any frame was lost the final one is re-sent through
+    pywizlight so the bulb doesn't end in the wrong state.
+    """
+    if not fast:
+        frames = [(lambda pilot=pilot: light.turn_on(pilot)) if pilot else light.turn_off for pilot in pilots]
+        return await run_frames(frames, frame_period, total_frames, light.ip)
+
+    payloads = [pilot_payload(pilot) for pilot in pilots]
+    frames = [lambda payload=payload: udp.send(light.ip, payload, wait=not pipeline) for payload in payloads]
+    before = dict(udp.counter(light.ip))
+    result = await run_frames(frames, frame_period, total_frames)
+    await udp.settle(light.ip)
+    counter = udp.counter(light.ip)
+    sent, acked, lost = (counter[key] - before[key] for key in ("sent", "acked", "lost"))
+    result.update(path="udp_pipelined" if pipeline else "udp", acked=acked, lost=lost, loss_rate=round(lost / sent, 4) if sent else None)
+    if lost and total_frames:
+        final = pilots[(total_frames - 1) % len(pilots)]
+        await (light.turn_on(final) if final else light.turn_off())
+    return result
+
+def frame_pilot(frame: dict, label: str):
+    """Pilot for a keyframe or scene light: rgb [r, g, b] | kelvin | off, plus optional brightness. None means off."""
+    brightness = frame.get("brightness")
+    if frame.get("off"):
+        return None
+    if "rgb" in frame:
+        return PilotBuilder(rgb=tuple(frame["rgb"]), brightness=brightness)
+    if "kelvin" in frame:
+        return PilotBuilder(colortemp=int(frame["kelvin"]), brightness=brightness)
+    raise ValueError(f"{label} needs one of 'rgb', 'kelvin' or 'off'")
+
+def compile_timeline(timeline: list[dict]):
+    """
+    Turn keyframes into (pilot, seconds) steps; a pilot of None means off.
+    Keyframe keys: rgb [r, g, b] | kelvin | off, plus optional brightness (0-255),
+    hold (seconds to stay, default 1.0) and fade (seconds to interpolate from the previous keyframe).
+    """
+    steps = []
+    previous = None
+    for i, frame in enumerate(timeline):
+        if not isinstance(frame, dict):
+            raise ValueError(f"Keyframe {i} must be an object")
+        hold = float(frame.get("hold", 1.0))
+        fade = float(frame.get("fade", 0))
+        if hold < 0 or fade < 0:
+            raise ValueError(f"Keyframe {i}: hold and fade must not be negative")
+        brightness = frame.get("brightness")
+        target = frame_pilot(frame, f"Keyframe {i}")
+
+        if fade > 0 and previous and "rgb" in previous and "rgb" in frame and not frame.get("off"):
+            count = max(1, int(fade / EFFECT_FADE_STEP))
+            start_b = previous.get("brightness", brightness)
+            for n in range(1, count):
+                t = n / count
+                rgb = tuple(round(a + (b - a) * t) for a, b in zip(previous["rgb"], frame["rgb"]))
+                level = round(start_b + (brightness - start_b) * t) if start_b is not None and brightness is not None else brightness
+                steps.append((PilotBuilder(rgb=rgb, brightness=level), fade / count))
+            hold += fade / count
+        elif fade > 0:
+            hold += fade
+        steps.append((target, hold))
+        previous = frame
+    if not steps:
+        raise ValueError("A timeline needs at least one keyframe")
+    if sum(seconds for _, seconds in steps) <= 0:
+        raise ValueError("A timeline must last longer than 0 seconds")
+    return steps
+
+async def play_timeline(light: wizlight, steps, loops: int):
+    """
+    Play compiled steps on a monotonic schedule, loops times (0 = until cancelled).
+    Like run_frames, a step whose slot has already passed is skipped instead of played late.
+    """
+    start = time.monotonic()
+    offset = 0.0
+    played = skipped = 0
+    loop = 0
+    while loops == 0 or loop < loops:
+        for pilot, seconds in steps:
+            deadline = start + offset
+            offset += seconds
+            now = time.monotonic()
+            if now >= start + offset:
+                skipped += 1
+                continue
+            if now < deadline:
+                await asyncio.sleep(deadline - now)
+            async with metrics.device("wiz_udp", light.ip):
+                if pilot:
+                    await light.turn_on(pilot)
+                else:
+                    await light.turn_off()
+            played += 1
+        loop += 1
+    if time.monotonic() < start + offset:
+        await asyncio.sleep(start + offset - time.monotonic())
+    return {
+        "loops": loop,
+        "steps_played": played,
+        "steps_skipped": skipped,
+        "elapsed_seconds": round(time.monotonic() - start, 3),
+    }
+
+class EffectEngine:
+    """
+    Runs light effects as background tasks, at most one per bulb.
+    Starting an effect on a busy bulb preempts the running one (last writer wins).
+    """
+    def __init__(self, history: int = EFFECT_HISTORY):
+        self.history = history
+        self.effects = {}  # id -> effect record, running and recently finished
+        self.active = {}  # ip -> effect id
+        self._tasks = {}  # effect id -> task
+        self._ids = itertools.count(1)
+
+    def start(self, ip: str, name: str, play):
+        """Start play() (a coroutine function) as the bulb's effect and return its record."""
+        replaced = self.stop(ip, "preempted")
+        effect_id = f"fx{next(self._ids)}"
+        effect = {
+            "id": effect_id,
+            "bulb": ip,
+            "name": name,
+            "status": "running",
+            "started": time.time(),
+            "ended": None,
+            "replaced": replaced,
+            "result": None,
+        }
+        self.effects[effect_id] = effect
+        self.active[ip] = effect_id
+        task = asyncio.create_task(self._run(effect, play))
+        task.add_done_callback(lambda _: self._finish(effect))
+        self._tasks[effect_id] = task
+        return effect
+
+    async def _run(self, effect, play):
+        try:
+            effect["result"] = await play()
+            effect["status"] = "completed"
+        except Exception as e:
+            effect["status"] = "failed"
+            effect["result"] = {"error": str(e)}
+
+    def _finish(self, effect):
+        # Runs as a done callback so effects cancelled before their first step are cleaned up too
+        if effect["status"] == "running":
+            effect["status"] = "cancelled"
+        effect["ended"] = time.time()
+        self._tasks.pop(effect["id"], None)
+        if self.active.get(effect["bulb"]) == effect["id"]:
+            del self.active[effect["bulb"]]
+            shadow.invalidate(effect["bulb"])
+        self._trim()
+
+    def stop(self, ip: str, reason: str = "cancelled"):
+        """Cancel the bulb's running effect, if any. Returns the cancelled effect id."""
+        effect_id = self.active.get(ip)
+        if effect_id and self.cancel(effect_id, reason):
+            return effect_id
+        return None
+
+    def cancel(self, effect_id: str, reason: str = "cancelled"):
+        task = self._tasks.get(effect_id)
+        if not task:
+            return False
+        effect = self.effects[effect_id]
+        effect["status"] = reason
+        task.cancel()
+        # Free the bulb now so the next command or effect doesn't wait for the task to unwind
+        if self.active.get(effect["bulb"]) == effect_id:
+            del self.active[effect["bulb"]]
+            shadow.invalidate(effect["bulb"])
+        return True
+
+    async def wait(self, effect_id: str):
+        task = self._tasks.get(effect_id)
+        if task:
+            await asyncio.wait({task})
+        return self.describe(self.effects[effect_id])
+
+    def describe(self, effect):
+        ended = effect["ended"] or time.time()
+        return {**effect, "running_seconds": round(ended - effect["started"], 1)}
+
+    def _trim(self):
+        finished = [e for e in self.effects.values() if e["status"] != "running"]
+        for effect in finished[:max(0, len(finished) - self.history)]:
+            del self.effects[effect["id"]]
+
+    async def close(self):
+        for effect_id in list(self._tasks):
+            self.cancel(effect_id, "cancelled")
+
+effects = EffectEngine()
+
+def parse_groups(config: str):
+    """Parse the WIZ_GROUPS env format into {name: [ip, ...]}."""
+    groups = {}
+    for entry in config.split(";"):
+        if "=" not in entry:
+            continue
+        name, members = entry.split("=", 1)
+        members = [m.strip() for m in members.split(",") if m.strip()]
+        if name.strip() and members:
+            groups[name.strip().lower()] = members
+    return groups
+
+groups = parse_groups(GROUPS_CONFIG)
+
+def discovered_ips():
+    """IPs of every indexed bulb; backs the implicit "all" group when it isn't configured."""
+    return [entry["ip"] for entry in bulb_index.snapshot()]
+
+def resolve_group(group: str):
+    """Return the member addresses of a named group."""
+    name = group.strip().lower()
+    if name in groups:
+        return groups[name]
+    if name == "all" and bulb_index.bulbs:
+        return discovered_ips()
+    known = sorted(groups) + (["all"] if bulb_index.bulbs else [])
+    raise ValueError(f"Unknown group '{group}'. Known groups: {', '.join(known) or 'none'}")
+
+async def run_on_bulb(ip: str, action):
+    """Run action(light) on one bulb under GROUP_COMMAND_TIMEOUT, as a result dict with timing."""
+    start = time.monotonic()
+    try:
+        light = await get_light(ip)
+        sent = await asyncio.wait_for(action(light), GROUP_COMMAND_TIMEOUT)
+        result = {"ok": True}
+        if sent is False:
+            result["skipped"] = "already in requested state"
+    except asyncio.TimeoutError as e:
+        # The cancelled command doesn't count against the bulb by itself, so count the timeout here
+        health.record_failure(ip, e)
+        result = {"ok": False, "error": f"timed out after {GROUP_COMMAND_TIMEOUT}s"}
+    except Exception as e:
+        result = {"ok": False, "error": str(e)}
+    result["ms"] = round((time.monotonic() - start) * 1000, 1)
+    return result
+
+async def fan_out(group: str, action):
+    """
+    Run action(light) against every member of a group concurrently.
+    Each bulb gets its own timeout so one unreachable bulb can't hold up the rest.
+    """
+    members = resolve_group(group)
+    start = time.monotonic()
+    results = await asyncio.gather(*(run_on_bulb(ip, action) for ip in members))
+    ok = sum(1 for r in results if r["ok"])
+    return {
+        "group": group,
+        "succeeded": ok,
+        "failed": len(results) - ok,
+        "elapsed_ms": round((time.monotonic() - start) * 1000, 1),
+        "results": dict(zip(members, results)),
+    }
+
+# When the servers share a process (mcp_host.py), the servo server's FastMCP instance
+# is registered here and scenes press the switch in-process instead of over HTTP
+local_servers = {}
+
+class Scene:
+    """
+    A named scene compiled for sending: the pilot of each light entry is built and
+    validated once, when the scene is loaded. Targets (bulbs, groups) are resolved
+    when the scene is applied, so renamed or moved bulbs are still found.
+    """
+    def __init__(self, name: str, definition: dict):
+        if not isinstance(definition, dict):
+            raise ValueError(f"Scene '{name}' must be an object")
+        self.name = name
+        self.definition = definition
+        self.description = definition.get("description", "")
+        self.lights = []  # (kind, targets, pilot); kind is "group" or "bulbs"
+        for i, entry in enumerate(definition.get("lights") or []):
+            label = f"Scene '{name}' light {i}"
+            if not isinstance(entry, dict):
+                raise ValueError(f"{label} must be an object")
+            pilot = frame_pilot(entry, label)
+            if "group" in entry:
+                self.lights.append(("group", [entry["group"]], pilot))
+            else:
+                bulbs = entry.get("bulb") or entry.get("bulbs") or DEFAULT_BULB_IP
+                if not bulbs:
+                    raise ValueError(f"{label} needs a 'bulb', 'bulbs' or 'group' (WIZ_BULB_IP is not set)")
+                self.lights.append(("bulbs", [bulbs] if isinstance(bulbs, str) else list(bulbs), pilot))
+        switch = definition.get("switch")
+        if switch is not None and str(switch).lower() not in ("on", "off"):
+            raise ValueError(f"Scene '{name}': switch must be 'on' or 'off'")
+        self.switch = str(switch).lower() if switch is not None else None
+        if not self.lights and not self.switch:
+            raise ValueError(f"Scene '{name}' doesn't set any lights or the switch")
+
+    def plan(self):
+        """({ip: pilot}, {target: error}); a bulb named by several entries gets the last one's pilot."""
+        pilots = {}
+        errors = {}
+        for kind, targets, pilot in self.lights:
+            members = []
+            for target in targets:
+                try:
+                    members += resolve_group(target) if kind == "group" else [target]
+                except ValueError as e:
+                    errors[target] = str(e)
+            for member in members:
+                try:
+                    pilots[resolve_bulb(member)] = pilot
+                except ValueError as e:
+                    errors[member] = str(e)
+        return pilots, errors
+
+    def describe(self):
+        lights = []
+        for kind, targets, pilot in self.lights:
+            entry = {"group": targets[0]} if kind == "group" else {"bulbs": targets}
+            entry["pilot"] = dict(pilot.pilot_params, state=True) if pilot else {"state": False}
+            lights.append(entry)
+        return {"description": self.description, "lights": lights, "switch": self.switch}
+
+class SceneBook:
+    """
+    Scenes from SCENES_FILE, a JSON object of scene name -> definition. The file's
+    modification time is checked on every use and the scenes are recompiled when it
+    changed, so edits take effect without restarting. A file that fails to parse or
+    validate is reported and the previously loaded scenes stay in use.
+    """
+    def __init__(self, path: str = SCENES_FILE):
+        self.path = path
+        self.scenes = {}
+        self.mtime = None
+        self.loads = 0
+        self.last_error = None
+
+    def refresh(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if mtime == self.mtime:
+            return
+        self.mtime = mtime
+        if mtime is None:
+            self.scenes = {}
+            return
+        try:
+            self.scenes = self.compile(self.read())
+            self.loads += 1
+            self.last_error = None
+            print(f"Wiz: Loaded {len(self.scenes)} scenes from {self.path}")
+        except (OSError, ValueError, TypeError) as e:
+            self.last_error = str(e)
+            print(f"Wiz: Could not load scenes from {self.path}, keeping the previous ones: {e}")
+
+    def read(self):
+        with open(self.path, encoding="utf-8") as f:
+            data = json.load(f)
+        if not isinstance(data, dict):
+            raise ValueError("The scenes file must contain an object of scene name -> definition")
+        return data
+
+    @staticmethod
+    def key(name: str):
+        """Scene names are matched case-insensitively, with spaces and underscores alike ('Good morning' is good_morning)."""
+        return "_".join(name.lower().split())
+
+    def compile(self, data: dict):
+        return {self.key(name): Scene(self.key(name), definition) for name, definition in data.items()}
+
+    def get(self, name: str):
+        self.refresh()
+        scene = self.scenes.get(self.key(name))
+        if scene is None:
+            raise ValueError(f"Unknown scene '{name}'. Known scenes: {', '.join(sorted(self.scenes)) or 'none'}")
+        return scene
+
+    def all(self):
+        self.refresh()
+        return self.scenes
+
+    def save(self, name: str, definition: dict):
+        """Validate a scene and write it to the file (replacing one with the same name)."""
+        name = self.key(name)
+        scene = Scene(name, definition)
+        data = self.read() if os.path.exists(self.path) else {}
+        data[name] = definition
+        temporary = self.path + ".tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+        os.replace(temporary, self.path)
+        self.refresh()
+        return scene
+
+scene_book = SceneBook()
+
+async def set_wall_switch(state: str):
+    """Set the wall switch through the servo server's toggle_switch tool, as a result dict with timing."""
+    start = time.monotonic()
+    try:
+        async with metrics.device("mcp_tool", "servo.toggle_switch"):
+            text, is_error = await asyncio.wait_for(
+                call_tool(SERVO_MCP_URL, "toggle_switch", {"state": state}, SCENE_SWITCH_TIMEOUT, local=local_servers.get("servo")),
+                SCENE_SWITCH_TIMEOUT,
+            )
+        try:
+            reply = json.loads(text)
+        except ValueError:
+            reply = {"ok": not is_error and not text.startswith("Error"), "result": text}
+        result = {"ok": bool(reply.get("ok")) and not is_error, "result": reply.get("result")}
+        if reply.get("pressed") is False:
+            result["skipped"] = "already in requested state"
+    except asyncio.TimeoutError:
+        result = {"ok": False, "error": f"timed out after {SCENE_SWITCH_TIMEOUT}s"}
+    except Exception as e:
+        result = {"ok": False, "error": str(e) or type(e).__name__}
+    result["ms"] = round((time.monotonic() - start) * 1000, 1)
+    return result
+
+async def run_scene(scene: Scene):
+    """Send every light's precompiled pilot and the switch state concurrently."""
+    start = time.monotonic()
+    pilots, errors = scene.plan()
+    devices = list(pilots)
+    jobs = [run_on_bulb(ip, lambda light, pilot=pilot: apply_pilot(light, pilot)) for ip, pilot in pilots.items()]
+    if scene.switch:
+        devices.append("switch")
+        jobs.append(set_wall_switch(scene.switch))
+    results = dict(zip(devices, await asyncio.gather(*jobs)))
+    results.update({target: {"ok": False, "error": error, "ms": 0.0} for target, error in errors.items()})
+    ok = sum(1 for r in results.values() if r["ok"])
+    return {
+        "scene": scene.name,
+        "succeeded": ok,
+        "failed": len(results) - ok,
+        "elapsed_ms": round((time.monotonic() - start) * 1000, 1),
+        "results": results,
+    }
+
+@mcp.tool()
+async def connection_stats():
+    """
+    Report the bulb connection cache (open connections, hit/miss counters, evictions)
+    and the state shadow (push updates, polls, sent and suppressed commands), plus
+    ack and loss counts of the fast UDP path used by strobe and flash effects.
+    """
+    return {**registry.stats(), "shadow": shadow.stats(), "udp_fast_path": udp.stats()}
+
+@mcp.tool()
+async def device_health():
+    """
+    Report which bulbs are reachable, as the background health prober and recent
+    commands saw them: online/offline, since when, last error, round-trip time and
+    friendly names. Commands to an offline bulb fail immediately instead of waiting
+    for a timeout, so check this before planning actions on specific bulbs.
+    """
+    report = health.snapshot()
+    names = {}
+    for name, target in bulb_names.items():
+        try:
+            names.setdefault(resolve_bulb(target), []).append(name)
+        except ValueError:
+            continue
+    for ip, entry in report["devices"].items():
+        entry["names"] = names.get(ip, [])
+    return report
 
 @mcp.tool()
-async def discover_bulbs():
+async def discover_bulbs(refresh: bool = False):
     """
-    Discover Wiz bulbs on the local network.
-    Returns a list of discovered bulbs with their IP and MAC addresses.
+    List Wiz bulbs on the local network from the background discovery index.
+    Returns each bulb's MAC, IP, model, friendly names and when it was last seen.
+    :param refresh: Run a discovery scan now instead of returning the cached index. Default False.
     """
     try:
-        bulbs = await discovery.discover_lights(broadcast_space="255.255.255.255")
-        return [{"ip": b.ip, "mac": b.mac} for b in bulbs]
+        if refresh or bulb_index.last_scan is None:
+            await bulb_index.refresh()
+        return {
+            "bulbs": bulb_index.snapshot(),
+            "last_scan_seconds_ago": round(time.time() - bulb_index.last_scan, 1) if bulb_index.last_scan else None,
+            "scans": bulb_index.scans,
+            "last_error": bulb_index.last_error,
+        }
     except Exception as e:
         return f"Error during discovery: {str(e)}"
 
+@mcp.tool()
+async def name_bulb(name: str, bulb: str):
+    """
+    Give a bulb a friendly name that any tool's ip_address argument will accept.
+    :param name: The friendly name, e.g. 'desk lamp'.
+    :param bulb: The bulb's MAC or IP address.
+    """
+    if not name.strip() or not bulb.strip():
+        return "Error: Both a name and a bulb are required."
+    bulb_names[name.strip().lower()] = normalize_mac(bulb) or bulb.strip()
+    return f"Bulb {bulb} is now known as '{name}'"
+
 @mcp.tool()
 async def turn_on(ip_address: str = None, brightness: int = 255):
     """
     Turn on a Wiz bulb.
-    :param ip_address: The IP address of the bulb. Defaults to WIZ_BULB_IP env var.
+    :param ip_address: The IP address, MAC or friendly name of the bulb. Defaults to WIZ_BULB_IP env var.
     :param brightness: Brightness level (0-255). Default is 255.
     """
     try:
+        light = await get_light(ip_address)
         ip = ip_address or DEFAULT_BULB_IP
-        if not ip:
-            return "Error: No IP."
-        light = wizlight(ip)
         # Explicit pilot builder purely for brightness
-        await light.turn_on(PilotBuilder(brightness=brightness))
+        if not await apply_pilot(light, PilotBuilder(brightness=brightness)):
+            return f"Bulb {ip} already on with brightness {brightness}"
         return f"Bulb {ip} turned on with brightness {brightness}"
     except Exception as e:
         return f"Error turning on bulb: {str(e)}"
@@ -51,12 +1085,13 @@ async def turn_on(ip_address: str = None, brightness: int = 255):
 async def turn_off(ip_address: str = None):
     """
     Turn off a Wiz bulb.
-    :param ip_address: The IP address of the bulb. Defaults to WIZ_BULB_IP env var.
+    :param ip_address: The IP address, MAC or friendly name of the bulb. Defaults to WIZ_BULB_IP env var.
     """
     try:
         light = await get_light(ip_address)
-        await light.turn_off()
         ip = ip_address or DEFAULT_BULB_IP
+        if not await apply_pilot(light, None):
+            return f"Bulb {ip} already off"
         return f"Bulb {ip} turned off"
     except Exception as e:
         return f"Error turning off bulb: {str(e)}"
@@ -68,45 +1103,37 @@ async def set_color(r: int, g: int, b: int, ip_address: str = None):
     :param r: Red component (0-255).
     :param g: Green component (0-255).
     :param b: Blue component (0-255).
-    :param ip_address: The IP address of the bulb. Defaults to WIZ_BULB_IP env var.
+    :param ip_address: The IP address, MAC or friendly name of the bulb. Defaults to WIZ_BULB_IP env var.
     """
     try:
+        light = await get_light(ip_address)
         ip = ip_address or DEFAULT_BULB_IP
-        if not ip:
-            return "Error: No IP address provided and WIZ_BULB_IP not set."
-            
-        light = wizlight(ip)
         # Using PilotBuilder explicitly for RGB
-        await light.turn_on(PilotBuilder(rgb=(r, g, b)))
+        if not await apply_pilot(light, PilotBuilder(rgb=(r, g, b))):
+            return f"Bulb {ip} already set to color RGB({r}, {g}, {b})"
         return f"Bulb {ip} set to color RGB({r}, {g}, {b})"
     except Exception as e:
         return f"Error setting color: {str(e)}"
 
 @mcp.tool()
-async def flash_bulb(times: int = 1, color_rgb: tuple[int, int, int] = (255, 0, 0), delay_seconds: float = 0.5):
+async def flash_bulb(times: int = 1, color_rgb: tuple[int, int, int] = (255, 0, 0), delay_seconds: float = 0.5, wait: bool = False):
     """
     Flash the bulb a specified number of times with a specific color.
+    Runs as a background effect and returns its effect id immediately unless wait is set.
     :param times: Number of times to flash.
     :param color_rgb: Tuple of (r, g, b) for the flash color. Default Red.
     :param delay_seconds: Time on/off in seconds.
+    :param wait: Block until the flashing finishes and return its timing. Default False.
     """
     try:
-        ip = DEFAULT_BULB_IP
-        if not ip:
-            return "Error: WIZ_BULB_IP not set."
-            
-        light = wizlight(ip)
-        
-        for i in range(times):
-            # Turn ON with color
-            await light.turn_on(PilotBuilder(rgb=color_rgb))
-            await asyncio.sleep(delay_seconds)
-            
-            # Turn OFF (or dim) - turning off is clearer for a flash
-            await light.turn_off()
-            await asyncio.sleep(delay_seconds)
-            
-        return f"Bulb flashed {times} times."
+        light = await get_light()
+        # Turn ON with color, then OFF (or dim) - turning off is clearer for a flash
+        pilots = [PilotBuilder(rgb=color_rgb), None]
+        effect = effects.start(light.ip, "flash", lambda: play_frames(light, pilots, delay_seconds, times * 2))
+        if wait:
+            done = await effects.wait(effect["id"])
+            return {"result": f"Bulb flashed {times} times.", "effect_id": effect["id"], "status": done["status"], **(done["result"] or {})}
+        return {"result": f"Flashing bulb {times} times.", "effect_id": effect["id"], "replaced": effect["replaced"]}
     except Exception as e:
         return f"Error flashing bulb: {str(e)}"
 
@@ -115,31 +1142,41 @@ async def set_warmth(kelvin: int, ip_address: str = None):
     """
     Set the color temperature of a Wiz bulb.
     :param kelvin: Color temperature in Kelvin (2700-6500).
-    :param ip_address: The IP address of the bulb. Defaults to WIZ_BULB_IP env var.
+    :param ip_address: The IP address, MAC or friendly name of the bulb. Defaults to WIZ_BULB_IP env var.
     """
     try:
         light = await get_light(ip_address)
-        await light.turn_on(PilotBuilder(kelvin=kelvin))
         ip = ip_address or DEFAULT_BULB_IP
+        if not await apply_pilot(light, PilotBuilder(colortemp=kelvin)):
+            return f"Bulb {ip} already at temperature {kelvin}K"
         return f"Bulb {ip} set to temperature {kelvin}K"
     except Exception as e:
         return f"Error setting warmth: {str(e)}"
 
 @mcp.tool()
-async def get_status(ip_address: str = None):
+async def get_status(ip_address: str = None, refresh: bool = False):
     """
     Get the current status (on/off, brightness, color) of a Wiz bulb.
-    :param ip_address: The IP address of the bulb. Defaults to WIZ_BULB_IP env var.
+    Served from the state shadow when it is fresh and complete; age_seconds says how old it is.
+    :param ip_address: The IP address, MAC or friendly name of the bulb. Defaults to WIZ_BULB_IP env var.
+    :param refresh: Query the bulb directly instead of using the shadow. Default False.
     """
     try:
         light = await get_light(ip_address)
-        state = await light.updateState()
+        if refresh or not shadow.complete(light.ip):
+            await shadow.poll(light)
+        entry = shadow.entries.get(light.ip)
+        if not entry:
+            return "Error getting status: Bulb returned no state."
+        state = PilotParser(entry["pilot"])
         return {
             "on": state.get_state(),
             "brightness": state.get_brightness(),
             "rgb": state.get_rgb(),
             "temp": state.get_colortemp(),
-            "mac": light.mac
+            "mac": light.mac,
+            "source": entry["source"],
+            "age_seconds": round(shadow.age(light.ip), 2),
         }
     except Exception as e:
         return f"Error getting status: {str(e)}"
@@ -151,14 +1188,14 @@ async def breathing(r: int = 255, g: int = 255, b: int = 255, ip_address: str =
     :param r: Red component (0-255).
     :param g: Green component (0-255).
     :param b: Blue component (0-255).
-    :param ip_address: The IP address of the bulb. Defaults to WIZ_BULB_IP env var.
+    :param ip_address: The IP address, MAC or friendly name of the bulb. Defaults to WIZ_BULB_IP env var.
     :param speed: The speed of the effect (10-200). Default is 100.
     :param brightness: Brightness level (0-255). Default is 255.
     """
     try:
         light = await get_light(ip_address)
         # Scene 31 is the 'Pulse' effect which looks like breathing
-        await light.turn_on(PilotBuilder(rgb=(r, g, b), scene=31, speed=speed, brightness=brightness))
+        await apply_pilot(light, PilotBuilder(rgb=(r, g, b), scene=31, speed=speed, brightness=brightness))
         ip = ip_address or DEFAULT_BULB_IP
         return f"Bulb {ip} set to breathing effect (Pulse) with color RGB({r}, {g}, {b}) and speed {speed}"
     except Exception as e:
@@ -169,47 +1206,290 @@ async def strobe(ip_address: str = None, speed: int = 100, brightness: int = 255
     """
     Start a strobe effect on the bulb using the built-in 'Party' scene.
     This effect cycles through colors rapidly.
-    :param ip_address: The IP address of the bulb. Defaults to WIZ_BULB_IP env var.
+    :param ip_address: The IP address, MAC or friendly name of the bulb. Defaults to WIZ_BULB_IP env var.
     :param speed: The speed of the strobe (10-200). Default is 100.
     :param brightness: Brightness level (0-255). Default is 255.
     """
     try:
         light = await get_light(ip_address)
         # Scene 4 is 'Party' which provides a multi-color strobe effect.
-        await light.turn_on(PilotBuilder(scene=4, speed=speed, brightness=brightness))
+        await apply_pilot(light, PilotBuilder(scene=4, speed=speed, brightness=brightness))
         ip = ip_address or DEFAULT_BULB_IP
         return f"Bulb {ip} set to strobe effect (Party scene) with speed {speed}"
     except Exception as e:
         return f"Error setting strobe effect: {str(e)}"
 
 @mcp.tool()
-async def manual_strobe(r: int = 255, g: int = 255, b: int = 255, ip_address: str = None, hz: float = 5.0, duration_seconds: float = 10.0):
+async def manual_strobe(r: int = 255, g: int = 255, b: int = 255, ip_address: str = None, hz: float = 5.0, duration_seconds: float = 10.0, wait: bool = False, pipeline: bool = None):
     """
     Start a manual strobe effect with a specific color.
-    Note: High frequencies may be limited by network latency.
+    Frames run on a fixed clock; if the bulb can't keep up, frames are skipped
+    rather than stretching the effect. Runs as a background effect and returns its
+    effect id immediately; the finished effect reports achieved Hz, jitter and lost frames.
     :param r: Red component (0-255).
     :param g: Green component (0-255).
     :param b: Blue component (0-255).
-    :param ip_address: The IP address of the bulb. Defaults to WIZ_BULB_IP env var.
+    :param ip_address: The IP address, MAC or friendly name of the bulb. Defaults to WIZ_BULB_IP env var.
     :param hz: Frequency of the strobe in Hertz (flashes per second). Default 5.0.
     :param duration_seconds: Total duration of the strobe effect. Default 10.0.
+    :param wait: Block until the strobe finishes and return its timing. Default False.
+    :param pipeline: Send frames without waiting for each acknowledgement, for higher rates. Defaults to WIZ_UDP_PIPELINE.
     """
     try:
         light = await get_light(ip_address)
         ip = ip_address or DEFAULT_BULB_IP
         period = 1.0 / hz / 2.0
         num_cycles = int(duration_seconds * hz)
-        
-        for _ in range(num_cycles):
-            await light.turn_on(PilotBuilder(rgb=(r, g, b)))
-            await asyncio.sleep(period)
-            await light.turn_off()
-            await asyncio.sleep(period)
-            
-        return f"Manual strobe effect completed on {ip}"
+        pilots = [PilotBuilder(rgb=(r, g, b)), None]
+        pipelined = UDP_PIPELINE if pipeline is None else pipeline
+        effect = effects.start(light.ip, "manual_strobe", lambda: play_frames(light, pilots, period, num_cycles * 2, pipeline=pipelined))
+        if wait:
+            done = await effects.wait(effect["id"])
+            return {"result": f"Manual strobe effect completed on {ip}", "effect_id": effect["id"], "status": done["status"], **(done["result"] or {})}
+        return {"result": f"Manual strobe started on {ip}", "effect_id": effect["id"], "replaced": effect["replaced"]}
     except Exception as e:
         return f"Error with manual strobe effect: {str(e)}"
 
+@mcp.tool()
+async def start_effect(timeline: list[dict], ip_address: str = None, loops: int = 1, name: str = "custom"):
+    """
+    Play a keyframe timeline on a bulb in the background and return its effect id at once.
+    Any effect already running on the bulb is replaced.
+    Each keyframe is an object with one of:
+      "rgb": [r, g, b]  |  "kelvin": 2700-6500  |  "off": true
+    and optionally:
+      "brightness": 0-255, "hold": seconds to stay (default 1.0),
+      "fade": seconds to blend in from the previous rgb keyframe.
+    Example: [{"rgb": [255, 0, 0], "hold": 0.5}, {"rgb": [0, 0, 255], "fade": 2, "hold": 0.5}]
+    :param timeline: The list of keyframes.
+    :param ip_address: The IP address, MAC or friendly name of the bulb. Defaults to WIZ_BULB_IP env var.
+    :param loops: How many times to play the timeline; 0 loops until cancelled. Default 1.
+    :param name: A label for the effect shown by list_effects.
+    """
+    try:
+        steps = compile_timeline(timeline)
+        light = await get_light(ip_address)
+        effect = effects.start(light.ip, name, lambda: play_timeline(light, steps, loops))
+        return {"effect_id": effect["id"], "bulb": light.ip, "steps": len(steps), "loops": loops, "replaced": effect["replaced"]}
+    except Exception as e:
+        return f"Error starting effect: {str(e)}"
+
+@mcp.tool()
+async def list_effects(include_finished: bool = False):
+    """
+    List effects running on bulbs.
+    :param include_finished: Also show recently completed, cancelled or failed effects. Default False.
+    """
+    return [
+        effects.describe(effect)
+        for effect in effects.effects.values()
+        if include_finished or effect["status"] == "running"
+    ]
+
+@mcp.tool()
+async def cancel_effect(effect_id: str = None, ip_address: str = None):
+    """
+    Cancel a running effect, by id or by the bulb it is running on.
+    :param effect_id: The effect id returned when the effect was started.
+    :param ip_address: Cancel whatever effect is running on this bulb (IP, MAC or friendly name).
+    """
+    try:
+        if effect_id:
+            if not effects.cancel(effect_id):
+                return f"Effect {effect_id} is not running"
+            return f"Effect {effect_id} cancelled"
+        light = await get_light(ip_address)
+        cancelled = effects.stop(light.ip)
+        return f"Effect {cancelled} cancelled" if cancelled else f"No effect running on {light.ip}"
+    except Exception as e:
+        return f"Error cancelling effect: {str(e)}"
+
+@mcp.tool()
+async def replace_effect(effect_id: str, timeline: list[dict], loops: int = 1, name: str = "custom"):
+    """
+    Swap a running effect for a new keyframe timeline on the same bulb.
+    Takes the same timeline format as start_effect.
+    :param effect_id: The running effect to replace.
+    :param timeline: The list of keyframes.
+    :param loops: How many times to play the timeline; 0 loops until cancelled. Default 1.
+    :param name: A label for the new effect.
+    """
+    effect = effects.effects.get(effect_id)
+    if not effect or effect["status"] != "running":
+        return f"Error: Effect {effect_id} is not running"
+    return await start_effect(timeline, ip_address=effect["bulb"], loops=loops, name=name)
+
+@mcp.tool()
+async def list_groups():
+    """
+    List the named bulb groups and their members.
+    The "all" group contains every bulb found by discover_bulbs unless configured explicitly.
+    """
+    result = {name: members for name, members in groups.items()}
+    if "all" not in result and bulb_index.bulbs:
+        result["all"] = discovered_ips()
+    return result
+
+@mcp.tool()
+async def define_group(name: str, ip_addresses: list[str]):
+    """
+    Create or replace a named bulb group for this server session.
+    :param name: Group name, e.g. 'living_room'.
+    :param ip_addresses: IP addresses, MACs or friendly names of the member bulbs.
+    """
+    members = [ip.strip() for ip in ip_addresses if ip.strip()]
+    if not members:
+        return "Error: A group needs at least one bulb."
+    groups[name.strip().lower()] = members
+    return f"Group '{name}' set to {len(members)} bulbs: {', '.join(members)}"
+
+@mcp.tool()
+async def group_turn_on(group: str, brightness: int = 255):
+    """
+    Turn on every bulb in a group at once.
+    :param group: The group name (see list_groups).
+    :param brightness: Brightness level (0-255). Default is 255.
+    """
+    try:
+        return await fan_out(group, lambda light: apply_pilot(light, PilotBuilder(brightness=brightness)))
+    except Exception as e:
+        return f"Error turning on group: {str(e)}"
+
+@mcp.tool()
+async def group_turn_off(group: str):
+    """
+    Turn off every bulb in a group at once.
+    :param group: The group name (see list_groups).
+    """
+    try:
+        return await fan_out(group, lambda light: apply_pilot(light, None))
+    except Exception as e:
+        return f"Error turning off group: {str(e)}"
+
+@mcp.tool()
+async def group_set_color(group: str, r: int, g: int, b: int):
+    """
+    Set the RGB color of every bulb in a group at once.
+    :param group: The group name (see list_groups).
+    :param r: Red component (0-255).
+    :param g: Green component (0-255).
+    :param b: Blue component (0-255).
+    """
+    try:
+        return await fan_out(group, lambda light: apply_pilot(light, PilotBuilder(rgb=(r, g, b))))
+    except Exception as e:
+        return f"Error setting group color: {str(e)}"
+
+@mcp.tool()
+async def group_set_warmth(group: str, kelvin: int):
+    """
+    Set the color temperature of every bulb in a group at once.
+    :param group: The group name (see list_groups).
+    :param kelvin: Color temperature in Kelvin (2700-6500).
+    """
+    try:
+        return await fan_out(group, lambda light: apply_pilot(light, PilotBuilder(colortemp=kelvin)))
+    except Exception as e:
+        return f"Error setting group warmth: {str(e)}"
+
+@mcp.tool()
+async def group_breathing(group: str, r: int = 255, g: int = 255, b: int = 255, speed: int = 100, brightness: int = 255):
+    """
+    Start the breathing (Pulse) effect on every bulb in a group at once.
+    :param group: The group name (see list_groups).
+    :param r: Red component (0-255).
+    :param g: Green component (0-255).
+    :param b: Blue component (0-255).
+    :param speed: The speed of the effect (10-200). Default is 100.
+    :param brightness: Brightness level (0-255). Default is 255.
+    """
+    try:
+        pilot = PilotBuilder(rgb=(r, g, b), scene=31, speed=speed, brightness=brightness)
+        return await fan_out(group, lambda light: apply_pilot(light, pilot))
+    except Exception as e:
+        return f"Error setting group breathing effect: {str(e)}"
+
+@mcp.tool()
+async def apply_scene(name: str):
+    """
+    Apply a named scene in one step: every light in it and the wall switch are set at once.
+    Returns each device's result (ok, skipped or error) and how long it took.
+    :param name: The scene name (see list_scenes), e.g. 'good_morning'.
+    """
+    try:
+        return await run_scene(scene_book.get(name))
+    except Exception as e:
+        return f"Error applying scene: {str(e)}"
+
+@mcp.tool()
+async def list_scenes():
+    """
+    List the saved scenes with the lights and switch state each one sets.
+    Scenes are read from the scenes file and pick up edits to it automatically.
+    """
+    scenes = scene_book.all()
+    return {
+        "scenes": {name: scene.describe() for name, scene in scenes.items()},
+        "file": scene_book.path,
+        "last_error": scene_book.last_error,
+    }
+
+@mcp.tool()
+async def define_scene(name: str, lights: list[dict] = None, switch: str = None, description: str = None):
+    """
+    Create or replace a named scene and save it to the scenes file.
+    :param name: Scene name, e.g. 'good_morning'.
+    :param lights: Light settings, each with a target - 'bulb' (name, MAC or IP), 'bulbs' (a list) or 'group' -
+        and one of 'rgb' [r, g, b], 'kelvin' or 'off': true, plus optional 'brightness' (0-255).
+        Without a target the default bulb is used. Example: [{"group": "bedroom", "kelvin": 4000, "brightness": 200}]
+    :param switch: Wall switch state for the scene, 'on' or 'off'. Omit to leave the switch alone.
+    :param description: What the scene is for.
+    """
+    definition = {"lights": lights or []}
+    if switch is not None:
+        definition["switch"] = switch
+    if description:
+        definition["description"] = description
+    try:
+        scene = scene_book.save(name, definition)
+        return {"result": f"Scene '{scene.name}' saved", **scene.describe()}
+    except Exception as e:
+        return f"Error saving scene: {str(e)}"
+
+discovery_task = None
+health_task = None
+
+async def startup():
+    """Start background discovery and the health prober."""
+    global discovery_task, health_task
+    if DISCOVERY_INTERVAL > 0:
+        discovery_task = asyncio.create_task(discovery_loop())
+    if health.interval > 0:
+        health_task = asyncio.create_task(health.run())
+
+async def shutdown():
+    """Stop discovery, the prober and effects, and release bulb connections."""
+    if discovery_task:
+        discovery_task.cancel()
+    if health_task:
+        health_task.cancel()
+    await effects.close()
+    udp.close()
+    await registry.close()
+
+async def serve(transport: str):
+    """Run the MCP server alongside background discovery, and release bulb connections on shutdown."""
+    await startup()
+    try:
+        if transport == "sse":
+            await mcp.run_sse_async()
+        elif transport == "streamable-http":
+            await mcp.run_streamable_http_async()
+        else:
+            await mcp.run_stdio_async()
+    finally:
+        await shutdown()
+
 import argparse
 
 if __name__ == "__main__":
@@ -229,4 +1509,4 @@ if __name__ == "__main__":
         mcp.settings.transport_security = None
         print(f"Starting Wiz Bulb MCP Server on http://0.0.0.0:{args.port}/mcp")
 
-    mcp.run(transport=args.transport)
+    asyncio.run(serve(args.transport))
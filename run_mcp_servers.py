@@ -1,9 +1,12 @@
-import subprocess
+import argparse
+import asyncio
 import sys
 import os
 import time
 import signal
 
+import httpx
+
 # List of servers to run
 # Format: (name, script_path, port)
 SERVERS = [
@@ -14,41 +17,202 @@ SERVERS = [
     ("Telegram Gateway", "mcp_servers/telegram/telegram_gateway.py", None)
 ]
 
-processes = []
+# A minimal MCP handshake: a server only counts as ready once /mcp answers initialize
+INITIALIZE_REQUEST = {
+    "jsonrpc": "2.0",
+    "id": 0,
+    "method": "initialize",
+    "params": {
+        "protocolVersion": "2025-03-26",
+        "capabilities": {},
+        "clientInfo": {"name": "run_mcp_servers", "version": "1.0"},
+    },
+}
+# Processes without a port (the gateway) count as ready once they've stayed up this long
+NO_PORT_READY_SECONDS = 2.0
+HEALTH_FAILURES_BEFORE_RESTART = 3
+
+class Child:
+    """One supervised server process and its bookkeeping."""
+    def __init__(self, name: str, path: str, port: int = None, probe_ports: list = None):
+        self.name = name
+        self.path = path
+        self.port = port
+        self.probe_ports = probe_ports if probe_ports is not None else ([port] if port else [])
+        self.process = None
+        self.status = "pending"
+        self.launched_at = None
+        self.startup_seconds = None
+        self.restarts = 0
+        self.last_exit = None
+        self.ready = asyncio.Event()
+
+    def command(self):
+        # Use sys.executable to ensure we use the same python environment
+        cmd = [sys.executable, self.path]
+        if self.port:
+            cmd.extend(["--transport", "streamable-http", "--port", str(self.port)])
+        return cmd
+
+async def probe_mcp(client: httpx.AsyncClient, port: int):
+    """True if http://127.0.0.1:port/mcp completes an MCP initialize; the probe session is closed afterwards."""
+    url = f"http://127.0.0.1:{port}/mcp"
+    try:
+        response = await client.post(url, json=INITIALIZE_REQUEST, headers={"Accept": "application/json, text/event-stream"})
+    except httpx.HTTPError:
+        return False
+    session_id = response.headers.get("mcp-session-id")
+    if session_id:
+        try:
+            await client.delete(url, headers={"mcp-session-id": session_id})
+        except httpx.HTTPError:
+            pass
+    return response.status_code == 200 and "serverInfo" in response.text
+
+async def is_ready(child: Child, client: httpx.AsyncClient):
+    if child.process.returncode is not None:
+        return False
+    if not child.probe_ports:
+        return time.monotonic() - child.launched_at >= NO_PORT_READY_SECONDS
+    results = await asyncio.gather(*(probe_mcp(client, port) for port in child.probe_ports))
+    return all(results)
+
+async def stop_process(process, drain_timeout: float):
+    """SIGTERM, wait up to drain_timeout for a graceful exit, then SIGKILL."""
+    if process is None or process.returncode is not None:
+        return
+    process.terminate()
+    try:
+        await asyncio.wait_for(process.wait(), drain_timeout)
+    except asyncio.TimeoutError:
+        print(f"[supervisor] pid {process.pid} didn't exit within {drain_timeout:.0f}s, killing")
+        process.kill()
+        await process.wait()
+
+async def monitor(child: Child, client: httpx.AsyncClient, args, stopping: asyncio.Event):
+    """Wait for the child to become ready, then watch it. Returns why it needs restarting."""
+    exited = asyncio.create_task(child.process.wait())
+    stop_requested = asyncio.create_task(stopping.wait())
+    try:
+        deadline = child.launched_at + args.ready_timeout
+        while not await is_ready(child, client):
+            if exited.done():
+                return f"exited with code {exited.result()} before becoming ready"
+            if stopping.is_set():
+                return "stopping"
+            if time.monotonic() > deadline:
+                return f"not ready after {args.ready_timeout:.0f}s"
+            await asyncio.sleep(0.25)
+
+        child.startup_seconds = round(time.monotonic() - child.launched_at, 2)
+        child.status = "ready"
+        child.ready.set()
+        print(f"[supervisor] {child.name} ready in {child.startup_seconds:.2f}s (pid {child.process.pid})")
 
-def signal_handler(sig, frame):
-    print("\nShutting down all MCP servers...")
-    for p, name in processes:
-        print(f"Stopping {name}...")
-        p.terminate()
-    sys.exit(0)
+        failures = 0
+        while True:
+            await asyncio.wait({exited, stop_requested}, timeout=args.health_interval, return_when=asyncio.FIRST_COMPLETED)
+            if stopping.is_set():
+                return "stopping"
+            if exited.done():
+                return f"exited with code {exited.result()}"
+            if await is_ready(child, client):
+                failures = 0
+                continue
+            failures += 1
+            print(f"[supervisor] {child.name} failed health probe ({failures}/{HEALTH_FAILURES_BEFORE_RESTART})")
+            if failures >= HEALTH_FAILURES_BEFORE_RESTART:
+                return f"failed {failures} health probes in a row"
+    finally:
+        exited.cancel()
+        stop_requested.cancel()
 
-signal.signal(signal.SIGINT, signal_handler)
+async def run_child(child: Child, client: httpx.AsyncClient, args, stopping: asyncio.Event):
+    """Keep one child running: launch, monitor, and restart with exponential backoff."""
+    backoff = 1.0
+    while not stopping.is_set():
+        child.status = "starting"
+        child.launched_at = time.monotonic()
+        # Own process group, so a Ctrl+C reaches only the supervisor, which then drains each child once
+        child.process = await asyncio.create_subprocess_exec(*child.command(), start_new_session=True)
+        reason = await monitor(child, client, args, stopping)
+        if stopping.is_set():
+            break
 
-def run_servers():
+        # Backoff starts over once a child has stayed up for a while
+        if time.monotonic() - child.launched_at > args.max_backoff:
+            backoff = 1.0
+        await stop_process(child.process, args.drain_timeout)
+        child.last_exit = reason
+        child.restarts += 1
+        child.status = "backoff"
+        print(f"[supervisor] {child.name} {reason}; restart #{child.restarts} in {backoff:.0f}s")
+        try:
+            await asyncio.wait_for(stopping.wait(), backoff)
+        except asyncio.TimeoutError:
+            pass
+        backoff = min(backoff * 2, args.max_backoff)
+
+def print_status(children):
+    print(f"\n{'server':<20}{'status':<10}{'pid':>8}{'startup s':>11}{'restarts':>10}  last exit")
+    for child in children:
+        pid = child.process.pid if child.process and child.process.returncode is None else "-"
+        startup = f"{child.startup_seconds:.2f}" if child.startup_seconds is not None else "-"
+        print(f"{child.name:<20}{child.status:<10}{pid:>8}{startup:>11}{child.restarts:>10}  {child.last_exit or '-'}")
+    print()
+
+async def report_when_ready(children, started: float):
+    await asyncio.gather(*(child.ready.wait() for child in children))
+    print(f"[supervisor] All servers ready in {time.monotonic() - started:.2f}s. Press Ctrl+C to stop all.")
+    print_status(children)
+
+async def run_servers(args):
     print("Starting all MCP servers in streamable-http mode...\n")
-    
-    for name, path, port in SERVERS:
+
+    servers = SERVERS
+    if args.single_process:
+        # One interpreter hosts every MCP server on its usual port; only the gateway runs separately
+        servers = [("MCP Host", "mcp_host.py", None)] + [s for s in SERVERS if s[2] is None]
+
+    children = []
+    for name, path, port in servers:
         if not os.path.exists(path):
             print(f"Warning: {path} not found. Skipping {name}.")
             continue
-            
-        print(f"Launching {name} on port {port}...")
-        
-        # Use sys.executable to ensure we use the same python environment
-        cmd = [sys.executable, path]
-        
-        if port:
-            cmd.extend(["--transport", "streamable-http", "--port", str(port)])
-        
-        process = subprocess.Popen(cmd)
-        processes.append((process, name))
-        
-    print("\nAll servers launched. Press Ctrl+C to stop all.")
-    
-    # Keep the script running
-    while True:
-        time.sleep(1)
+        if path == "mcp_host.py":
+            children.append(Child(name, path, probe_ports=[p for _, _, p in SERVERS if p]))
+        else:
+            children.append(Child(name, path, port))
+        print(f"Launching {name}" + (f" on port {port}..." if port else "..."))
+
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stopping.set)
+    if hasattr(signal, "SIGUSR1"):
+        loop.add_signal_handler(signal.SIGUSR1, print_status, children)
+
+    started = time.monotonic()
+    async with httpx.AsyncClient(timeout=2.0) as client:
+        tasks = [asyncio.create_task(run_child(child, client, args, stopping)) for child in children]
+        reporter = asyncio.create_task(report_when_ready(children, started))
+        await stopping.wait()
+
+        print("\nShutting down all MCP servers...")
+        reporter.cancel()
+        await asyncio.gather(*tasks)
+        for child in children:
+            child.status = "stopping"
+        await asyncio.gather(*(stop_process(child.process, args.drain_timeout) for child in children))
+        for child in children:
+            child.status = "stopped"
+        print_status(children)
 
 if __name__ == "__main__":
-    run_servers()
+    parser = argparse.ArgumentParser(description="Run and supervise the MCP servers and the Telegram gateway.")
+    parser.add_argument("--single-process", action="store_true", help="Run all MCP servers in one process (mcp_host.py)")
+    parser.add_argument("--ready-timeout", type=float, default=30.0, help="Seconds a server may take to answer the MCP handshake")
+    parser.add_argument("--health-interval", type=float, default=15.0, help="Seconds between health probes of ready servers")
+    parser.add_argument("--drain-timeout", type=float, default=10.0, help="Seconds to wait for a graceful exit before killing")
+    parser.add_argument("--max-backoff", type=float, default=60.0, help="Longest delay between restarts of a crashing server")
+    asyncio.run(run_servers(parser.parse_args()))